@@ -0,0 +1,246 @@
+"""
+Ax_Metrics - Future results and thread executor for asynchronous work
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import sys
+import threading
+import Queue
+
+from axonchisel.metrics.foundation.ax.obj import AxObj
+
+
+# ----------------------------------------------------------------------------
+
+
+class AxFutureTimeout(Exception):
+    """Result of AxFuture not available within timeout."""
+    pass
+
+
+# ----------------------------------------------------------------------------
+
+
+class AxFuture(AxObj):
+    """
+    Result of asynchronous work, available now or later.
+
+    Loosely modeled on Python 3 concurrent.futures.Future, this allows
+    asynchronous plugins (e.g. using non-blocking I/O) and thread executors
+    to share a single contract.
+    Producer calls set_result() or set_exc_info() exactly once.
+    Consumers call result() to wait, or add_done_callback() to be called
+    back (from the producer's thread) when done.
+    """
+
+    def __init__(self):
+        self._lock      = threading.Lock()
+        self._done      = threading.Event()
+        self._result    = None
+        self._exc_info  = None
+        self._callbacks = list()
+
+
+    #
+    # Public Methods
+    #
+
+    def done(self):
+        """Check T/F if result (or error) is available."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait (up to timeout secs if not None) and return result,
+        re-raising error if work failed.
+        Raises AxFutureTimeout on timeout.
+        """
+        if not self._done.wait(timeout) and not self._done.is_set():
+            raise AxFutureTimeout("{0} not done in {1}s".format(self, timeout))
+        if self._exc_info is not None:
+            (etype, evalue, etb) = self._exc_info
+            raise etype, evalue, etb
+        return self._result
+
+    def set_result(self, result):
+        """Complete with result value."""
+        self._result = result
+        self._complete()
+
+    def set_exc_info(self, exc_info):
+        """Complete with error as sys.exc_info() tuple."""
+        self._exc_info = exc_info
+        self._complete()
+
+    def add_done_callback(self, fn):
+        """
+        Call fn(future) when done, or immediately if already done.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def then(self, func):
+        """
+        Return new AxFuture with result func(result) once this is done,
+        or same error if this failed (or func raises).
+        """
+        future2 = AxFuture()
+        def _chain(future):
+            try:
+                future2.set_result(func(future.result()))
+            except:
+                future2.set_exc_info(sys.exc_info())
+        self.add_done_callback(_chain)
+        return future2
+
+    @classmethod
+    def from_result(cls, result):
+        """Return new AxFuture already done with result."""
+        future = cls()
+        future.set_result(result)
+        return future
+
+    @classmethod
+    def gather(cls, futures):
+        """
+        Return new AxFuture with list of results of list of futures,
+        in same order, once all are done, or the first error (in order)
+        if any failed.
+        """
+        futures = list(futures)
+        future2 = cls()
+        if not futures:
+            future2.set_result([])
+            return future2
+        remaining = [len(futures)]
+        lock = threading.Lock()
+        def _one_done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                future2.set_result([f.result() for f in futures])
+            except:
+                future2.set_exc_info(sys.exc_info())
+        for future in futures:
+            future.add_done_callback(_one_done)
+        return future2
+
+
+    #
+    # Internal Methods
+    #
+
+    def _complete(self):
+        """Mark done and invoke callbacks."""
+        with self._lock:
+            if self._done.is_set():
+                raise ValueError("{0} already completed".format(self))
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = list()
+        for fn in callbacks:
+            fn(self)
+
+    def __unicode__(self):
+        return (u"AxFuture({state})"
+        ).format(state="done" if self.done() else "pending")
+
+
+# ----------------------------------------------------------------------------
+
+
+class AxThreadExecutor(AxObj):
+    """
+    Executes submitted callables in up to max_workers worker threads,
+    returning AxFutures.
+
+    Useful to adapt blocking work onto the AxFuture contract while
+    bounding its concurrency.
+    Worker threads are started as needed (up to max_workers),
+    and stopped by shutdown().
+    """
+
+    def __init__(self, max_workers=1, name='ax-executor'):
+        self._name        = name
+        self._assert_type_int("max_workers", max_workers)
+        if max_workers < 1:
+            raise ValueError("{self} max_workers must be >= 1: {val}"
+                .format(self=self, val=max_workers))
+        self._max_workers = max_workers
+        self._lock        = threading.Lock()
+        self._queue       = Queue.Queue()
+        self._threads     = list()
+        self._shutdown    = False
+
+
+    #
+    # Public Methods
+    #
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Schedule func(*args, **kwargs) and return AxFuture of its result.
+        """
+        future = AxFuture()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("{self} already shut down"
+                    .format(self=self))
+            self._queue.put((future, func, args, kwargs))
+            if len(self._threads) < self._max_workers:
+                thread = threading.Thread(target=self._worker,
+                    name="%s-%d" % (self._name, len(self._threads)))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Stop worker threads once all submitted work is done,
+        optionally waiting for them.
+        """
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+            for thread in threads:
+                self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+    #
+    # Internal Methods
+    #
+
+    def _worker(self):
+        """Worker thread main loop."""
+        while True:
+            work = self._queue.get()
+            if work is None:
+                return
+            (future, func, args, kwargs) = work
+            try:
+                result = func(*args, **kwargs)
+            except:
+                future.set_exc_info(sys.exc_info())
+            else:
+                future.set_result(result)
+
+    def __unicode__(self):
+        return (u"AxThreadExecutor('{self._name}')"
+        ).format(self=self)
+
@@ -17,9 +17,51 @@ from datetime import datetime
 # ----------------------------------------------------------------------------
 
 
-class AxObj(object):
+# Validation levels allowed (see set_validation_level):
+VALIDATION_LEVELS = {
+    'FULL': {},      # validate everything, every time (default)
+    'BOUNDARY': {},  # validate input once, trust internal objects after
+}
+
+# Internal: current process-wide validation level
+_validation_level = 'FULL'
+
+
+def set_validation_level(level):
     """
-    Base class for Ax_Metrics classes.
+    Set process-wide validation level from VALIDATION_LEVELS.
+
+    FULL (the default) validates everything every time, as appropriate
+    for untrusted input.  BOUNDARY still validates input at creation
+    (e.g. parsing, property setters, EMFetcher results), but skips the
+    repeated per-step checks on objects produced internally, e.g. steps
+    from Stepper (FrozenTimeRange) as they pass through MQEngine,
+    EMFetchers and DataSeries.  Recommended for production once
+    configuration is known good.
+    """
+    global _validation_level
+    if level not in VALIDATION_LEVELS:
+        raise ValueError("Validation level not valid: {0}".format(level))
+    _validation_level = level
+
+def get_validation_level():
+    """Return process-wide validation level from VALIDATION_LEVELS."""
+    return _validation_level
+
+def is_validation_full():
+    """Check T/F if process-wide validation level is FULL."""
+    return _validation_level == 'FULL'
+
+
+# ----------------------------------------------------------------------------
+
+
+class AxSlotsObj(object):
+    """
+    Base class for lightweight Ax_Metrics classes declaring __slots__
+    (e.g. TimeRange, DataPoint), providing all AxObj support methods
+    without a per-instance __dict__.
+    Most classes should extend AxObj instead.
 
     Assertion Usage Note:
     Failures in the _assert_* methods typically include {self} within
@@ -30,6 +72,8 @@ class AxObj(object):
     format the message!
     """
 
+    __slots__ = ()
+
     #
     # Internal Methods: Init
     #
@@ -178,3 +222,14 @@ class AxObj(object):
         return self._get_debug_name()
 
 
+# ----------------------------------------------------------------------------
+
+
+class AxObj(AxSlotsObj):
+    """
+    Base class for Ax_Metrics classes.
+    See AxSlotsObj for support methods and usage notes.
+    """
+    pass
+
+
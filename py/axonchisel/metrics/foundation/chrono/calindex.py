@@ -0,0 +1,286 @@
+"""
+Ax_Metrics - Calendar index of period boundaries for fast calendar math
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import bisect
+import threading
+from datetime import date, datetime, timedelta
+
+from axonchisel.metrics.foundation.ax.obj import AxObj
+
+from . import dtmath
+
+
+# ----------------------------------------------------------------------------
+
+
+# Calendar units indexed, mapped to (dtmath begin_* fn, dtmath add_* fn)
+UNITS = {
+    'WEEK':     (dtmath.begin_week,    dtmath.add_weeks),
+    'MONTH':    (dtmath.begin_month,   dtmath.add_months),
+    'QUARTER':  (dtmath.begin_quarter, dtmath.add_quarters),
+    'YEAR':     (dtmath.begin_year,    dtmath.add_years),
+}
+
+# Years to extend index beyond a year looked up (both directions)
+EXTEND_YEARS = 16
+
+# Range of years indexed (others fall back to dtmath)
+MIN_YEAR = 2
+MAX_YEAR = 9998
+
+# Internal: proleptic Gregorian ordinal of epoch date
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Internal: map from calendar unit to max days per period
+_DAYS_BY_UNIT = {'WEEK': 7, 'MONTH': 31, 'QUARTER': 92, 'YEAR': 366}
+
+# Internal: map (unit, day0_sunday_ofs) to shared CalendarIndex
+_indexes = dict()
+_indexes_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------------
+
+
+def get_index(unit, day0_sunday_ofs=0):
+    """
+    Return shared CalendarIndex for calendar unit (and, for WEEK,
+    first day of week as offset from Sunday, see dtmath.begin_week).
+    """
+    day0_sunday_ofs = (day0_sunday_ofs % 7) if (unit == 'WEEK') else 0
+    key = (unit, day0_sunday_ofs)
+    with _indexes_lock:
+        calidx = _indexes.get(key)
+        if calidx is None:
+            calidx = _indexes[key] = CalendarIndex(unit, day0_sunday_ofs)
+        return calidx
+
+def add_years(dt, delta):
+    """
+    Return datetime offset by +/- delta years, as dtmath.add_years,
+    via MONTH index (so dt need only be month aligned to benefit).
+    """
+    return get_index('MONTH').add(dt, 12 * delta)
+
+
+# ----------------------------------------------------------------------------
+
+
+class CalendarIndex(AxObj):
+    """
+    Sorted table of period boundaries of a calendar unit (WEEK, MONTH,
+    QUARTER, YEAR), as int seconds since epoch of naive (wall clock)
+    datetimes, lazily extended to cover years as they are looked up.
+
+    Rounding (begin) is then a binary search, and adding periods
+    to an aligned datetime (add) is an index offset, with results
+    identical to the equivalent dtmath functions (used as fallback for
+    unaligned datetimes and years out of range).
+    Aware datetimes are treated by wall clock time, as dtmath does.
+
+    Thread-safe, so generally shared via get_index().
+    """
+
+    def __init__(self, unit, day0_sunday_ofs=0):
+        """
+        Initialize (empty) for calendar unit and, for WEEK,
+        first day of week as offset from Sunday.
+        """
+        # Set valid default state:
+        self._unit            = 'MONTH'
+        self._day0_sunday_ofs = 0
+        self._lock            = threading.Lock()
+        self._table           = (0, 0, list())  # (year0, year1, secs list)
+
+        # Apply initial values from args:
+        self._assert_type_string("unit", unit)
+        self._assert_value("unit", unit, UNITS)
+        self._assert_type_int("day0_sunday_ofs", day0_sunday_ofs)
+        self._unit            = unit
+        self._day0_sunday_ofs = day0_sunday_ofs
+        (self._fn_begin, self._fn_add) = UNITS[unit]
+
+
+    #
+    # Public Methods
+    #
+
+    def begin(self, dt):
+        """Return datetime marking beginning of period containing dt."""
+        secs = self._secs(dt)
+        table = self._covering(dt.year, secs)[2]
+        if table is None:
+            return self._dtmath_begin(dt)
+        idx = bisect.bisect_right(table, secs) - 1
+        return self._datetime(table[idx], dt.tzinfo)
+
+    def add(self, dt, delta):
+        """Return datetime offset by +/- delta periods."""
+        secs = self._secs(dt)
+        state = self._covering(dt.year, secs)
+        table = state[2]
+        if table is None or dt.microsecond:
+            return self._fn_add(dt, delta)
+        idx = bisect.bisect_left(table, secs)
+        if table[idx] != secs:
+            return self._fn_add(dt, delta)   # (not aligned)
+        if not (0 <= idx + delta < len(table)):
+            (idx, table) = self._extended_for(idx, delta, state)
+            if table is None:
+                return self._fn_add(dt, delta)
+        return self._datetime(table[idx + delta], dt.tzinfo)
+
+    def bounds_usec(self, dt_begin, dt_end):
+        """
+        Return list of int epoch usecs (see dtmath.to_epoch_usec) of
+        period boundaries from aligned naive dt_begin through the first
+        at or after dt_end, or empty list if dt_begin >= dt_end.
+        Return None if unsupported (unaligned, aware, or out of range).
+        """
+        if dt_begin.tzinfo is not None or dt_end.tzinfo is not None:
+            return None
+        if dt_begin >= dt_end:
+            return list()
+        if dt_begin.microsecond:
+            return None
+        secs_begin = self._secs(dt_begin)
+        secs_end   = self._secs(dt_end) + (1 if dt_end.microsecond else 0)
+        self._covering(dt_begin.year, secs_begin)
+        table = self._covering(dt_end.year, secs_end)[2]
+        if table is None or not (table[0] <= secs_begin):
+            return None
+        idx_begin = bisect.bisect_left(table, secs_begin)
+        if table[idx_begin] != secs_begin:
+            return None   # (not aligned)
+        idx_end = bisect.bisect_left(table, secs_end)
+        return [secs * 1000000 for secs in table[idx_begin:idx_end+1]]
+
+
+    #
+    # Public Properties
+    #
+
+    @property
+    def unit(self):
+        """Calendar unit indexed (read-only)."""
+        return self._unit
+
+    @property
+    def day0_sunday_ofs(self):
+        """First day of WEEK as offset from Sunday (read-only)."""
+        return self._day0_sunday_ofs
+
+
+    #
+    # Internal Methods
+    #
+
+    def _dtmath_begin(self, dt):
+        """Return dtmath begin of period containing dt."""
+        if self._unit == 'WEEK':
+            return self._fn_begin(dt, day0_sunday_ofs=self._day0_sunday_ofs)
+        return self._fn_begin(dt)
+
+    def _covering(self, year, secs):
+        """
+        Return tuple (year0, year1, table) with table covering secs
+        (within year), extending if needed,
+        or (None, None, None) if year out of range.
+        """
+        state = self._table
+        table = state[2]
+        if table and (table[0] <= secs < table[-1]):
+            return state
+        if not (MIN_YEAR <= year <= MAX_YEAR):
+            return (None, None, None)
+        return self._extend(year, year + 1)
+
+    def _extended_for(self, idx, delta, state):
+        """
+        Return tuple (idx, table) with table of state extended to cover
+        idx + delta, and idx adjusted to it, or (None, None) if out of range.
+        """
+        (year0, year1, table) = state
+        years = abs(delta) * _DAYS_BY_UNIT[self._unit] / 365 + 1
+        if delta < 0:
+            year0 -= years
+        else:
+            year1 += years
+        if year0 < MIN_YEAR or year1 > MAX_YEAR:
+            return (None, None)
+        table2 = self._extend(year0, year1)[2]
+        idx += bisect.bisect_left(table2, table[0])
+        if not (0 <= idx + delta < len(table2)):
+            return (None, None)
+        return (idx, table2)
+
+    def _extend(self, year0, year1):
+        """
+        Extend table (rebuilding under lock) to cover at least year0
+        through year1 (exclusive) plus EXTEND_YEARS margin.
+        Return new state tuple (year0, year1, table).
+        """
+        with self._lock:
+            (cur0, cur1, table) = self._table
+            if table and cur0 <= year0 and year1 <= cur1:
+                return self._table
+            year0 = max(MIN_YEAR, year0 - EXTEND_YEARS)
+            year1 = min(MAX_YEAR, year1 + EXTEND_YEARS)
+            if table:
+                (year0, year1) = (min(year0, cur0), max(year1, cur1))
+            self._table = (year0, year1, self._boundaries(year0, year1))
+            return self._table
+
+    def _boundaries(self, year0, year1):
+        """
+        Return sorted list of epoch secs of all period boundaries
+        from the beginning of year0 through the first at or after
+        the beginning of year1.
+        """
+        if self._unit == 'WEEK':
+            first = self._dtmath_begin(datetime(year0, 1, 1)).toordinal()
+            last = date(year1, 1, 1).toordinal() + 6
+            return [(ordinal - _EPOCH_ORDINAL) * 86400
+                for ordinal in xrange(first, last + 1, 7)]
+        months = {'MONTH': 1, 'QUARTER': 3, 'YEAR': 12}[self._unit]
+        table = [(date(year, month, 1).toordinal() - _EPOCH_ORDINAL) * 86400
+            for year in xrange(year0, year1)
+            for month in xrange(1, 13, months)]
+        table.append((date(year1, 1, 1).toordinal() - _EPOCH_ORDINAL) * 86400)
+        return table
+
+    @staticmethod
+    def _secs(dt):
+        """Return int epoch secs of wall clock time (floor) of dt."""
+        return ((dt.toordinal() - _EPOCH_ORDINAL) * 86400 +
+            dt.hour * 3600 + dt.minute * 60 + dt.second)
+
+    @staticmethod
+    def _datetime(secs, tzinfo=None):
+        """Return datetime for epoch secs, with optional tzinfo."""
+        dt = dtmath.EPOCH + timedelta(seconds=secs)
+        if tzinfo is not None:
+            dt = dt.replace(tzinfo=tzinfo)
+        return dt
+
+    def __unicode__(self):
+        return (u"CalendarIndex({self._unit}"
+            u"{ofs}, {count} boundaries)"
+            ).format(self=self, count=len(self._table[2]),
+                ofs=(" from %+d" % self._day0_sunday_ofs
+                    if self._unit == 'WEEK' else ""))
+
+
+# ----------------------------------------------------------------------------
+
+
+# (See test suite in axonchisel.metrics.tests.test_dtmath)
@@ -10,6 +10,8 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
+import array
+import calendar
 from datetime import datetime, timedelta
 
 
@@ -133,26 +135,27 @@ def begin_second(dt):
 
 
 def add_years(dt, delta):
-    """Return datetime offset by +/- delta years."""
-    val = dt.year + delta
-    return dt.replace(year=val)
+    """
+    Return datetime offset by +/- delta years.
+    Feb 29 becomes Feb 28 in non-leap years.
+    """
+    return add_months(dt, delta * 12)
 
 def add_quarters(dt, delta):
     """Return datetime offset by +/- delta quarters."""
     return add_months(dt, delta * 3)
 
 def add_months(dt, delta):
-    """Return datetime offset by +/- delta months."""
-    val = dt.month + delta
-    if val > 12:
-        carry = (val - 1) / 12
-        val -= (carry * 12)
-        dt = add_years(dt, carry)
-    if val <= 0:
-        borrow = -((val - 1) / 12)
-        val += (borrow * 12)
-        dt = add_years(dt, -borrow)
-    return dt.replace(month=val)
+    """
+    Return datetime offset by +/- delta months.
+    Day is clamped to last day of resulting month, e.g. Jan 31 + 1 = Feb 28.
+    """
+    (year, month0) = divmod(dt.year * 12 + (dt.month - 1) + delta, 12)
+    month = month0 + 1
+    day = dt.day
+    if day > 28:
+        day = min(day, calendar.monthrange(year, month)[1])
+    return dt.replace(year=year, month=month, day=day)
 
 def add_weeks(dt, delta):
     """Return datetime offset by +/- delta weeks."""
@@ -198,5 +201,33 @@ def add_microseconds(dt, delta):
 # ----------------------------------------------------------------------------
 
 
+# Naive datetime of epoch (time_t 0) for epoch conversions
+EPOCH = datetime(1970, 1, 1)
+
+# Array typecode for int64 epoch microseconds.
+# ('l' is 64 bits on LP64 platforms, else fall back to double,
+# exact for epoch microseconds within +/- 285 years.)
+EPOCH_USEC_TYPECODE = 'l' if array.array('l').itemsize >= 8 else 'd'
+
+def to_epoch_usec(dt):
+    """
+    Return int microseconds since epoch for datetime.
+    Naive datetimes are taken as-is (i.e. as UTC), so conversion is
+    exact and reversible (see from_epoch_usec) regardless of DST.
+    Aware datetimes are converted to UTC first.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def from_epoch_usec(usec):
+    """Return naive datetime for int microseconds since epoch."""
+    return EPOCH + timedelta(microseconds=usec)
+
+
+# ----------------------------------------------------------------------------
+
+
 # (See test suite in axonchisel.metrics.tests.test_dtmath)
 
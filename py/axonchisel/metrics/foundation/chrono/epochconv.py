@@ -0,0 +1,224 @@
+"""
+Ax_Metrics - Fast datetime to epoch (time_t) conversion by timezone
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import bisect
+import calendar
+import re
+import threading
+import time
+from datetime import date
+
+from axonchisel.metrics.foundation.ax.obj import AxObj
+
+from . import dtmath
+
+
+# ----------------------------------------------------------------------------
+
+
+# Timezone names for UTC (others are "+HH:MM" fixed offsets, or None=local)
+UTC_NAMES = {
+    'UTC': {},
+    'GMT': {},
+    'Z': {},
+}
+
+# Seconds between probes when searching local time for UTC offset
+# transitions (so assumes transitions at least this far apart)
+PROBE_SECS = 7 * 86400
+
+# Max seconds to search local time for UTC offset transitions each way
+SEARCH_SECS = 400 * 86400
+
+# Internal: proleptic Gregorian ordinal of epoch date
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Internal: regexp for fixed offset timezone, e.g. "+05:30", "-0800", "+01"
+_RE_FIXED_OFFSET = re.compile(r'^([+-])(\d\d):?(\d\d)?$')
+
+# Internal: map timezone to shared EpochConverter
+_converters = dict()
+_converters_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------------
+
+
+def get_converter(timezone=None):
+    """
+    Return shared EpochConverter for timezone (see EpochConverter).
+    """
+    with _converters_lock:
+        conv = _converters.get(timezone)
+        if conv is None:
+            conv = _converters[timezone] = EpochConverter(timezone)
+        return conv
+
+
+# ----------------------------------------------------------------------------
+
+
+class EpochConverter(AxObj):
+    """
+    Converts datetimes to int epoch seconds (time_t) with pure arithmetic,
+    interpreting naive datetimes as wall clock time in a timezone:
+      - None: server local time (as time.mktime does),
+      - "UTC" (or "GMT", "Z"),
+      - fixed offset from UTC, e.g. "+05:30", "-0800".
+    Aware datetimes are converted exactly regardless of timezone.
+
+    For local time, UTC offsets are found with time.mktime/localtime
+    once per DST segment (period between offset transitions) and cached,
+    so converting many datetimes (e.g. all steps of a query) rarely calls
+    into the C library.
+    Wall times skipped or repeated by a transition are passed to
+    time.mktime every time, so results always match it.
+
+    Thread-safe, so generally shared via get_converter().
+    """
+
+    def __init__(self, timezone=None):
+        """
+        Initialize for timezone (None = server local time).
+        """
+        # Set valid default state:
+        self._timezone = None
+        self._offset   = None    # fixed offset secs (None = local)
+        self._lock     = threading.Lock()
+        self._segments = (list(), list(), list())  # (wall lo, wall hi, ofs)
+
+        # Apply initial values from args:
+        if timezone is not None:
+            self._assert_type_string("timezone", timezone)
+            self._offset = self._parse_fixed_offset(timezone)
+        self._timezone = timezone
+
+
+    #
+    # Public Methods
+    #
+
+    def to_time_t(self, dt):
+        """Return int epoch seconds (time_t) for datetime."""
+        if dt.tzinfo is not None:
+            return dtmath.to_epoch_usec(dt) // 1000000
+        wall = ((dt.toordinal() - _EPOCH_ORDINAL) * 86400 +
+            dt.hour * 3600 + dt.minute * 60 + dt.second)
+        if self._offset is not None:
+            return wall - self._offset
+        (los, his, offsets) = self._segments
+        idx = bisect.bisect_right(los, wall) - 1
+        if idx >= 0 and wall < his[idx]:
+            return wall - offsets[idx]
+        return self._local_miss(dt, wall)
+
+    def to_time_t_list(self, dts):
+        """
+        Return list of int epoch seconds (time_t) for sequence of
+        datetimes (None = None), in same order.
+        """
+        to_time_t = self.to_time_t
+        return [None if dt is None else to_time_t(dt) for dt in dts]
+
+
+    #
+    # Public Properties
+    #
+
+    @property
+    def timezone(self):
+        """Timezone naive datetimes are in (None = local) (read-only)."""
+        return self._timezone
+
+
+    #
+    # Internal Methods
+    #
+
+    def _parse_fixed_offset(self, timezone):
+        """Return int offset secs east of UTC for timezone str."""
+        if timezone in UTC_NAMES:
+            return 0
+        m = _RE_FIXED_OFFSET.match(timezone)
+        if not m or int(m.group(3) or 0) >= 60:
+            raise ValueError("{self} timezone unknown: '{val}'"
+                .format(self=self, val=timezone))
+        secs = int(m.group(2)) * 3600 + int(m.group(3) or 0) * 60
+        return -secs if m.group(1) == '-' else secs
+
+    def _local_miss(self, dt, wall):
+        """
+        Return time_t for local wall time not cached (via time.mktime),
+        and cache the DST segment containing it.
+        """
+        t = int(time.mktime(dt.timetuple()))
+        self._add_segment(t)
+        return t
+
+    def _add_segment(self, t):
+        """Find and cache DST segment containing UTC time_t t."""
+        offset = self._local_offset(t)
+        (lo, prev_offset) = self._find_transition(t, offset, -1)
+        (hi, next_offset) = self._find_transition(t, offset, +1)
+        wall_lo = lo + max(offset, prev_offset)
+        wall_hi = hi + min(offset, next_offset)
+        with self._lock:
+            (los, his, offsets) = [list(l) for l in self._segments]
+            idx = bisect.bisect_right(los, wall_lo)
+            if idx and (los[idx-1], his[idx-1]) == (wall_lo, wall_hi):
+                return   # (already cached, e.g. by another thread)
+            los.insert(idx, wall_lo)
+            his.insert(idx, wall_hi)
+            offsets.insert(idx, offset)
+            self._segments = (los, his, offsets)
+
+    def _find_transition(self, t, offset, direction):
+        """
+        Search from UTC time_t t (with offset) in direction (+1/-1) for
+        nearest UTC offset transition, returning tuple (edge, offset2):
+        edge is the first (+1) or last (-1) time_t with offset, exclusive
+        (+1) or inclusive (-1), and offset2 the offset beyond it.
+        If none within SEARCH_SECS, returns that far with same offset.
+        """
+        same = t
+        for probe in xrange(t + direction * PROBE_SECS,
+                t + direction * (SEARCH_SECS + 1), direction * PROBE_SECS):
+            offset2 = self._local_offset(probe)
+            if offset2 != offset:
+                break
+            same = probe
+        else:
+            return (same + (1 if direction > 0 else 0), offset)
+        # Binary search between same and probe for transition:
+        (a, b) = (same, probe)
+        while abs(b - a) > 1:
+            mid = (a + b) // 2
+            if self._local_offset(mid) == offset:
+                a = mid
+            else:
+                b = mid
+        return (max(a, b) if direction > 0 else min(a, b) + 1, offset2)
+
+    @staticmethod
+    def _local_offset(t):
+        """Return local UTC offset secs (east) at UTC time_t t."""
+        return calendar.timegm(time.localtime(t)) - t
+
+    def __unicode__(self):
+        return (u"EpochConverter({tz})"
+        ).format(tz=self._timezone or 'local')
+
+
+# ----------------------------------------------------------------------------
+
+
+# (See test suite in axonchisel.metrics.tests.test_dtmath)
@@ -14,6 +14,8 @@ from datetime import datetime
 
 from axonchisel.metrics.foundation.ax.obj import AxObj
 
+from .tztable import get_table
+
 
 # ----------------------------------------------------------------------------
 
@@ -96,6 +98,15 @@ class FrameSpec(AxObj):
             If specified, changes period calc to execute as if "now"
             was the datetime specified here.
 
+      - timezone:  (default = None)
+            If None (default), frames are computed in naive server local
+            time, and steps have naive datetimes.
+            If timezone id specified (e.g. 'America/New_York'), frames
+            are computed in that zone's wall clock time, and steps have
+            aware datetimes (see tztable.TZTable), so e.g. DST days are
+            23 or 25 hours long.  A naive reframe_dt is taken as wall
+            clock time in the zone.
+
       - accumulate: True/False  (default = False)
             If True, all steps have their beginning locked to the
             beginning of the overall frame, each growing in size.
@@ -138,6 +149,7 @@ class FrameSpec(AxObj):
         self.smooth_val  = 0
         self.mode        = 'CURRENT'
         self.reframe_dt  = None
+        self.timezone    = None
         self.accumulate  = False
         self.allow_overflow_begin = True
         self.allow_overflow_end   = False
@@ -149,6 +161,7 @@ class FrameSpec(AxObj):
             'smooth_unit', 'smooth_val',
             'mode',
             'reframe_dt',
+            'timezone',
             'accumulate',
             'allow_overflow_begin', 'allow_overflow_end',
         ])
@@ -164,6 +177,20 @@ class FrameSpec(AxObj):
     def is_smoothed(self):
         return self.smooth_val > 0
 
+    def key(self):
+        """
+        Return hashable canonical tuple of all properties, equal for
+        FrameSpecs producing the same steps, e.g. for use in dict keys.
+        Smoothing is canonicalized away when it has no effect
+        (no smooth_val, or overridden by accumulate).
+        """
+        smooth = (self.smooth_unit, self.smooth_val)
+        if self.accumulate or not self.is_smoothed():
+            smooth = (None, 0)
+        return (self.range_unit, self.range_val, self.gran_unit) + smooth + (
+            self.mode, self.reframe_dt, self.timezone, self.accumulate,
+            self.allow_overflow_begin, self.allow_overflow_end)
+
 
     #
     # Public Properties
@@ -237,6 +264,17 @@ class FrameSpec(AxObj):
             self._assert_type_datetime("reframe_dt", val)
         self._reframe_dt = val
 
+    @property
+    def timezone(self):
+        """Timezone id to frame in (e.g. 'America/New_York'), or None."""
+        return self._timezone
+    @timezone.setter
+    def timezone(self, val):
+        if val is not None:
+            self._assert_type_string("timezone", val)
+            get_table(val)   # (raises ValueError if unknown)
+        self._timezone = val
+
     @property
     def accumulate(self):
         """Lock all steps to beginnining time frame?"""
@@ -273,8 +311,10 @@ class FrameSpec(AxObj):
         return (u"FrameSpec(every {self.gran_unit} "+
             "for {self.range_val} {self.range_unit}s, "+
             "{self.mode}, reframe {self.reframe_dt}, "+
-            "smooth {smooth}, accum {accum})"
-            ).format(self=self, smooth=(
+            "smooth {smooth}, accum {accum}{tz})"
+            ).format(self=self, tz=(
+                ", tz {0}".format(self.timezone) if self.timezone else ""),
+                smooth=(
                 "{self.smooth_val} {self.smooth_unit}s".format(self=self)
                 ) if self.smooth_val else "None",
                 accum=("Y" if self.accumulate else "N"),
@@ -10,7 +10,7 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
-from axonchisel.metrics.foundation.ax.obj import AxObj
+from axonchisel.metrics.foundation.ax.obj import AxSlotsObj
 
 
 # ----------------------------------------------------------------------------
@@ -28,14 +28,18 @@ GHOST_TYPES = {
 # ----------------------------------------------------------------------------
 
 
-class Ghost(AxObj):
+class Ghost(AxSlotsObj):
     """
     Specification of relative "ghost" time.
 
     Usually used 
 
+    Ghosts compare equal when their types match.
+    As Ghosts are mutable they are not hashable; see FrozenGhost.
     """
-    
+
+    __slots__ = ('_gtype',)
+
     def __init__(self, gtype='PREV_PERIOD1'):
         """
         Initialize, optionally overriding any default properties with kwargs.
@@ -47,6 +51,15 @@ class Ghost(AxObj):
         self.gtype = gtype
 
 
+    #
+    # Public Methods
+    #
+
+    def frozen(self):
+        """Return new FrozenGhost copy of self."""
+        return FrozenGhost(self._gtype)
+
+
     #
     # Public Properties
     #
@@ -66,7 +79,84 @@ class Ghost(AxObj):
     # Internal Methods
     #
 
+    def __eq__(self, other):
+        if not isinstance(other, Ghost):
+            return NotImplemented
+        return self._gtype == other._gtype
+
+    def __ne__(self, other):
+        if not isinstance(other, Ghost):
+            return NotImplemented
+        return self._gtype != other._gtype
+
+    __hash__ = None   # (mutable)
+
     def __unicode__(self):
         return (u"Ghost({self.gtype})").format(self=self)
 
+    def __getstate__(self):
+        return self._gtype
+
+    def __setstate__(self, state):
+        self._gtype = state
+
+
+# ----------------------------------------------------------------------------
+
+
+class FrozenGhost(Ghost):
+    """
+    Immutable, hashable Ghost, suitable as a dict key (e.g. for caches).
+
+    Construct from a ghost type, or copy any Ghost with Ghost.frozen().
+
+    Attempting to set gtype raises AttributeError.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, gtype='PREV_PERIOD1'):
+        """
+        Initialize from ghost type, validating.
+        Raise TypeError, ValueError if invalid.
+        """
+        self._gtype = 'PREV_PERIOD1'
+        self._assert_type_string("gtype", gtype)
+        self._assert_value("gtype", gtype, GHOST_TYPES)
+        self._gtype = gtype
+
+
+    #
+    # Public Methods
+    #
+
+    def frozen(self):
+        """Return self, already frozen."""
+        return self
+
+
+    #
+    # Public Properties
+    #
+
+    # (Read-only override of Ghost property:)
+    gtype = property(Ghost.gtype.fget)
+
+
+    #
+    # Internal Methods
+    #
+
+    def __hash__(self):
+        return hash(self._gtype)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __unicode__(self):
+        return (u"FrozenGhost({self.gtype})").format(self=self)
+
 
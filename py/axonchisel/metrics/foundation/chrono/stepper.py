@@ -10,12 +10,16 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
+import array
+import threading
 from datetime import *
 
 from axonchisel.metrics.foundation.ax.obj import AxObj
 
 from . import dtmath
-from .timerange import TimeRange
+from . import calindex
+from . import tztable
+from .timerange import FrozenTimeRange
 from .framespec import FrameSpec
 from .ghost import Ghost
 
@@ -36,10 +40,10 @@ _ROUND_FUNC_BY_UNIT = {
     'MINUTE30': dtmath.begin_minute30,
     'HOUR':     dtmath.begin_hour,
     'DAY':      dtmath.begin_day,
-    'WEEK':     dtmath.begin_week,
-    'MONTH':    dtmath.begin_month,
-    'QUARTER':  dtmath.begin_quarter,
-    'YEAR':     dtmath.begin_year,
+    'WEEK':     calindex.get_index('WEEK', WEEK_FIRST_DAY).begin,
+    'MONTH':    calindex.get_index('MONTH').begin,
+    'QUARTER':  calindex.get_index('QUARTER').begin,
+    'YEAR':     calindex.get_index('YEAR').begin,
 }
 
 # Internal: map from FrameSpec UNIT to dtmath add_* function
@@ -52,10 +56,45 @@ _ADD_FUNC_BY_UNIT = {
     'MINUTE30': dtmath.add_minute30s,
     'HOUR':     dtmath.add_hours,
     'DAY':      dtmath.add_days,
-    'WEEK':     dtmath.add_weeks,
-    'MONTH':    dtmath.add_months,
-    'QUARTER':  dtmath.add_quarters,
-    'YEAR':     dtmath.add_years,
+    'WEEK':     calindex.get_index('WEEK', WEEK_FIRST_DAY).add,
+    'MONTH':    calindex.get_index('MONTH').add,
+    'QUARTER':  calindex.get_index('QUARTER').add,
+    'YEAR':     calindex.get_index('YEAR').add,
+}
+
+# Internal: map from calendar FrameSpec UNIT to CalendarIndex
+# (begin/add functions above use these too)
+_CALINDEX_BY_UNIT = {
+    'WEEK':     calindex.get_index('WEEK', WEEK_FIRST_DAY),
+    'MONTH':    calindex.get_index('MONTH'),
+    'QUARTER':  calindex.get_index('QUARTER'),
+    'YEAR':     calindex.get_index('YEAR'),
+}
+
+# Internal: FrameSpec UNITs stepped in elapsed time (not wall clock time)
+# when framing in a timezone
+_ELAPSED_UNITS = {
+    'SECOND': {},
+    'MINUTE': {},
+    'MINUTE5': {},
+    'MINUTE10': {},
+    'MINUTE15': {},
+    'MINUTE30': {},
+    'HOUR': {},
+}
+
+# Internal: map from fixed width FrameSpec UNIT to width in microseconds
+# (other units are calendar based, varying in width)
+_USEC_BY_UNIT = {
+    'SECOND':   1000000,
+    'MINUTE':   1000000 * 60,
+    'MINUTE5':  1000000 * 60 * 5,
+    'MINUTE10': 1000000 * 60 * 10,
+    'MINUTE15': 1000000 * 60 * 15,
+    'MINUTE30': 1000000 * 60 * 30,
+    'HOUR':     1000000 * 60 * 60,
+    'DAY':      1000000 * 60 * 60 * 24,
+    'WEEK':     1000000 * 60 * 60 * 24 * 7,
 }
 
 
@@ -97,7 +136,7 @@ class Stepper(AxObj):
         self._bind_dt_funcs()
         self._bind_dtinc_start()
         self._bind_dtexc_end()
-        tmrange = TimeRange(
+        tmrange = FrozenTimeRange.from_trusted(
             inc_begin=self._dtinc_start,
             exc_end=self._dtexc_end,
             anchor=self._dtwithin,
@@ -108,7 +147,8 @@ class Stepper(AxObj):
 
     def steps(self):
         """
-        Yield a series of TimeRange objects representing FrameSpec steps.
+        Yield a series of FrozenTimeRange objects representing FrameSpec
+        steps.
         Each TimeRange is the period over which the measurement point 
         should be queried, with its anchor representing the time label.
         """
@@ -143,8 +183,8 @@ class Stepper(AxObj):
                     if dtidx_inc_begin < self._dtinc_start:
                         dtidx_inc_begin = self._dtinc_start
 
-            # Construct and yield TimeRange:
-            tmrange = TimeRange(
+            # Construct and yield (immutable, hashable) TimeRange:
+            tmrange = FrozenTimeRange.from_trusted(
                 anchor    = dtidx_anchor,
                 inc_begin = dtidx_inc_begin,
                 exc_end   = dtidx_exc_end)
@@ -153,6 +193,63 @@ class Stepper(AxObj):
             # Advance to next step:
             dtidx = self._fn_addgran(dtidx, 1)
 
+    def steps_array(self):
+        """
+        Return tuple (anchors, inc_begins, exc_ends) of parallel arrays
+        of int epoch microseconds (see dtmath.to_epoch_usec) of all
+        FrameSpec steps, identical to those yielded by steps().
+
+        Computed in bulk without per-step TimeRanges: fixed width units
+        (SECOND..WEEK) as arithmetic progressions, calendar units (MONTH,
+        QUARTER, YEAR) sliced from the shared CalendarIndex tables.
+        Arrays use typecode dtmath.EPOCH_USEC_TYPECODE.
+        """
+
+        tmfrspec = self.tmfrspec
+
+        # Analyze parameters and bind data to self:
+        self.analyze()
+        start = self._dtinc_start
+
+        # Aware datetimes may vary in UTC offset, so step individually:
+        if start.tzinfo is not None:
+            return self._steps_array_from_steps()
+
+        # Calc anchors and (unclamped) step ends:
+        usec_start = dtmath.to_epoch_usec(start)
+        usec_end   = dtmath.to_epoch_usec(self._dtexc_end)
+        width = _USEC_BY_UNIT.get(tmfrspec.gran_unit)
+        if width is not None:
+            anchors = self._usec_array(xrange(usec_start, usec_end, width))
+            exc_ends = self._usec_array(
+                xrange(usec_start + width, usec_end + width, width))
+            del exc_ends[len(anchors):]
+        else:
+            bounds = self._usec_array(self._calendar_bounds())
+            anchors = bounds[:-1]
+            exc_ends = bounds[1:]
+
+        # Clamp last step end:
+        if not tmfrspec.allow_overflow_end and exc_ends:
+            if exc_ends[-1] > usec_end:
+                exc_ends[-1] = usec_end
+
+        # Calc step begins, applying optional smoothing, accumulation:
+        if tmfrspec.accumulate:
+            inc_begins = self._usec_array([usec_start]) * len(anchors)
+        else:
+            if tmfrspec.is_smoothed():
+                inc_begins = self._smooth_begins(exc_ends)
+            else:
+                inc_begins = self._usec_array(anchors)
+            if not tmfrspec.allow_overflow_begin:
+                for idx in xrange(len(inc_begins)):
+                    if inc_begins[idx] >= usec_start:
+                        break   # (begins increase, so rest are in range)
+                    inc_begins[idx] = usec_start
+
+        return (anchors, inc_begins, exc_ends)
+
 
     #
     # Public Properties
@@ -212,27 +309,59 @@ class Stepper(AxObj):
             raise _impl_error("FrameSpec smooth unit '{0}' missing smooth fn"
                 .format(tmfrspec.smooth_unit))
 
+        # In timezone, wrap all to operate on aware datetimes in zone:
+        fn_addyears = calindex.add_years
+        if tmfrspec.timezone is not None:
+            tzt = tztable.get_table(tmfrspec.timezone)
+            fn_round     = self._tz_func(tzt, fn_round)
+            fn_add       = self._tz_func(tzt, fn_add, tmfrspec.range_unit)
+            fn_addgran   = self._tz_func(tzt, fn_addgran, tmfrspec.gran_unit)
+            fn_addsmooth = self._tz_func(tzt, fn_addsmooth,
+                tmfrspec.smooth_unit)
+            fn_addyears  = self._tz_func(tzt, fn_addyears)
+
         # Bind:
         self._fn_round     = fn_round
         self._fn_add       = fn_add
         self._fn_addgran   = fn_addgran
         self._fn_addsmooth = fn_addsmooth
+        self._fn_addyears  = fn_addyears
+
+    @staticmethod
+    def _tz_func(tzt, fn, unit=None):
+        """
+        Return wrapper of dtmath style fn(dt, *args) operating instead on
+        aware datetimes in TZTable zone: for units in _ELAPSED_UNITS in
+        elapsed (UTC) time, else in zone wall clock time (e.g. rounding,
+        or adding DAYs, which may then be 23 or 25 hours).
+        """
+        if fn is None:
+            return None
+        if unit in _ELAPSED_UNITS:
+            def _fn_elapsed(dt, *args):
+                return tzt.fromutc(
+                    fn(dt.replace(tzinfo=None) - dt.utcoffset(), *args))
+            return _fn_elapsed
+        def _fn_wall(dt, *args):
+            return tzt.localize(fn(dt.replace(tzinfo=None), *args))
+        return _fn_wall
 
     def _bind_dtinc_start(self):
         """Bind to self: dtinc_start inclusive begin time and dtwithin."""
 
         tmfrspec = self.tmfrspec
 
-        # Choose raw unrounded context time, either now or explicit reframed:
+        # Choose raw unrounded context time, either now or explicit reframed,
+        # in timezone (if any):
         dtwithin = tmfrspec.reframe_dt
-        if dtwithin is None:
+        if tmfrspec.timezone is not None:
+            tzt = tztable.get_table(tmfrspec.timezone)
+            dtwithin = tzt.now() if dtwithin is None else tzt.convert(dtwithin)
+        elif dtwithin is None:
             dtwithin = datetime.now()
 
         # Round down dtwithin to range_unit:
-        if tmfrspec.range_unit == 'WEEK':
-            dtwithin = self._fn_round(dtwithin, day0_sunday_ofs=WEEK_FIRST_DAY)
-        else:
-            dtwithin = self._fn_round(dtwithin)
+        dtwithin = self._fn_round(dtwithin)
 
         # Rewind range_val range_units to find beginning of range we're in:
         dtinc_start = dtwithin
@@ -249,15 +378,61 @@ class Stepper(AxObj):
         elif self.is_ghost('PREV_PERIOD2'):
             dtinc_start = self._fn_add(dtinc_start, -2 * tmfrspec.range_val)
         elif self.is_ghost('PREV_YEAR1'):
-            dtinc_start = dtmath.add_years(dtinc_start, -1)
+            dtinc_start = self._fn_addyears(dtinc_start, -1)
         elif self.is_ghost('PREV_YEAR2'):
-            dtinc_start = dtmath.add_years(dtinc_start, -2)
+            dtinc_start = self._fn_addyears(dtinc_start, -2)
 
         # Bind:
         self._dtinc_start = dtinc_start
         self._dtwithin = dtwithin
 
 
+    def _calendar_bounds(self):
+        """
+        Return list of epoch usec step boundaries of analyzed frame:
+        each step's anchor, plus the last step's unclamped end.
+        Sliced from CalendarIndex when possible.
+        """
+        calidx = _CALINDEX_BY_UNIT.get(self.tmfrspec.gran_unit)
+        if calidx is not None:
+            bounds = calidx.bounds_usec(self._dtinc_start, self._dtexc_end)
+            if bounds is not None:
+                return bounds
+        bounds = [self._dtinc_start]
+        while bounds[-1] < self._dtexc_end:
+            bounds.append(self._fn_addgran(bounds[-1], 1))
+        if len(bounds) == 1:
+            return list()
+        return [dtmath.to_epoch_usec(dt) for dt in bounds]
+
+    def _smooth_begins(self, exc_ends):
+        """
+        Return array of smoothed step begin epoch usecs for array of
+        step end epoch usecs.
+        """
+        tmfrspec = self.tmfrspec
+        width = _USEC_BY_UNIT.get(tmfrspec.smooth_unit)
+        if width is not None:
+            smooth = width * tmfrspec.smooth_val
+            return self._usec_array(usec - smooth for usec in exc_ends)
+        return self._usec_array(dtmath.to_epoch_usec(self._fn_addsmooth(
+            dtmath.from_epoch_usec(usec), -tmfrspec.smooth_val))
+            for usec in exc_ends)
+
+    def _steps_array_from_steps(self):
+        """Return steps_array() result by converting steps()."""
+        arrays = (self._usec_array(), self._usec_array(), self._usec_array())
+        for tmrange in self.steps():
+            arrays[0].append(dtmath.to_epoch_usec(tmrange.anchor))
+            arrays[1].append(dtmath.to_epoch_usec(tmrange.inc_begin))
+            arrays[2].append(dtmath.to_epoch_usec(tmrange.exc_end))
+        return arrays
+
+    @staticmethod
+    def _usec_array(usecs=()):
+        """Return new epoch usec array from iterable."""
+        return array.array(dtmath.EPOCH_USEC_TYPECODE, usecs)
+
     def _bind_dtexc_end(self):
         """Bind to self: dtexc_end exclusive end time."""
 
@@ -273,5 +448,96 @@ class Stepper(AxObj):
         return (u"Stepper({self.tmfrspec} ghost {self.ghost}"
             ).format(self=self)
 
-            
+
+# ----------------------------------------------------------------------------
+
+
+class StepPlans(AxObj):
+    """
+    Memo of Stepper results (steps and analyze()), computed once per
+    pinned FrameSpec and Ghost and shared read-only thereafter, e.g. by
+    all series of all queries run together, and their EROuts.
+
+    Keyed by FrameSpec.key() and Ghost type, so only pinned FrameSpecs
+    (with reframe_dt) are memoized; unpinned ones depend on the current
+    time and so are computed fresh on every call.
+    Steps are returned as tuples of (immutable) FrozenTimeRanges.
+
+    Entries are never evicted, so a StepPlans is meant to be scoped to
+    a unit of work such as a Servant request.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self):
+        # Set valid default state:
+        self._lock   = threading.Lock()
+        self._plans  = dict()   # key: (steps tuple, analyze dict)
+        self.hits    = 0
+        self.misses  = 0
+
+
+    #
+    # Public Methods
+    #
+
+    def steps(self, tmfrspec, ghost=None):
+        """
+        Return tuple of FrozenTimeRange steps for FrameSpec and
+        optional Ghost, as Stepper.steps() would yield.
+        """
+        if tmfrspec.reframe_dt is None:
+            return tuple(Stepper(tmfrspec, ghost=ghost).steps())
+        return self._plan(tmfrspec, ghost)[0]
+
+    def analyze(self, tmfrspec, ghost=None):
+        """
+        Return new dict from Stepper.analyze() for FrameSpec and
+        optional Ghost.
+        """
+        if tmfrspec.reframe_dt is None:
+            return Stepper(tmfrspec, ghost=ghost).analyze()
+        return dict(self._plan(tmfrspec, ghost)[1])
+
+    def clear(self):
+        """Remove all entries (counters are kept)."""
+        with self._lock:
+            self._plans = dict()
+
+    def stats(self):
+        """Return dict of usage counters."""
+        return {
+            'hits':   self.hits,
+            'misses': self.misses,
+            'size':   len(self._plans),
+        }
+
+
+    #
+    # Internal Methods
+    #
+
+    def _plan(self, tmfrspec, ghost):
+        """
+        Return memoized tuple (steps tuple, analyze dict) for pinned
+        FrameSpec and optional Ghost, creating it if needed.
+        """
+        key = (tmfrspec.key(), ghost.gtype if ghost is not None else None)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self.hits += 1
+                return plan
+        plan = self._make_plan(tmfrspec, ghost)
+        with self._lock:
+            self.misses += 1
+            return self._plans.setdefault(key, plan)
+
+    def _make_plan(self, tmfrspec, ghost):
+        """Return new tuple (steps tuple, analyze dict) from Stepper."""
+        stepper = Stepper(tmfrspec, ghost=ghost)
+        return (tuple(stepper.steps()), stepper.analyze())
+
+    def __unicode__(self):
+        return (u"StepPlans({n} plans)").format(n=len(self._plans))
+
 
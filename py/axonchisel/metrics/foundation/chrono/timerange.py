@@ -12,7 +12,8 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 
 from datetime import datetime, timedelta
 
-from axonchisel.metrics.foundation.ax.obj import AxObj
+from axonchisel.metrics.foundation.ax.obj import \
+    AxSlotsObj, is_validation_full
 
 
 # ----------------------------------------------------------------------------
@@ -25,7 +26,7 @@ TIMERANGE_PRECISION = timedelta(microseconds=1)
 # ----------------------------------------------------------------------------
 
 
-class TimeRange(AxObj):
+class TimeRange(AxSlotsObj):
     """
     Single time range with beginning/end time to microsecond precision
     and optional anchor point.
@@ -46,8 +47,15 @@ class TimeRange(AxObj):
 
     TimeRange objects are initially invalid and require setting begin and end
     points before use.
+
+    TimeRanges compare equal when they match exactly, including anchor.
+    One is less (greater) than another only if it is entirely older (newer),
+    so overlapping TimeRanges are neither equal, less, nor greater.
+    As TimeRanges are mutable they are not hashable; see FrozenTimeRange.
     """
 
+    __slots__ = ('_anchor', '_inc_begin', '_exc_end')
+
     def __init__(self, **kwargs):
         """
         Initialize, optionally overriding any default properties with kwargs.
@@ -84,6 +92,15 @@ class TimeRange(AxObj):
         """
         return self.anchor is not None
 
+    def frozen(self):
+        """
+        Return new FrozenTimeRange copy of self.
+        Raise TypeError, ValueError if self is not valid.
+        """
+        self.validate()
+        return FrozenTimeRange.from_trusted(
+            self._inc_begin, self._exc_end, self._anchor)
+
     def validate(self):
         """
         Validate self.
@@ -167,23 +184,139 @@ class TimeRange(AxObj):
         )
 
 
-    # NOTE: Consider defining comparison operators like __lt__, __ge__, ...
-    # See https://docs.python.org/2/reference/datamodel.html#object.__lt__
-    # Semantics:
-    #   - less/greater than should indicate entire range is older/newer than.
-    #   - equal should indicate exact match including anchor point.
-    # Thus a TimeRange may be none of equal, less than, or greater than
-    # another TimeRange, and that's OK -- it means they overlap somewhere.
+    def __getstate__(self):
+        return self._key()
+
+    def __setstate__(self, state):
+        (self._anchor, self._inc_begin, self._exc_end) = state
 
+    def _key(self):
+        """Return tuple (anchor, inc_begin, exc_end) identifying value."""
+        return (self._anchor, self._inc_begin, self._exc_end)
 
+    def __eq__(self, other):
+        if not isinstance(other, TimeRange):
+            return NotImplemented
+        return self._key() == other._key()
 
+    def __ne__(self, other):
+        if not isinstance(other, TimeRange):
+            return NotImplemented
+        return self._key() != other._key()
 
+    def __lt__(self, other):
+        if not isinstance(other, TimeRange):
+            return NotImplemented
+        return self._exc_end <= other._inc_begin
 
+    def __gt__(self, other):
+        if not isinstance(other, TimeRange):
+            return NotImplemented
+        return self._inc_begin >= other._exc_end
 
+    def __le__(self, other):
+        if not isinstance(other, TimeRange):
+            return NotImplemented
+        return self.__lt__(other) or self.__eq__(other)
 
+    def __ge__(self, other):
+        if not isinstance(other, TimeRange):
+            return NotImplemented
+        return self.__gt__(other) or self.__eq__(other)
 
+    __hash__ = None   # (mutable)
 
 
+# ----------------------------------------------------------------------------
 
 
+class FrozenTimeRange(TimeRange):
+    """
+    Immutable, hashable TimeRange, suitable as a dict key (e.g. for caches).
+
+    Construct from the same kwargs as TimeRange (which must result in
+    a valid range), or copy any TimeRange with TimeRange.frozen().
+    Internal producers of already validated datetimes (e.g. Stepper)
+    may use the fast from_trusted() constructor instead.
+
+    Attempting to set any property raises AttributeError.
+
+    As they are valid by construction, validate() checks FrozenTimeRanges
+    again only at FULL validation level (see ax.obj.set_validation_level).
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        """
+        Initialize from TimeRange kwargs, validating.
+        Raise TypeError, ValueError if the resulting range is invalid.
+        """
+        tmrange = TimeRange(**kwargs)
+        tmrange.validate()
+        self._anchor    = tmrange._anchor
+        self._inc_begin = tmrange._inc_begin
+        self._exc_end   = tmrange._exc_end
+
+
+    #
+    # Public Methods
+    #
+
+    @classmethod
+    def from_trusted(cls, inc_begin, exc_end, anchor=None):
+        """
+        Return new instance from datetimes, without any validation.
+        Callers must pass datetimes (anchor may be None) forming a valid
+        range.
+        """
+        tmrange = cls.__new__(cls)
+        tmrange._anchor    = anchor
+        tmrange._inc_begin = inc_begin
+        tmrange._exc_end   = exc_end
+        return tmrange
 
+    def frozen(self):
+        """Return self, already frozen."""
+        return self
+
+    def validate(self):
+        """
+        Override from TimeRange -
+        Validate self, only at FULL validation level.
+        """
+        if is_validation_full():
+            TimeRange.validate(self)
+
+
+    #
+    # Public Properties
+    #
+
+    # (Read-only overrides of TimeRange properties:)
+    anchor    = property(TimeRange.anchor.fget)
+    inc_begin = property(TimeRange.inc_begin.fget)
+    exc_begin = property(TimeRange.exc_begin.fget)
+    inc_end   = property(TimeRange.inc_end.fget)
+    exc_end   = property(TimeRange.exc_end.fget)
+
+
+    #
+    # Internal Methods
+    #
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __unicode__(self):
+        return (u"FrozenTimeRange({dur} = [{begin}..{end}) anchor {anchor})"
+        ).format(
+            dur=self.duration, begin=self._inc_begin, end=self._exc_end,
+            anchor=self._anchor
+        )
@@ -0,0 +1,455 @@
+"""
+Ax_Metrics - Timezone UTC offset transition tables (from TZif zoneinfo)
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import bisect
+import calendar
+import os
+import re
+import struct
+import threading
+import time
+from datetime import date, datetime, timedelta, tzinfo
+
+from axonchisel.metrics.foundation.ax.obj import AxObj
+
+from . import dtmath
+from .epochconv import get_converter
+
+
+# ----------------------------------------------------------------------------
+
+
+# Directories searched for TZif zoneinfo files (after $TZDIR, if set)
+ZONEINFO_DIRS = [
+    '/usr/share/zoneinfo',
+    '/usr/lib/zoneinfo',
+    '/usr/share/lib/zoneinfo',
+    '/etc/zoneinfo',
+]
+
+# Zone ids usable even without zoneinfo files
+BUILTIN_UTC_IDS = {
+    'UTC': {},
+    'Etc/UTC': {},
+}
+
+# Years to extend rule-based transitions beyond a year looked up
+EXTEND_YEARS = 16
+
+# Internal: valid zone id (also preventing paths outside zoneinfo dirs)
+_RE_ZONE_ID = re.compile(r'^[A-Za-z0-9_+\-]+(/[A-Za-z0-9_+\-]+)*$')
+
+# Internal: POSIX TZ string offset or time, e.g. "8", "-3:30", "+25"
+_POSIX_OFS = r'[+-]?\d{1,3}(?::\d\d){0,2}'
+
+# Internal: POSIX TZ string (from TZif footer), e.g. "PST8PDT,M3.2.0,M11.1.0"
+_RE_POSIX_TZ = re.compile(
+    r'^(?P<std><[^>]+>|[A-Za-z]{3,})(?P<stdoff>' + _POSIX_OFS + ')'
+    r'(?:(?P<dst><[^>]+>|[A-Za-z]{3,})(?P<dstoff>' + _POSIX_OFS + ')?'
+    r',(?P<start>[^,/]+)(?:/(?P<starttime>' + _POSIX_OFS + '))?'
+    r',(?P<end>[^,/]+)(?:/(?P<endtime>' + _POSIX_OFS + '))?)?$')
+
+# Internal: POSIX TZ string rule date, e.g. "M3.2.0", "J60", "59"
+_RE_POSIX_RULE = re.compile(r'^(?:M(\d+)\.(\d)\.(\d)|J(\d+)|(\d+))$')
+
+# Internal: proleptic Gregorian ordinal of epoch date
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Internal: map zone id to shared TZTable
+_tables = dict()
+_tables_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------------
+
+
+def get_table(zone_id):
+    """
+    Return shared TZTable for zone id (e.g. 'America/Los_Angeles'),
+    loaded on first use.
+    Raise ValueError if unknown or invalid.
+    """
+    with _tables_lock:
+        table = _tables.get(zone_id)
+        if table is None:
+            table = _tables[zone_id] = TZTable(zone_id)
+        return table
+
+
+# ----------------------------------------------------------------------------
+
+
+class TZOffset(tzinfo):
+    """
+    Fixed UTC offset tzinfo of datetimes produced by a TZTable,
+    for one local time type (offset, abbreviation, DST flag) of its zone.
+
+    Aware datetimes in a zone thus carry the offset in effect at that
+    moment, so comparisons and differences are exact across transitions
+    (e.g. a DST day is 23 or 25 hours long).
+    """
+
+    def __init__(self, offset, abbr, isdst, zone_id):
+        """Init with offset (int secs east of UTC), abbr str, isdst bool."""
+        self.offset  = offset
+        self.abbr    = abbr
+        self.isdst   = isdst
+        self.zone_id = zone_id
+        self._td     = timedelta(seconds=offset)
+
+    def utcoffset(self, dt):
+        return self._td
+
+    def dst(self, dt):
+        return None   # (DST adjustment unknown, only isdst)
+
+    def tzname(self, dt):
+        return self.abbr
+
+    @property
+    def tztable(self):
+        """Shared TZTable of zone (get only)."""
+        return get_table(self.zone_id)
+
+    def __getinitargs__(self):
+        return (self.offset, self.abbr, self.isdst, self.zone_id)
+
+    def __repr__(self):
+        return "TZOffset(%d, %r, %r, %r)" % self.__getinitargs__()
+
+
+# ----------------------------------------------------------------------------
+
+
+class TZTable(AxObj):
+    """
+    Precomputed table of UTC offset transitions of a timezone,
+    parsed from its TZif zoneinfo file, for converting between
+    UTC and local wall clock time with binary searches only
+    (no per-datetime timezone library calls).
+
+    Transitions beyond those listed in the file are generated from its
+    POSIX TZ rule footer, lazily extended to cover years as they are
+    looked up.
+    Aware datetimes produced have TZOffset tzinfo.
+
+    Thread-safe, so generally shared via get_table().
+    """
+
+    def __init__(self, zone_id, data=None):
+        """
+        Initialize for zone id, loading its TZif zoneinfo file,
+        or parsing optional TZif data str instead.
+        Raise ValueError if unknown or invalid.
+        """
+        # Set valid default state:
+        self._zone_id  = None
+        self._lock     = threading.Lock()
+        self._infos    = dict()   # (offset, abbr, isdst): TZOffset
+        self._initial  = None     # TZOffset before first transition
+        self._rule     = None     # (std TZOffset, dst TZOffset, start, end)
+        self._rule_year = None    # last year of rule transitions generated
+        # (utc secs, wall secs by offset before, TZOffset after) lists:
+        self._state    = (list(), list(), list())
+
+        # Load:
+        self._assert_type_string("zone_id", zone_id)
+        self._zone_id = zone_id
+        if data is None:
+            data = self._load(zone_id)
+        if data is None:
+            self._initial = self._info(0, 'UTC', False)
+        else:
+            self._parse(data)
+
+
+    #
+    # Public Methods
+    #
+
+    def utcoffset_at(self, secs):
+        """Return int UTC offset secs east in effect at epoch secs."""
+        return self._info_at_utc(int(secs // 1)).offset
+
+    def fromutc_usec(self, usec):
+        """Return aware datetime in zone for int epoch microseconds."""
+        info = self._info_at_utc(usec // 1000000)
+        return (dtmath.EPOCH + timedelta(
+            microseconds=usec + info.offset * 1000000)
+            ).replace(tzinfo=info)
+
+    def fromutc(self, dt):
+        """Return aware datetime in zone for naive UTC datetime."""
+        return self.fromutc_usec(dtmath.to_epoch_usec(dt))
+
+    def localize(self, dt):
+        """
+        Return aware datetime in zone for naive local wall clock datetime.
+        Wall times repeated by a transition resolve to the first
+        occurrence, and those skipped are moved forward past it
+        (as PEP 495 fold=0), e.g. 02:30 on US spring DST day is 03:30.
+        """
+        wall = ((dt.toordinal() - _EPOCH_ORDINAL) * 86400 +
+            dt.hour * 3600 + dt.minute * 60 + dt.second)
+        (utcs, walls, infos) = self._covering(dt.year)
+        idx = bisect.bisect_right(walls, wall) - 1
+        if idx < 0:
+            offset = self._initial.offset
+        elif wall >= utcs[idx] + infos[idx].offset:
+            offset = infos[idx].offset
+        else:
+            offset = (infos[idx-1] if idx else self._initial).offset
+        return self.fromutc_usec(
+            (wall - offset) * 1000000 + dt.microsecond)
+
+    def convert(self, dt):
+        """
+        Return aware datetime in zone for datetime: aware converted,
+        naive taken as local wall clock time in zone (see localize).
+        """
+        if dt.tzinfo is None:
+            return self.localize(dt)
+        return self.fromutc_usec(dtmath.to_epoch_usec(dt))
+
+    def fromlocal(self, dt):
+        """
+        Return aware datetime in zone for naive datetime in server
+        local time, e.g. from datetime.now().
+        """
+        secs = get_converter().to_time_t(dt)
+        return self.fromutc_usec(secs * 1000000 + dt.microsecond)
+
+    def now(self):
+        """Return aware datetime of current time in zone."""
+        return self.fromutc_usec(int(time.time() * 1000000))
+
+
+    #
+    # Public Properties
+    #
+
+    @property
+    def zone_id(self):
+        """Timezone id, e.g. 'America/Los_Angeles' (read-only)."""
+        return self._zone_id
+
+
+    #
+    # Internal Methods
+    #
+
+    def _load(self, zone_id):
+        """
+        Return TZif data str from zoneinfo file for zone id,
+        or None for builtin UTC.
+        Raise ValueError if not found.
+        """
+        if _RE_ZONE_ID.match(zone_id):
+            dirs = list(ZONEINFO_DIRS)
+            if os.environ.get('TZDIR'):
+                dirs.insert(0, os.environ['TZDIR'])
+            for zdir in dirs:
+                path = os.path.join(zdir, *zone_id.split('/'))
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        return f.read()
+            if zone_id in BUILTIN_UTC_IDS:
+                return None
+        raise ValueError("{self} zone unknown: '{val}'"
+            .format(self=self, val=zone_id))
+
+    def _parse(self, data):
+        """
+        Parse TZif data str (RFC 8536), populating transitions and rule.
+        Raise ValueError if invalid.
+        """
+        def _invalid(what):
+            return ValueError("{self} invalid TZif data: {what}"
+                .format(self=self, what=what))
+        if data[:4] != 'TZif' or len(data) < 44:
+            raise _invalid("header")
+        version = data[4]
+        (pos, time_size) = (0, 4)
+        if version >= '2':
+            # Skip v1 (32-bit) block, use v2+ (64-bit) block and footer:
+            (isutcnt, isstdcnt, leapcnt, timecnt, typecnt, charcnt) = \
+                struct.unpack('>6l', data[20:44])
+            pos = 44 + (timecnt * 5 + typecnt * 6 + charcnt +
+                leapcnt * 8 + isstdcnt + isutcnt)
+            time_size = 8
+        try:
+            if data[pos:pos+4] != 'TZif':
+                raise _invalid("header")
+            (isutcnt, isstdcnt, leapcnt, timecnt, typecnt, charcnt) = \
+                struct.unpack('>6l', data[pos+20:pos+44])
+            pos += 44
+            times = struct.unpack('>%d%s' % (timecnt,
+                'q' if time_size == 8 else 'l'),
+                data[pos:pos + timecnt * time_size])
+            pos += timecnt * time_size
+            idxs = struct.unpack('>%dB' % timecnt, data[pos:pos + timecnt])
+            pos += timecnt
+            ttinfos = [struct.unpack('>lBB', data[pos+n*6:pos+n*6+6])
+                for n in xrange(typecnt)]
+            pos += typecnt * 6
+            chars = data[pos:pos + charcnt]
+            pos += charcnt + leapcnt * (time_size + 4) + isstdcnt + isutcnt
+            infos = [self._info(utoff, chars[desig:chars.index('\0', desig)],
+                bool(isdst)) for (utoff, isdst, desig) in ttinfos]
+            if not infos:
+                raise _invalid("no local time types")
+            transitions = [(t, infos[idx]) for (t, idx) in zip(times, idxs)]
+        except (struct.error, IndexError) as e:
+            raise _invalid(e)
+        self._initial = infos[0]
+        if version >= '2':
+            footer = data[pos:].strip('\n')
+            if footer:
+                self._parse_rule(footer)
+        self._set_transitions(transitions)
+
+    def _parse_rule(self, posix_tz):
+        """
+        Parse POSIX TZ str (TZif footer) for rule-based transitions,
+        or local time type if no DST.
+        Unsupported strs are ignored (last transition then holds).
+        """
+        m = _RE_POSIX_TZ.match(posix_tz)
+        if not m:
+            return
+        def _secs(ofs):
+            sign = -1 if ofs.startswith('-') else 1
+            parts = [int(p) for p in ofs.lstrip('+-').split(':')] + [0, 0]
+            return sign * (parts[0] * 3600 + parts[1] * 60 + parts[2])
+        std = self._info(-_secs(m.group('stdoff')),
+            m.group('std').strip('<>'), False)
+        if not m.group('dst'):
+            self._rule = (std, None, None, None)
+            return
+        dst_offset = std.offset + 3600
+        if m.group('dstoff'):
+            dst_offset = -_secs(m.group('dstoff'))
+        dst = self._info(dst_offset, m.group('dst').strip('<>'), True)
+        rules = list()
+        for (rule, rtime) in ((m.group('start'), m.group('starttime')),
+                (m.group('end'), m.group('endtime'))):
+            mr = _RE_POSIX_RULE.match(rule)
+            if not mr:
+                return
+            rules.append((tuple(int(g) if g is not None else None
+                for g in mr.groups()), _secs(rtime or '2')))
+        self._rule = (std, dst, rules[0], rules[1])
+
+    def _set_transitions(self, transitions):
+        """
+        Set state from list of (utc secs, TZOffset) transitions,
+        dropping any that don't change offset, abbr or DST flag.
+        """
+        (utcs, walls, infos) = (list(), list(), list())
+        prev = self._initial
+        for (t, info) in transitions:
+            if info is prev:
+                continue
+            utcs.append(t)
+            walls.append(t + prev.offset)
+            infos.append(info)
+            prev = info
+        self._state = (utcs, walls, infos)
+
+    def _covering(self, year):
+        """
+        Return state (utcs, walls, infos) with transitions covering year,
+        generating rule-based ones if needed.
+        """
+        state = self._state
+        if self._rule is None or self._rule[1] is None:
+            return state
+        if self._rule_year is not None and year < self._rule_year:
+            return state
+        with self._lock:
+            (utcs, walls, infos) = self._state
+            first_year = (dtmath.EPOCH + timedelta(
+                seconds=utcs[-1])).year if utcs else year
+            if self._rule_year is not None:
+                first_year = self._rule_year + 1
+            last_year = max(year, first_year) + EXTEND_YEARS
+            if last_year > 9998:
+                return self._state
+            transitions = zip(utcs, infos)
+            for ryear in xrange(first_year, last_year + 1):
+                for (t, info) in self._rule_transitions(ryear):
+                    if not utcs or t > utcs[-1]:
+                        transitions.append((t, info))
+            self._set_transitions(transitions)
+            self._rule_year = last_year
+            return self._state
+
+    def _rule_transitions(self, year):
+        """Return sorted list of (utc secs, TZOffset) by rule for year."""
+        (std, dst, start, end) = self._rule
+        return sorted([
+            (self._rule_wall(year, start) - std.offset, dst),
+            (self._rule_wall(year, end) - dst.offset, std),
+        ])
+
+    def _rule_wall(self, year, rule):
+        """Return wall clock epoch secs of POSIX TZ rule date/time in year."""
+        ((month, week, weekday, julian1, julian0), rtime) = rule
+        if month is not None:
+            first = date(year, month, 1)
+            day = 1 + (weekday - (first.weekday() + 1)) % 7 + (week - 1) * 7
+            while day > calendar.monthrange(year, month)[1]:
+                day -= 7
+            ordinal = date(year, month, day).toordinal()
+        elif julian1 is not None:
+            ordinal = date(year, 1, 1).toordinal() + julian1 - 1
+            if calendar.isleap(year) and julian1 >= 60:
+                ordinal += 1
+        else:
+            ordinal = date(year, 1, 1).toordinal() + julian0
+        return (ordinal - _EPOCH_ORDINAL) * 86400 + rtime
+
+    def _info_at_utc(self, secs):
+        """Return TZOffset in effect at UTC epoch secs."""
+        state = self._state
+        if self._rule is not None and state[0] and secs > state[0][-1]:
+            state = self._covering(
+                (dtmath.EPOCH + timedelta(seconds=secs)).year)
+        (utcs, walls, infos) = state
+        idx = bisect.bisect_right(utcs, secs) - 1
+        if idx < 0:
+            return self._initial
+        return infos[idx]
+
+    def _info(self, offset, abbr, isdst):
+        """
+        Return shared TZOffset for local time type.
+        Offset is rounded to whole minutes, as Python 2 tzinfo requires
+        (affecting only historical local mean time offsets).
+        """
+        offset = int(round(offset / 60.0)) * 60
+        key = (offset, abbr, isdst)
+        info = self._infos.get(key)
+        if info is None:
+            info = self._infos[key] = TZOffset(offset, abbr, isdst,
+                self._zone_id)
+        return info
+
+    def __unicode__(self):
+        return (u"TZTable('{self._zone_id}', {count} transitions)"
+        ).format(self=self, count=len(self._state[0]))
+
+
+# ----------------------------------------------------------------------------
+
+
+# (See test suite in axonchisel.metrics.tests.test_dtmath)
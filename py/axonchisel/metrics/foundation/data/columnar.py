@@ -0,0 +1,389 @@
+"""
+Ax_Metrics - Columnar (array-backed) series of data points and their context
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None   # (optional, for vectorized operations)
+
+from axonchisel.metrics.foundation.ax.obj import is_validation_full
+from axonchisel.metrics.foundation.chrono.timerange import \
+    TimeRange, FrozenTimeRange
+from axonchisel.metrics.foundation.chrono.tztable import TZOffset
+import axonchisel.metrics.foundation.chrono.dtmath as dtmath
+
+from axonchisel.metrics.foundation.metricdef.metricdef import FUNCS
+
+from .point import DataPoint
+from .series import DataSeries
+
+
+# ----------------------------------------------------------------------------
+
+
+# Array typecode for int64 epoch microseconds:
+EPOCH_TYPECODE = dtmath.EPOCH_USEC_TYPECODE
+
+# Epoch microseconds value representing missing (None) anchor:
+NO_ANCHOR = -2**63
+
+# Value kinds, so values round trip as the same type (or None) given:
+KIND_FLOAT   = 0
+KIND_INT     = 1
+KIND_MISSING = 2
+KIND_BIGINT  = 3   # (int too large for float64, kept exactly aside)
+
+# Use NumPy (if importable) for vectorized reduce, div, and scale:
+USE_NUMPY = numpy is not None
+
+# Int values (and their sums) are exact in float64 only below this
+# magnitude:
+EXACT_INT_LIMIT = 2**53
+
+# Internal marker for a NumPy reduce falling back to pure Python:
+_NO_RESULT = object()
+
+
+# ----------------------------------------------------------------------------
+
+
+class ColumnarDataSeries(DataSeries):
+    """
+    DataSeries variant storing points compactly in parallel arrays
+    (columns) rather than as DataPoint objects: anchor, inc_begin and
+    exc_end as int64 epoch microseconds (see dtmath.to_epoch_usec),
+    and values as float64 with a kind (float, int, or missing) each.
+    Int values of EXACT_INT_LIMIT magnitude or more, which float64
+    can't represent exactly, are also kept aside as Python ints,
+    so all values round trip exactly.
+
+    DataPoints and their TimeRanges are materialized only on access
+    via get_point() or iter_points(), as new objects each time, so
+    modifying them does not affect the series (use set_value instead).
+    Aware datetimes in a timezone (see FrameSpec timezone) are
+    materialized in the same zone, other aware datetimes as naive UTC.
+    Otherwise usable anywhere a DataSeries is, e.g. by EROuts.
+
+    If NumPy is importable (and USE_NUMPY is set), reduce(), div_series()
+    and scale() operate on whole columns at once, with results (and
+    errors) identical to the pure Python DataSeries implementations,
+    which remain the fallback (always used once any value is such a
+    large int).
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize, optionally overriding any default properties with kwargs.
+        """
+        # Set default state:
+        self._reset_columns()
+
+        # Superclass init:
+        DataSeries.__init__(self, **kwargs)
+
+
+    #
+    # Public Methods
+    #
+
+    def count_points(self):
+        """Return number of DataPoints."""
+        return len(self._begins)
+
+    def reset_points(self):
+        """Reset DataPoints to empty list."""
+        self._reset_columns()
+
+    def add_point(self, dpoint):
+        """Add a valid DataPoint (by value)."""
+        self._assert_type("dpoint", dpoint, DataPoint)
+        dpoint.validate()
+        self._append(dpoint.tmrange, dpoint.value)
+
+    def add_values(self, tmranges, values):
+        """
+        Add DataPoints for parallel lists of valid TimeRanges and values
+        (None = missing), without creating DataPoint objects.
+        Below FULL validation level, these are trusted without validation.
+        """
+        if not is_validation_full():
+            for (tmrange, value) in zip(tmranges, values):
+                self._append(tmrange, value)
+            return
+        for (tmrange, value) in zip(tmranges, values):
+            self._assert_type("tmrange", tmrange, TimeRange)
+            tmrange.validate()
+            if value is not None:
+                self._assert_type_numeric("value", value)
+            self._append(tmrange, value)
+
+    def get_point(self, idx):
+        """
+        Return new DataPoint materialized from specific 0-based index.
+        Supports negative indexes from tail (-1 = last).
+        Raise IndexError if out of range.
+        """
+        anchor = self._anchors[idx]
+        from_usec = dtmath.from_epoch_usec
+        if self._tztable is not None:
+            from_usec = self._tztable.fromutc_usec
+        tmrange = FrozenTimeRange.from_trusted(
+            anchor=None if anchor == NO_ANCHOR else from_usec(anchor),
+            inc_begin=from_usec(self._begins[idx]),
+            exc_end=from_usec(self._ends[idx]))
+        return DataPoint(tmrange=tmrange, value=self._value_at(idx))
+
+    def iter_points(self):
+        """Return an iterator over new materialized DataPoints."""
+        return (self.get_point(idx) for idx in xrange(self.count_points()))
+
+    def values(self):
+        """Return list of DataPoint values (None = missing), in order."""
+        return [self._value_at(idx) for idx in xrange(self.count_points())]
+
+    def set_value(self, idx, val):
+        """
+        Set value (None = missing) of specific 0-based indexed DataPoint.
+        Raise IndexError if out of range.
+        """
+        if val is not None:
+            self._assert_type_numeric("value", val)
+        (kind, fval) = self._encode_value(val)
+        self._values[idx] = fval
+        self._kinds[idx] = kind
+        if idx < 0:
+            idx += self.count_points()
+        self._bigints.pop(idx, None)
+        if kind == KIND_BIGINT:
+            self._bigints[idx] = val
+
+    def count_missing(self):
+        """Return number of points missing data."""
+        return self._kinds.count(KIND_MISSING)
+
+    def div_series(self, dseries2):
+        """
+        Divide each point value by value from same point in other series.
+        If either point's value is None, the resulting value will be None.
+        If dseries2 is shorter, all unmatched values will be None.
+        """
+        if self._can_vectorize(dseries2):
+            if self._np_div_series(dseries2):
+                return
+        values2 = dseries2.values()
+        for idx in xrange(self.count_points()):
+            val = self._value_at(idx)
+            val2 = values2[idx] if idx < len(values2) else None
+            if (val is None) or (val2 is None):
+                self.set_value(idx, None)
+            else:
+                self.set_value(idx, val / val2)
+
+    def scale(self, factor):
+        """
+        Multiply each point value by numeric factor.
+        Missing (None) values remain None.
+        """
+        self._assert_type_numeric("scale factor", factor)
+        if self._can_vectorize():
+            if self._np_scale(factor):
+                return
+        for idx in xrange(self.count_points()):
+            val = self._value_at(idx)
+            if val is not None:
+                self.set_value(idx, val * factor)
+
+    def reduce(self, mdef_func):
+        """
+        Reduce the series to a single value by MetricDef func specified.
+        Returns value.
+        func is a string from:
+          axonchisel.metrics.foundation.metricdef.metricdef.FUNCS
+        """
+        if self._can_vectorize():
+            self._assert_type_string("reduce mdef_func", mdef_func)
+            self._assert_value("reduce mdef_func", mdef_func, FUNCS.keys())
+            result = self._np_reduce(mdef_func)
+            if result is not _NO_RESULT:
+                return result
+        return DataSeries.reduce(self, mdef_func)
+
+    #
+    # Internal Methods
+    #
+
+    def _reset_columns(self):
+        """Reset columns to empty arrays."""
+        self._anchors = array.array(EPOCH_TYPECODE)
+        self._begins  = array.array(EPOCH_TYPECODE)
+        self._ends    = array.array(EPOCH_TYPECODE)
+        self._values  = array.array('d')
+        self._kinds   = array.array('b')
+        self._bigints = dict()   # idx: exact int value of KIND_BIGINT
+        self._tztable = None   # TZTable of aware datetimes (if any)
+
+    def _append(self, tmrange, value):
+        """Append already validated TimeRange and value to columns."""
+        tzinfo = tmrange.inc_begin.tzinfo
+        if tzinfo is not None and isinstance(tzinfo, TZOffset):
+            self._tztable = tzinfo.tztable
+        anchor = tmrange.anchor
+        self._anchors.append(NO_ANCHOR if anchor is None else
+            dtmath.to_epoch_usec(anchor))
+        self._begins.append(dtmath.to_epoch_usec(tmrange.inc_begin))
+        self._ends.append(dtmath.to_epoch_usec(tmrange.exc_end))
+        (kind, fval) = self._encode_value(value)
+        if kind == KIND_BIGINT:
+            self._bigints[len(self._values)] = value
+        self._values.append(fval)
+        self._kinds.append(kind)
+
+    def _encode_value(self, val):
+        """Return tuple (kind, float value) encoding value for columns."""
+        if val is None:
+            return (KIND_MISSING, 0.0)
+        if isinstance(val, (int, long)) and not isinstance(val, bool):
+            if abs(val) >= EXACT_INT_LIMIT:
+                return (KIND_BIGINT, float(val))
+            return (KIND_INT, float(val))
+        return (KIND_FLOAT, float(val))
+
+    def _value_at(self, idx):
+        """Return decoded value (or None) at index."""
+        kind = self._kinds[idx]
+        if kind == KIND_MISSING:
+            return None
+        if kind == KIND_INT:
+            return int(self._values[idx])
+        if kind == KIND_BIGINT:
+            return self._bigints[idx % len(self._kinds)]
+        return self._values[idx]
+
+    def _can_vectorize(self, dseries2=None):
+        """
+        Check T/F if NumPy operations may be used on this series
+        (and optional other series, which must be columnar too),
+        i.e. if all values are exact in float64.
+        """
+        if not USE_NUMPY or not self.count_points() or self._bigints:
+            return False
+        if dseries2 is not None:
+            return (isinstance(dseries2, ColumnarDataSeries) and
+                dseries2.count_points() > 0 and not dseries2._bigints)
+        return True
+
+    def _np_columns(self):
+        """Return tuple (values, kinds) of NumPy array copies of columns."""
+        return (numpy.frombuffer(self._values, dtype=numpy.float64).copy(),
+                numpy.frombuffer(self._kinds, dtype=numpy.int8).copy())
+
+    def _np_set_columns(self, values, kinds):
+        """
+        Replace value and kind columns from NumPy arrays.
+        Int values are normalized (-0.0 to 0.0) as Python ints have no -0.
+        """
+        values[kinds == KIND_INT] += 0.0
+        self._values = array.array('d')
+        self._values.fromstring(values.astype(numpy.float64).tostring())
+        self._kinds  = array.array('b')
+        self._kinds.fromstring(kinds.astype(numpy.int8).tostring())
+
+    def _np_reduce(self, mdef_func):
+        """
+        Return reduced value by MetricDef func, computed with NumPy,
+        or _NO_RESULT if it can't be computed exactly (e.g. NaN in MIN).
+        """
+        if mdef_func == 'COUNT':
+            return self.count_points()
+        (values, kinds) = self._np_columns()
+        idxs = numpy.flatnonzero(kinds != KIND_MISSING)
+        if mdef_func == 'FIRST':
+            return self._value_at(int(idxs[0])) if len(idxs) else None
+        if mdef_func == 'LAST':
+            return self._value_at(int(idxs[-1])) if len(idxs) else None
+        present = values[idxs]
+        if mdef_func in ('MIN', 'MAX'):
+            if not len(idxs):
+                return _NO_RESULT   # (let Python raise its ValueError)
+            if numpy.isnan(present).any():
+                return _NO_RESULT   # (Python result depends on order)
+            pos = present.argmin() if mdef_func == 'MIN' else present.argmax()
+            return self._value_at(int(idxs[pos]))
+        # SUM, AVG: sequential float sum (cumsum) matches Python sum(),
+        # once added to its 0 start (so e.g. all -0.0 sum to 0.0):
+        if not len(idxs):
+            return 0 if mdef_func == 'SUM' else None
+        ints = (kinds[idxs] == KIND_INT)
+        if numpy.abs(present[ints]).sum() >= EXACT_INT_LIMIT:
+            return _NO_RESULT       # (Python ints sum exactly)
+        total = 0 + float(present.cumsum()[-1])
+        if mdef_func == 'AVG':
+            return total / len(idxs)
+        return int(total) if ints.all() else total
+
+    def _np_div_series(self, dseries2):
+        """
+        Implement div_series with NumPy for columnar dseries2.
+        Return T/F if done, or False if any divisor is zero (leaving
+        the Python loop to raise ZeroDivisionError at the same point).
+        """
+        (values, kinds) = self._np_columns()
+        (values2, kinds2) = dseries2._np_columns()
+        count = min(len(values), len(values2))
+        (a, b) = (values[:count], values2[:count])
+        valid = numpy.zeros(len(values), dtype=bool)
+        valid[:count] = ((kinds[:count] != KIND_MISSING) &
+            (kinds2[:count] != KIND_MISSING))
+        vb = valid[:count]
+        if (vb & (b == 0)).any():
+            return False
+        ints = numpy.zeros(len(values), dtype=bool)
+        ints[:count] = (vb & (kinds[:count] == KIND_INT) &
+            (kinds2[:count] == KIND_INT))
+        with numpy.errstate(all='ignore'):
+            quotient = numpy.where(ints[:count],
+                numpy.floor_divide(a, b), numpy.true_divide(a, b))
+        values[:count] = quotient
+        values[~valid] = 0.0
+        kinds[:] = KIND_FLOAT
+        kinds[ints] = KIND_INT
+        kinds[~valid] = KIND_MISSING
+        self._np_set_columns(values, kinds)
+        return True
+
+    def _np_scale(self, factor):
+        """
+        Implement scale with NumPy.
+        Return T/F if done, or False if any int product may not be exact
+        in float64 (leaving the Python loop to compute it exactly).
+        """
+        (values, kinds) = self._np_columns()
+        missing = (kinds == KIND_MISSING)
+        if isinstance(factor, (int, long)):
+            if abs(factor) >= EXACT_INT_LIMIT:
+                return False
+            ints = values[kinds == KIND_INT]
+            if len(ints) and numpy.abs(ints * factor).max() >= EXACT_INT_LIMIT:
+                return False
+        with numpy.errstate(all='ignore'):
+            values = values * factor
+        values[missing] = 0.0
+        if not isinstance(factor, (int, long)):
+            kinds[~missing] = KIND_FLOAT
+        self._np_set_columns(values, kinds)
+        return True
+
+
+# ----------------------------------------------------------------------------
+
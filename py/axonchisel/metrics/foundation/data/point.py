@@ -10,7 +10,7 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
-from axonchisel.metrics.foundation.ax.obj import AxObj
+from axonchisel.metrics.foundation.ax.obj import AxSlotsObj
 
 from axonchisel.metrics.foundation.chrono.timerange import TimeRange
 
@@ -18,7 +18,7 @@ from axonchisel.metrics.foundation.chrono.timerange import TimeRange
 # ----------------------------------------------------------------------------
 
 
-class DataPoint(AxObj):
+class DataPoint(AxSlotsObj):
     """
     Single 2D data point with a) time range and b) value.
 
@@ -27,6 +27,8 @@ class DataPoint(AxObj):
     Many DataPoints may be represented by a DataSeries.
     """
 
+    __slots__ = ('_tmrange', '_value')
+
     def __init__(self, **kwargs):
         """
         Initialize, optionally overriding any default properties with kwargs.
@@ -44,7 +46,19 @@ class DataPoint(AxObj):
     #
     # Public Methods
     #
-    
+
+    @classmethod
+    def from_trusted(cls, tmrange, value):
+        """
+        Return new instance from TimeRange and value (None = missing),
+        without any validation.
+        Callers must pass a valid TimeRange and numeric (or None) value.
+        """
+        dpoint = cls.__new__(cls)
+        dpoint._tmrange = tmrange
+        dpoint._value   = value
+        return dpoint
+
     def is_valid(self):
         """
         Check T/F if DataPoint is valid.
@@ -10,7 +10,7 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
-from axonchisel.metrics.foundation.ax.obj import AxObj
+from axonchisel.metrics.foundation.ax.obj import AxObj, is_validation_full
 
 from axonchisel.metrics.foundation.chrono.ghost import Ghost
 from axonchisel.metrics.foundation.metricdef.metricdef import MetricDef, FUNCS
@@ -37,6 +37,7 @@ class DataSeries(AxObj):
         self.id       = ''
         self.query_id = ''
         self.mdef     = MetricDef()
+        self.div_mdef = None
         self.tmfrspec = FrameSpec()
         self.ghost    = None
         self.label    = ""
@@ -44,7 +45,8 @@ class DataSeries(AxObj):
 
         # Apply initial values from kwargs:
         self._init_kwargs(kwargs, [
-            'id', 'query_id', 'mdef', 'tmfrspec', 'ghost', 'label',
+            'id', 'query_id', 'mdef', 'div_mdef', 'tmfrspec', 'ghost',
+            'label',
         ])
 
 
@@ -71,6 +73,19 @@ class DataSeries(AxObj):
         for dpoint in dpoints:
             self.add_point(dpoint)
 
+    def add_values(self, tmranges, values):
+        """
+        Add DataPoints for parallel lists of valid TimeRanges and values
+        (None = missing).
+        Below FULL validation level, these are trusted without validation.
+        """
+        if not is_validation_full():
+            self._points.extend(DataPoint.from_trusted(tmrange, value)
+                for (tmrange, value) in zip(tmranges, values))
+            return
+        for (tmrange, value) in zip(tmranges, values):
+            self.add_point(DataPoint(tmrange=tmrange, value=value))
+
     def get_point(self, idx):
         """
         Return specific 0-based indexed DataPoint.
@@ -83,6 +98,17 @@ class DataSeries(AxObj):
         """Return an iterator over DataPoints."""
         return iter(self._points)
 
+    def values(self):
+        """Return list of DataPoint values (None = missing), in order."""
+        return [dp.value for dp in self._points]
+
+    def set_value(self, idx, val):
+        """
+        Set value (None = missing) of specific 0-based indexed DataPoint.
+        Raise IndexError if out of range.
+        """
+        self._points[idx].value = val
+
     def count_missing(self):
         """Return number of points missing data."""
         return sum(1 if dp.is_missing() else 0 for dp in self._points)
@@ -103,6 +129,16 @@ class DataSeries(AxObj):
             if dp.value is not None:
                 dp.value /= dp2.value
 
+    def scale(self, factor):
+        """
+        Multiply each point value by numeric factor.
+        Missing (None) values remain None.
+        """
+        self._assert_type_numeric("scale factor", factor)
+        for dp in self._points:
+            if dp.value is not None:
+                dp.value *= factor
+
     def reduce(self, mdef_func):
         """
         Reduce the series to a single value by MetricDef func specified.
@@ -112,7 +148,7 @@ class DataSeries(AxObj):
         """
         self._assert_type_string("reduce mdef_func", mdef_func)
         self._assert_value("reduce mdef_func", mdef_func, FUNCS.keys())
-        vals = [dp.value for dp in self._points]
+        vals = self.values()
         func = FUNCS[mdef_func]['reduce']
         return func(vals)
 
@@ -148,6 +184,16 @@ class DataSeries(AxObj):
         self._assert_type("mdef", val, MetricDef)
         self._mdef = val
 
+    @property
+    def div_mdef(self):
+        """MetricDef of series values are divided by, optional."""
+        return self._div_mdef
+    @div_mdef.setter
+    def div_mdef(self, val):
+        if val is not None:
+            self._assert_type("div_mdef", val, MetricDef)
+        self._div_mdef = val
+
     @property
     def tmfrspec(self):
         """Wrapped FrameSpec."""
@@ -187,7 +233,7 @@ class DataSeries(AxObj):
             "with {cnt} points: [{points}])"
         ).format(self=self, cls=self.__class__.__name__,
             cnt=self.count_points(),
-            points=u", ".join("{0}".format(p.value) for p in self._points)
+            points=u", ".join("{0}".format(v) for v in self.values())
         )
 
             
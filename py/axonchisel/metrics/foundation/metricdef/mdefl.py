@@ -114,6 +114,7 @@ class MetricDefParser(AxObj):
         self._parse_item(ymetric, 'id')
         self._parse_item(ymetric, 'emfetch_id')
         self._parse_item(ymetric, 'emfetch_opts', extend=True)
+        self._parse_item(ymetric, 'settle_secs')
         self._parse_item(ymetric, 'table')
         self._parse_item(ymetric, 'func')
         self._parse_item(ymetric, 'time_field')
@@ -10,6 +10,9 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
+import hashlib
+import json
+
 from axonchisel.metrics.foundation.ax.obj import AxObj
 
 from .filters import Filters, Filter
@@ -75,6 +78,7 @@ class MetricDef(AxObj):
         self.data_field   = ''
         self.data_type    = 'NUM_INT'          # from DATA_TYPES
         self.filters      = Filters()
+        self.settle_secs  = 0            # secs until past data is final
 
         # Apply initial values from kwargs:
         self._init_kwargs(kwargs, [
@@ -82,7 +86,7 @@ class MetricDef(AxObj):
             'emfetch_id', 'emfetch_opts',
             'table', 'func', 'time_field', 'time_type',
             'data_field', 'data_type',
-            'filters',
+            'filters', 'settle_secs',
         ])
 
 
@@ -110,6 +114,37 @@ class MetricDef(AxObj):
         self._validate_required()
         self.filters.validate()
 
+    def fingerprint(self, extinfo=None):
+        """
+        Return stable hex string identifying what this MetricDef fetches,
+        e.g. for use in cache keys.
+        Two MetricDefs with the same fingerprint fetch the same data from
+        their EMFetcher, regardless of their ids or object identity.
+        settle_secs is not included, as it only affects when fetched data
+        is final, so caches of results must key on it too
+        (see MQEngine.fingerprint_for).
+        Fingerprint is computed from current state, so changes to the
+        MetricDef change its fingerprint.
+        Optional EMFetcher extinfo dict (e.g. backend connection config)
+        is included too, as it may also change what is fetched.
+        """
+        spec = {
+            'emfetch_id':   self.emfetch_id,
+            'emfetch_opts': self.emfetch_opts,
+            'table':        self.table,
+            'func':         self.func,
+            'time_field':   self.time_field,
+            'time_type':    self.time_type,
+            'data_field':   self.data_field,
+            'data_type':    self.data_type,
+            'filters':      [(f.field, f.op, f.value)
+                                for f in self.filters.get_filters()],
+        }
+        if extinfo is not None:
+            spec['extinfo'] = extinfo
+        canon = json.dumps(spec, sort_keys=True, default=unicode)
+        return hashlib.sha1(canon.encode('utf-8')).hexdigest()
+
 
     #
     # Public Properties
@@ -208,6 +243,22 @@ class MetricDef(AxObj):
         self._assert_type("filters", val, Filters)
         self._filters = val
 
+    @property
+    def settle_secs(self):
+        """
+        Settle horizon: number of seconds after a time range ends before
+        its data is considered final and will never change (e.g. to allow
+        for late arriving or batch loaded data). Default 0.
+        """
+        return self._settle_secs
+    @settle_secs.setter
+    def settle_secs(self, val):
+        self._assert_type_numeric("settle_secs", val)
+        if val < 0:
+            raise ValueError("{self} settle_secs must be >= 0: {val}"
+                .format(self=self, val=val))
+        self._settle_secs = val
+
 
     #
     # Internal Methods
@@ -67,6 +67,7 @@ class QueryParser(AxObj):
           smooth_unit: DAY
           smooth_val: 30
           reframe_dt: 2014-11-01
+          timezone: America/New_York
         format:
           some_erout_plugin_id:
             type: type1
@@ -214,6 +215,7 @@ class QueryParser(AxObj):
         _parse_ytimeframe_item('smooth_unit')
         _parse_ytimeframe_item('smooth_val')
         _parse_ytimeframe_item('mode')
+        _parse_ytimeframe_item('timezone')
         _parse_ytimeframe_item('accumulate')
         _parse_ytimeframe_item('allow_overflow_begin')
         _parse_ytimeframe_item('allow_overflow_end')
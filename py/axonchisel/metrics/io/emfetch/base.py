@@ -12,15 +12,18 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 
 import collections
 
-from axonchisel.metrics.foundation.ax.obj import AxObj
+from axonchisel.metrics.foundation.ax.obj import AxObj, is_validation_full
 from axonchisel.metrics.foundation.ax.plugin import AxPluginBase
+from axonchisel.metrics.foundation.ax.future import AxFuture
 
-from axonchisel.metrics.foundation.chrono.timerange import TimeRange
+from axonchisel.metrics.foundation.chrono.timerange import \
+    TimeRange, FrozenTimeRange
+from axonchisel.metrics.foundation.chrono.epochconv import get_converter
 from axonchisel.metrics.foundation.metricdef.metricdef import MetricDef
 from axonchisel.metrics.foundation.data.point import DataPoint
 
 from .tmrange_time_t import TimeRange_time_t
-from .interface import EMFetcher
+from .interface import EMFetcher, FetchCancelled
 
 
 # ----------------------------------------------------------------------------
@@ -31,6 +34,10 @@ class EMFetcherBase(EMFetcher, AxPluginBase):
     EMFetch (Extensible Metrics Fetch) Plugin Superclass Base.
 
     See EMFetcher interface class for detailed docs.
+
+    Naive datetimes are converted to time_t (e.g. "{tmrange.inc_begin:%s}"
+    in format strs) as server local time, unless extinfo specifies
+    'timezone' (see EpochConverter), e.g. {'timezone': 'UTC'}.
     """
 
     def __init__(self, mdef, extinfo=None):
@@ -46,8 +53,10 @@ class EMFetcherBase(EMFetcher, AxPluginBase):
         AxPluginBase.__init__(self)
 
         # Validate, store MetricDef in self._mdef:
+        # (MetricDefs are validated in their MetSet, unless FULL level)
         self._assert_type("mdef", mdef, MetricDef)
-        mdef.validate()    # (raises TypeError, ValueError)
+        if is_validation_full():
+            mdef.validate()    # (raises TypeError, ValueError)
         self._mdef = mdef
 
         # Pass options to superclass:
@@ -63,17 +72,88 @@ class EMFetcherBase(EMFetcher, AxPluginBase):
         May be called multiple times to load multiple data points.
         Validates input, calls plugin_fetch(), validates, returns DataPoint.
         """
-        # Validate and cache input:
+        # Validate input:
         self._assert_type("tmrange", tmrange, TimeRange)
         tmrange.validate()
-        self._tmrange = TimeRange_time_t(tmrange)
 
-        # Defer to plugin abstract method to fetch:
-        dpoint = self.plugin_fetch(tmrange)
+        # Cache input, defer to plugin abstract method to fetch:
+        return self._fetch_prepared(tmrange,
+            TimeRange_time_t(tmrange, self._epoch_converter()))
 
-        # Validate result DataPoint:
-        self._assert_type("result", dpoint, DataPoint)
-        return dpoint
+    def fetch_batch(self, tmranges, cancel=None, on_fetched=None):
+        """
+        Invoked by MQEngine to fetch a whole sequence of data points.
+        Validates input, calls plugin_fetch_batch(), validates, returns
+        list of DataPoints in same order as tmranges.
+        If plugin does not support batch fetch, falls back to calling
+        fetch() for each TimeRange individually.
+        Optional cancel (threading.Event) is checked before the batch
+        and before each individual fetch, raising FetchCancelled once set.
+        Optional on_fetched(dpoints) is invoked with each list of
+        DataPoints as soon as fetched (the whole batch, or each
+        individual DataPoint when falling back).
+        """
+        # Validate and cache input:
+        tmranges = self._prep_batch(tmranges)
+        if not tmranges:
+            return []
+
+        # Defer to plugin optional method to fetch, else fall back:
+        self._check_cancel(cancel)
+        dpoints = self.plugin_fetch_batch(tmranges)
+        if dpoints is None:
+            dpoints = list()
+            for (tmrange, tmrange_t) in zip(tmranges,
+                    self._tmranges_time_t(tmranges)):
+                self._check_cancel(cancel)
+                dpoint = self._fetch_prepared(tmrange, tmrange_t)
+                if on_fetched is not None:
+                    on_fetched([dpoint])
+                dpoints.append(dpoint)
+            return dpoints
+
+        # Validate result DataPoints:
+        dpoints = self._validate_batch_result(tmranges, dpoints)
+        if on_fetched is not None:
+            on_fetched(dpoints)
+        return dpoints
+
+    def fetch_batch_async(self, tmranges):
+        """
+        Invoked by AsyncMQEngine to start fetching a whole sequence of
+        data points without blocking.
+        Validates input, calls plugin_fetch_batch_async() (or else
+        plugin_fetch_async() for each TimeRange), returns AxFuture of
+        validated list of DataPoints in same order as tmranges.
+        Returns None if plugin does not support async fetch, in which
+        case caller should invoke fetch_batch() in another thread instead.
+        """
+        # Validate and cache input:
+        tmranges = self._prep_batch(tmranges)
+        if not tmranges:
+            return AxFuture.from_result([])
+
+        # Defer to plugin optional methods to start fetch:
+        future = self.plugin_fetch_batch_async(tmranges)
+        if future is None:
+            futures = list()
+            for (tmrange, tmrange_t) in zip(tmranges,
+                    self._tmranges_time_t(tmranges)):
+                self._tmrange = tmrange_t
+                future1 = self.plugin_fetch_async(tmrange)
+                if future1 is None:
+                    if futures:
+                        raise ValueError("{self} plugin_fetch_async"
+                            " returned None after supporting async fetch"
+                            .format(self=self))
+                    return None
+                futures.append(future1)
+            future = AxFuture.gather(futures)
+
+        # Validate result DataPoints once available:
+        self._assert_type("result", future, AxFuture)
+        return future.then(
+            lambda dpoints: self._validate_batch_result(tmranges, dpoints))
 
 
     #
@@ -103,11 +183,65 @@ class EMFetcherBase(EMFetcher, AxPluginBase):
         return AxPluginBase._format_str(self, fmt,
             context=context, what=what, od_defaults=od_defaults)
 
+    def _epoch_converter(self):
+        """
+        Return shared EpochConverter for time_t conversions,
+        per optional extinfo 'timezone' (default server local time).
+        """
+        return get_converter(self.extinfo.get('timezone'))
+
+    def _tmranges_time_t(self, tmranges):
+        """
+        Return list of TimeRange_time_t for list of valid TimeRanges,
+        with time_t properties converted in bulk.
+        """
+        return TimeRange_time_t.from_list(tmranges, self._epoch_converter())
+
 
     #
     # Internal Methods
     #
 
+    def _fetch_prepared(self, tmrange, tmrange_t):
+        """
+        Fetch individual data point for validated TimeRange and its
+        TimeRange_time_t (cached as self._tmrange), returning DataPoint.
+        """
+        self._tmrange = tmrange_t
+        dpoint = self.plugin_fetch(tmrange)
+        self._assert_type("result", dpoint, DataPoint)
+        return dpoint
+
+    def _check_cancel(self, cancel):
+        """Raise FetchCancelled if optional cancel Event is set."""
+        if cancel is not None and cancel.is_set():
+            raise FetchCancelled("{self} deadline expired".format(self=self))
+
+    def _prep_batch(self, tmranges):
+        """
+        Validate and cache input sequence of TimeRanges for batch fetch,
+        returning list of them.
+        """
+        tmranges = list(tmranges)
+        self._assert_type_list("tmranges", tmranges, ofsupercls=TimeRange)
+        for tmrange in tmranges:
+            tmrange.validate()
+        if tmranges:
+            self._tmrange = TimeRange_time_t(FrozenTimeRange.from_trusted(
+                inc_begin = min(t.inc_begin for t in tmranges),
+                exc_end   = max(t.exc_end for t in tmranges),
+            ), self._epoch_converter())
+        return tmranges
+
+    def _validate_batch_result(self, tmranges, dpoints):
+        """
+        Validate list of result DataPoints for batch of TimeRanges,
+        returning list of them.
+        """
+        self._assert_type_list("result", dpoints,
+            ofsupercls=DataPoint, length=len(tmranges))
+        return list(dpoints)
+
     def __unicode__(self):
         return (u"{cls}({self.mdef})"
         ).format(self=self, cls=self.__class__.__name__,
@@ -16,6 +16,14 @@ from axonchisel.metrics.foundation.ax.plugin import AxPlugin
 # ----------------------------------------------------------------------------
 
 
+class FetchCancelled(Exception):
+    """Fetch abandoned as its query deadline expired."""
+    pass
+
+
+# ----------------------------------------------------------------------------
+
+
 class EMFetcher(AxPlugin):
     """
     EMFetch (Extensible Metrics Fetch) Plugin Interface.
@@ -24,6 +32,11 @@ class EMFetcher(AxPlugin):
     for each data point.
     Implementations provide access to various data sources by overriding the
     plugin_fetch() abstract method.
+    Implementations may also override the optional plugin_fetch_batch()
+    method to fetch a whole sequence of data points at once, and the
+    optional plugin_fetch_async() / plugin_fetch_batch_async() methods
+    to fetch without blocking (e.g. using non-blocking I/O), for use by
+    AsyncMQEngine.
 
     See AxPlugin and AxPluginBase for architecture details.
 
@@ -61,6 +74,77 @@ class EMFetcher(AxPlugin):
         """
         raise NotImplementedError("EMFetcher abstract superclass")
 
+    #
+    # Optional Methods
+    #
+
+    # optional
+    def plugin_fetch_batch(self, tmranges):
+        """
+        EMFetcher plugins may optionally implement this method to fetch
+        many data points at once, e.g. with a single backend request.
+        Invoked by fetch_batch() after parameters are validated.
+
+        Returns list of DataPoints, one per TimeRange and in the same order.
+            (axonchisel.metrics.foundation.data.point.DataPoint)
+        Returns None if batch fetch is not supported, in which case
+        fetch_batch() falls back to invoking fetch() for each TimeRange.
+        This default implementation returns None.
+
+        Parameters:
+
+          - tmranges : list of time ranges to gather data for.
+            (axonchisel.metrics.foundation.chrono.timerange.TimeRange)
+            The overall range spanned by all of them is also available
+            in TimeRange_time_t format as self._tmrange.
+        """
+        return None
+
+    # optional
+    def plugin_fetch_async(self, tmrange):
+        """
+        EMFetcher plugins may optionally implement this method to start
+        fetching a single data point without blocking.
+        Invoked by fetch_batch_async() (once per TimeRange) after
+        parameters are validated, if plugin_fetch_batch_async() is not
+        supported.
+
+        Returns AxFuture of a single DataPoint.
+            (axonchisel.metrics.foundation.ax.future.AxFuture)
+        Returns None if async fetch is not supported, in which case
+        callers fall back to invoking blocking fetch methods in threads.
+        This default implementation returns None.
+
+        Parameters:
 
+          - tmrange : specification of time range to gather data for.
+            (axonchisel.metrics.foundation.chrono.timerange.TimeRange)
+            Also available in TimeRange_time_t format as self._tmrange
+            (only during this call).
+        """
+        return None
 
+    # optional
+    def plugin_fetch_batch_async(self, tmranges):
+        """
+        EMFetcher plugins may optionally implement this method to start
+        fetching many data points at once without blocking.
+        Invoked by fetch_batch_async() after parameters are validated.
+
+        Returns AxFuture of list of DataPoints, one per TimeRange and in
+        the same order.
+            (axonchisel.metrics.foundation.ax.future.AxFuture)
+        Returns None if async batch fetch is not supported, in which case
+        fetch_batch_async() falls back to plugin_fetch_async().
+        This default implementation returns None.
+
+        Parameters:
+
+          - tmranges : list of time ranges to gather data for.
+            (axonchisel.metrics.foundation.chrono.timerange.TimeRange)
+            The overall range spanned by all of them is also available
+            in TimeRange_time_t format as self._tmrange
+            (only during this call).
+        """
+        return None
 
@@ -10,16 +10,16 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
-import time
 import re
 
 import axonchisel.metrics.foundation.chrono.timerange as timerange
+from axonchisel.metrics.foundation.chrono.epochconv import get_converter
 
 
 # ----------------------------------------------------------------------------
 
 
-class TimeRange_time_t(timerange.TimeRange):
+class TimeRange_time_t(timerange.FrozenTimeRange):
     """
     Extend TimeRange to provide 4 new properties named with _time_t appended.
     Each contains time_t (in int seconds) version of equivalent properties.
@@ -28,15 +28,24 @@ class TimeRange_time_t(timerange.TimeRange):
     This object is intended as a read-only decorator and not for updating.
     New time_t properties are lazily initialized to avoid unnecessary
     performance penalties when time_t variants are not referenced.
+    Naive datetimes are converted as wall clock time in the timezone of
+    an optional EpochConverter (default server local time).
     """
 
-    def __init__(self, tmrange):
-        """Init based on a TimeRange."""
-        timerange.TimeRange.__init__(self, 
-            anchor=tmrange.anchor,
-            inc_begin=tmrange.inc_begin,
-            exc_end=tmrange.exc_end,
-        )
+    __slots__ = ('_epochconv',
+                 '_inc_begin_time_t', '_exc_begin_time_t',
+                 '_inc_end_time_t', '_exc_end_time_t')
+
+    def __init__(self, tmrange, epochconv=None):
+        """
+        Init based on a valid TimeRange,
+        and optional EpochConverter (else shared one for local time).
+        """
+        tmrange.validate()
+        self._anchor    = tmrange.anchor
+        self._inc_begin = tmrange.inc_begin
+        self._exc_end   = tmrange.exc_end
+        self._epochconv = epochconv or get_converter()
 
 
     #
@@ -71,6 +80,26 @@ class TimeRange_time_t(timerange.TimeRange):
     # Public Static Helpers
     #
 
+    @classmethod
+    def from_list(cls, tmranges, epochconv=None):
+        """
+        Return list of new TimeRange_time_t for list of valid TimeRanges,
+        with all time_t properties computed up front in bulk.
+        """
+        epochconv = epochconv or get_converter()
+        tmranges_t = [cls(tmrange, epochconv) for tmrange in tmranges]
+        dts = list()
+        for tmrange in tmranges_t:
+            dts.extend((tmrange.inc_begin, tmrange.exc_begin,
+                tmrange.inc_end, tmrange.exc_end))
+        time_ts = iter(epochconv.to_time_t_list(dts))
+        for tmrange in tmranges_t:
+            tmrange._inc_begin_time_t = next(time_ts)
+            tmrange._exc_begin_time_t = next(time_ts)
+            tmrange._inc_end_time_t   = next(time_ts)
+            tmrange._exc_end_time_t   = next(time_ts)
+        return tmranges_t
+
     @staticmethod
     def patch_format_str(fmt, varnames):
         """
@@ -99,9 +128,16 @@ class TimeRange_time_t(timerange.TimeRange):
     # Internal Methods
     #
     
+    def __getstate__(self):
+        return self._key() + (self._epochconv.timezone,)
+
+    def __setstate__(self, state):
+        timerange.FrozenTimeRange.__setstate__(self, state[:3])
+        self._epochconv = get_converter(state[3])
+
     def _dt_to_time_t(self, dt):
         """Helper: convert datetime to int time_t"""
-        return int(time.mktime(dt.timetuple()))
+        return self._epochconv.to_time_t(dt)
 
 
 
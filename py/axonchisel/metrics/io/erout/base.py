@@ -11,13 +11,15 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 
 
 import collections
-import time
 from datetime import datetime
 
 from axonchisel.metrics.foundation.ax.obj import AxObj
 from axonchisel.metrics.foundation.ax.plugin import AxPluginBase
 
+from axonchisel.metrics.foundation.chrono.epochconv import get_converter
+from axonchisel.metrics.foundation.chrono.stepper import StepPlans
 from axonchisel.metrics.foundation.query.query import Query
+from axonchisel.metrics.foundation.data.series import DataSeries
 from axonchisel.metrics.foundation.data.multi import MultiDataSeries
 
 from .interface import EROut
@@ -41,6 +43,7 @@ class EROutBase(EROut, AxPluginBase):
         # Default state:
         self._query = None    # Query transient storage per output
         self._mdseries = None # MultiDataSeries transient storage per output
+        self._stepplans = None  # StepPlans (optional)
 
         # Superclass init:
         AxPluginBase.__init__(self)
@@ -71,6 +74,30 @@ class EROutBase(EROut, AxPluginBase):
         # Defer to plugin abstract method to output:
         self.plugin_output(mdseries, query=query)
 
+    def output_series(self, dseries, query=None):
+        """
+        Invoked to stream a single DataSeries, in optional query context,
+        if can_stream.  Call output_finish() after the last DataSeries
+        of the query.
+        Validates input, calls plugin_output_series().
+        """
+        # Validate and cache input:
+        self._assert_type("dseries", dseries, DataSeries)
+        self._mdseries = None
+        if query is not None and query is not self._query:
+            self._assert_type("query", query, Query)
+            query.validate()    # (raises TypeError, ValueError)
+        self._query = query
+
+        # Defer to plugin optional method to output:
+        self.plugin_output_series(dseries, query=query)
+
+    def output_finish(self, query=None):
+        """
+        Invoked to finish streaming output of query (see output_series).
+        """
+        self.plugin_output_finish(query=query)
+
 
     #
     # Public Properties
@@ -86,6 +113,30 @@ class EROutBase(EROut, AxPluginBase):
         """MultiDataSeries we are outputting (get only)."""
         return self._mdseries
 
+    @property
+    def can_stream(self):
+        """
+        Whether plugin supports streaming via output_series (get only),
+        i.e. implements optional plugin_output_series().
+        """
+        impl = getattr(self.plugin_output_series, 'im_func', None)
+        return impl is not EROut.plugin_output_series.im_func
+
+    @property
+    def stepplans(self):
+        """
+        Optional StepPlans memo of steps shared with MQEngine (e.g. per
+        Servant request), or None.
+        Plugins needing steps or Stepper analysis should use it via
+        _stepplans_or_new().
+        """
+        return self._stepplans
+    @stepplans.setter
+    def stepplans(self, val):
+        if val is not None:
+            self._assert_type("stepplans", val, StepPlans)
+        self._stepplans = val
+
 
     #
     # Protected Methods for Subclasses
@@ -102,20 +153,34 @@ class EROutBase(EROut, AxPluginBase):
         return AxPluginBase._format_str(self, fmt,
             context=context, what=what, od_defaults = od_defaults)
 
+    def _stepplans_or_new(self):
+        """Return our StepPlans if any, else a new one."""
+        if self._stepplans is not None:
+            return self._stepplans
+        return StepPlans()
+
     def _format_datetime(self, fmt, dt):
         """
         Helper to format a datetime obj using strftime.
         If dt is None, returns empty string ("").
         Handles "%s" format (time_t) manually since this is not supported
-        on all platforms.
+        on all platforms, converting naive datetimes as server local time
+        unless extinfo specifies 'timezone' (see EpochConverter).
         """
         if dt is None:
             return ""
         self._assert_type("datetime", dt, datetime)
         if fmt == "%s":
-            return int(time.mktime(dt.timetuple()))  # datetime to time_t
+            return self._epoch_converter().to_time_t(dt)  # to time_t
         return dt.strftime(fmt)
 
+    def _epoch_converter(self):
+        """
+        Return shared EpochConverter for time_t conversions,
+        per optional extinfo 'timezone' (default server local time).
+        """
+        return get_converter(self.extinfo.get('timezone'))
+
 
     #
     # Internal Methods
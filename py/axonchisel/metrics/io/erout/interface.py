@@ -66,6 +66,47 @@ class EROut(AxPlugin):
         """
         raise NotImplementedError("EROut abstract superclass")
 
+    #
+    # Optional Methods
+    #
+
+    # optional
+    def plugin_output_series(self, dseries, query=None):
+        """
+        EROut plugins may optionally implement this method to support
+        streaming output, one DataSeries at a time as each is completed,
+        rather than a whole MultiDataSeries at once.
+        Invoked for each DataSeries of a query in order, followed by
+        plugin_output_finish() once all have been output.
+        Plugins implementing this should also implement plugin_output()
+        in terms of it.
+
+        Returns nothing. Output target should be configured separately.
+        This default implementation raises NotImplementedError,
+        indicating streaming is not supported.
 
+        Parameters:
 
+          - dseries : DataSeries query result with data to output.
+                    (axonchisel.metrics.foundation.data.series.DataSeries)
 
+          - query : optional Query source with more formatting details, etc.
+                    Optional. Plugins should work without access to Query.
+                    (axonchisel.metrics.foundation.query.query.Query)
+        """
+        raise NotImplementedError("EROut streaming not supported")
+
+    # optional
+    def plugin_output_finish(self, query=None):
+        """
+        EROut plugins may optionally implement this method to finish
+        streaming output of a query (see plugin_output_series),
+        e.g. to flush or close out the written structure.
+        This default implementation does nothing.
+
+        Parameters:
+
+          - query : optional Query source with more formatting details, etc.
+                    (axonchisel.metrics.foundation.query.query.Query)
+        """
+        pass
@@ -76,6 +76,23 @@ class EROut_csv(EROutBase):
                     Optional. Plugins should work without access to Query.
                     (axonchisel.metrics.foundation.query.query.Query)
         """
+        # Iterate MDS, writing each series:
+        for dseries in mdseries.iter_series():
+            self.plugin_output_series(dseries, query=query)
+        self.plugin_output_finish(query=query)
+
+
+    #
+    # Optional Method Implementations
+    #
+
+    # optional
+    def plugin_output_series(self, dseries, query=None):
+        """
+        EROut plugins may optionally implement this method to support
+        streaming output, one DataSeries at a time as each is completed.
+        Writes rows of the DataSeries immediately.
+        """
         # Prep CSV:
         fout = self.plugin_extinfo('fout')
         self._csvw = csv.DictWriter(fout, FIELDNAMES, dialect='excel')
@@ -83,9 +100,19 @@ class EROut_csv(EROutBase):
         # Write header (but only once):
         self._write_header_row()
 
-        # Iterate MDS, writing each series:
-        for dseries in mdseries.iter_series():
-            self._write_series(dseries)
+        # Write series:
+        self._write_series(dseries)
+
+    # optional
+    def plugin_output_finish(self, query=None):
+        """
+        EROut plugins may optionally implement this method to finish
+        streaming output of a query.
+        Flushes output (if supported), so rows reach reader promptly.
+        """
+        fout = self.plugin_extinfo('fout')
+        if hasattr(fout, 'flush'):
+            fout.flush()
 
     #
     # Internal Methods
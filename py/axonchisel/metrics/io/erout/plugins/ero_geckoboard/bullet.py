@@ -22,7 +22,7 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 import time
 
 from axonchisel.metrics.foundation.ax.dictutil import OrderedDict
-from axonchisel.metrics.foundation.chrono.stepper import Stepper
+from axonchisel.metrics.foundation.chrono.epochconv import get_converter
 
 from .base import EROut_geckoboard
 
@@ -217,12 +217,14 @@ class EROut_geckoboard_bullet(EROut_geckoboard):
         # Projected value based on current relative to query time frame:
         if self.query.qtimeframe.tmfrspec.mode == 'CURRENT':
             dseries = self._dseries
-            stepper = Stepper(dseries.tmfrspec, ghost=dseries.ghost)
-            tmrange = stepper.analyze()['tmrange']
+            tmrange = self._stepplans_or_new().analyze(dseries.tmfrspec,
+                ghost=dseries.ghost)['tmrange']
 
             # Calc tfrac as how far into time period we are, [0..1]
-            t0 = time.mktime(tmrange.inc_begin.timetuple())
-            t1 = time.mktime(tmrange.exc_end.timetuple())
+            # (naive times are server local, aware ones exact):
+            epochconv = get_converter()
+            t0 = epochconv.to_time_t(tmrange.inc_begin)
+            t1 = epochconv.to_time_t(tmrange.exc_end)
             tnow = time.time()
             tfrac = 1.0 * (tnow - t0) / (t1 - t0)
 
@@ -309,7 +309,7 @@ class EROut_geckoboard_numsec_trend(EROut_geckoboard_numsec):
         """
 
         # Get all values from first DataSeries:
-        values = [dp.value for dp in self.mdseries.get_series(0).iter_points()]
+        values = self.mdseries.get_series(0).values()
 
         # Add values:
         self.jout['item'].append(values)
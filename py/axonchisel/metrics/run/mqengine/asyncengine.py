@@ -0,0 +1,445 @@
+"""
+Ax_Metrics - AsyncMQEngine asynchronous metrics query running engine
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import collections
+import sys
+import threading
+import time
+
+from axonchisel.metrics.foundation.ax.future import \
+    AxFuture, AxFutureTimeout, AxThreadExecutor
+from axonchisel.metrics.foundation.data.point import DataPoint
+
+from .mqengine import MQEngine, FetchCancelled
+from .parallel import split_chunks, ObtainedPoints
+from . import decompose
+
+import logging
+log =  logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------------
+
+
+class AsyncMQEngine(MQEngine):
+    """
+    Metrics Query Engine variant which fetches asynchronously,
+    producing the same MultiDataSeries as MQEngine.
+
+    Rather than fetching up to series_workers series groups at once,
+    each in fetch_workers threads, AsyncMQEngine starts every series
+    group of every query at once, each issuing all its fetches (split
+    into up to fetch_workers chunks) as AxFutures without waiting,
+    then finishes each group in turn as its fetches complete.
+    Fetches in flight are instead bounded per backend (emfetch_id) by
+    backend_limit, which may be overridden per emfetch_id via extinfo:
+      {'<emfetch_id>': {'mqengine': {'backend_limit': 16}}}
+    Fetches are started as backend slots free up (from the thread
+    completing the previous fetch), so planning and scheduling never
+    block.
+
+    EMFetchers supporting the async contract (see EMFetcher
+    plugin_fetch_async / plugin_fetch_batch_async) fetch without
+    tying up a thread.  Synchronous EMFetchers are adapted by running
+    their blocking fetches on a per-backend thread executor.
+
+    See MQEngine for all other options and behavior.
+    """
+
+    def __init__(self,
+        metset,
+        emfetch_extinfo = None,  #  dict  (map pluginid:dict)
+        backend_limit   = 4,     #  int   (max concurrent fetches/backend)
+        **kwargs                 #  (see MQEngine)
+    ):
+        # Set valid default state:
+        self._backend_limit = 4
+        self._backend_lock  = threading.Lock()
+        self._executors     = dict()   # emfetch_id: AxThreadExecutor
+        self._slots         = dict()   # emfetch_id: BackendSlots
+
+        # Superclass init:
+        MQEngine.__init__(self, metset, emfetch_extinfo, **kwargs)
+
+        # Apply initial values from kwargs:
+        self.backend_limit  = backend_limit
+
+
+    #
+    # Public Properties
+    #
+
+    @property
+    def backend_limit(self):
+        """
+        Default max number of fetches in flight at once per backend
+        (emfetch_id).
+        May be overridden per emfetch_id in extinfo (see class docs).
+        """
+        return self._backend_limit
+    @backend_limit.setter
+    def backend_limit(self, val):
+        self._assert_type_int("backend_limit", val)
+        if val < 1:
+            raise ValueError("{self} backend_limit must be >= 1: {val}"
+                .format(self=self, val=val))
+        self._backend_limit = val
+
+
+    #
+    # Internal Methods
+    #
+
+    def _fetch_series_groups(self, groups, cancel, on_group_done):
+        """
+        Override from MQEngine -
+        Start fetching list of series groups all at once, then finish
+        each in turn (see _finish_series_group), invoking
+        on_group_done(idx) as each is fetched.
+        If any group fails, sets cancel Event to stop the rest, and
+        re-raises the error once those started have stopped (or the
+        deadline expired).
+        """
+        if self._deadline is not None and time.time() >= self._deadline:
+            cancel.set()   # (serve from cache only)
+        started = [self._start_series_group(group, cancel)
+            for group in groups]
+        try:
+            for (idx, start) in enumerate(started):
+                started[idx] = None
+                self._finish_series_group(groups[idx], start, cancel)
+                on_group_done(idx)
+        except:
+            (etype, evalue, etb) = sys.exc_info()
+            cancel.set()
+            for start in started:
+                if start is not None:
+                    timeout = None
+                    if self._deadline is not None:
+                        timeout = max(0, self._deadline - time.time())
+                    try:
+                        start[1].result(timeout=timeout)
+                    except:
+                        pass
+            raise etype, evalue, etb
+
+    def _start_series_group(self, group, cancel):
+        """
+        Start fetching list of DataSeries sharing same metric (see
+        MQEngine._fetch_series_group) without waiting.
+        Returns tuple (plan, future, obtained) of group plan (see
+        _plan_series_group), AxFuture of list of DataPoints fetched,
+        and ObtainedPoints collecting them as obtained.
+        """
+        plan = self._plan_series_group(group)
+        (mdef, all_steps, ranges, reframe_dt) = plan
+        obtained = ObtainedPoints()
+        try:
+            future = self._fetch_ranges_async(mdef, ranges, reframe_dt,
+                cancel, obtained.add)
+        except:
+            future = AxFuture()
+            future.set_exc_info(sys.exc_info())
+        return (plan, future, obtained)
+
+    def _finish_series_group(self, group, start, cancel):
+        """
+        Wait (only until deadline, if any) for fetches of list of
+        DataSeries started by _start_series_group, and add DataPoints to
+        each series.
+        If deadline expired first, sets cancel Event and keeps only the
+        DataPoints obtained by then (or in StepCache, if any).
+        """
+        ((mdef, all_steps, ranges, reframe_dt), future, obtained) = start
+        if self._deadline is None:
+            dpoints = future.result()
+        else:
+            try:
+                dpoints = future.result(
+                    timeout=max(0, self._deadline - time.time()))
+            except (AxFutureTimeout, FetchCancelled):
+                cancel.set()
+                dpoints = self._abandon_ranges(mdef, ranges, obtained)
+        self._fan_out_series_group(group, all_steps, dpoints)
+
+    def _fetch_ranges_async(self, mdef, steps, reframe_dt, cancel,
+            on_fetched=None):
+        """
+        Start fetching list of TimeRange steps (sorted by begin) for
+        MetricDef as MQEngine._fetch_ranges does, returning AxFuture of
+        list of DataPoints in same order.
+        """
+        if self._can_decompose(mdef, steps):
+            return self._fetch_decomposed_async(mdef, steps, reframe_dt,
+                cancel)
+        return self._fetch_cached_async(mdef, steps, reframe_dt, cancel,
+            on_fetched)
+
+    def _fetch_cached_async(self, mdef, steps, reframe_dt, cancel,
+            on_fetched=None):
+        """
+        Start fetching list of TimeRange steps for MetricDef as
+        MQEngine._fetch_cached does, returning AxFuture of list of
+        DataPoints in same order.
+        """
+        # Serve what we can from cache:
+        (cached, missing) = self._stepcache_get(mdef, steps)
+        if on_fetched is not None:
+            on_fetched([dpoint for dpoint in cached if dpoint is not None])
+
+        # Fetch missing data points, then assemble in step order:
+        def _assemble(fetched):
+            self._stepcache_put(mdef, fetched, reframe_dt)
+            fetched.reverse()
+            return [dpoint if dpoint is not None else fetched.pop()
+                for dpoint in cached]
+        return self._fetch_missing_async(mdef, missing, cancel,
+            on_fetched).then(_assemble)
+
+    def _fetch_missing_async(self, mdef, steps, cancel, on_fetched=None):
+        """
+        Start fetching list of TimeRange steps for MetricDef (bypassing
+        cache), split into up to fetch_workers chunks fetched at once,
+        returning AxFuture of list of DataPoints in same order.
+        """
+        workers = self.emfetch_option_for(
+            mdef.emfetch_id, 'fetch_workers', self.fetch_workers)
+        futures = [self._fetch_steps_async(mdef, chunk, cancel, on_fetched)
+            for chunk in split_chunks(steps, workers)]
+        def _join(chunks):
+            return [dpoint for dpoints in chunks for dpoint in dpoints]
+        return AxFuture.gather(futures).then(_join)
+
+    def _fetch_decomposed_async(self, mdef, steps, reframe_dt, cancel):
+        """
+        Start fetching list of overlapping TimeRange steps for MetricDef
+        as MQEngine._fetch_decomposed does, but fetching elementary ranges
+        for all funcs needed at once, returning AxFuture of list of
+        DataPoints in same order.
+        """
+        (ranges, spans) = decompose.elementary_ranges(steps)
+        log.info("Decomposed %d %s steps into %d ranges for %s",
+            len(steps), mdef.func, len(ranges), mdef)
+        funcs = ('SUM', 'COUNT') if mdef.func == 'AVG' else (mdef.func,)
+        futures = [self._fetch_cached_async(self._derive_mdef(mdef, func),
+            ranges, reframe_dt, cancel) for func in funcs]
+        def _combine(results):
+            values = dict((func, [dpoint.value for dpoint in dpoints])
+                for (func, dpoints) in zip(funcs, results))
+            dpoints = self._combine_decomposed(mdef, steps, spans,
+                values.get)
+            if dpoints is None:
+                return self._fetch_cached_async(mdef, steps, reframe_dt,
+                    cancel)
+            return AxFuture.from_result(dpoints)
+        return _chain(AxFuture.gather(futures), _combine)
+
+    def _fetch_steps_async(self, mdef, steps, cancel, on_fetched=None):
+        """
+        Start fetching list of TimeRange steps for MetricDef with a pooled
+        EMFetcher, returning AxFuture of list of DataPoints in same order.
+        Never blocks, as the fetch is only started once a backend_limit
+        slot is free (see _start_fetch_steps).
+        Optional on_fetched(dpoints) is invoked with DataPoints as soon
+        as fetched.
+        """
+        # Coalesced fetches are blocking, so run wholly on executor:
+        if self.singleflight is not None:
+            return self._backend_executor(mdef.emfetch_id).submit(
+                self._fetch_steps_coalesced, mdef, steps, cancel, on_fetched)
+
+        # Start fetch once backend slot is free:
+        slots = self._backend_slots(mdef.emfetch_id)
+        future = AxFuture()
+        def _copy(future2):
+            try:
+                future.set_result(future2.result())
+            except:
+                future.set_exc_info(sys.exc_info())
+        def _start():
+            try:
+                self._start_fetch_steps(mdef, steps, cancel, on_fetched,
+                    slots).add_done_callback(_copy)
+            except:
+                future.set_exc_info(sys.exc_info())
+        slots.start(_start)
+        return future
+
+    def _start_fetch_steps(self, mdef, steps, cancel, on_fetched, slots):
+        """
+        Start fetching list of TimeRange steps for MetricDef (see
+        _fetch_steps_async) in backend slot just taken from BackendSlots,
+        returning AxFuture of list of DataPoints, and releasing slot
+        once done.
+        Raises FetchCancelled if cancel Event was set meanwhile.
+        Blocking fetches run on executor, checking cancel Event before
+        each step.
+        """
+        # Acquire EMFetcher:
+        try:
+            if cancel.is_set():
+                raise FetchCancelled("{self} deadline expired"
+                    .format(self=self))
+            extinfo = self.emfetch_extinfo_for(mdef.emfetch_id)
+            emf = self._emfpool.acquire(mdef, extinfo)
+        except:
+            slots.release()
+            raise
+
+        # Start async fetch, or else blocking fetch on executor:
+        try:
+            future = emf.fetch_batch_async(steps)
+            if future is None:
+                future = self._backend_executor(mdef.emfetch_id).submit(
+                    emf.fetch_batch, steps, cancel, on_fetched)
+            elif on_fetched is not None:
+                def _notify(dpoints):
+                    on_fetched(dpoints)
+                    return dpoints
+                future = future.then(_notify)
+        except:
+            exc_info = sys.exc_info()
+            future = AxFuture()
+            future.set_exc_info(exc_info)
+
+        # Once done, return EMFetcher (unless failed) and slot:
+        def _done(future):
+            try:
+                future.result()
+                self._emfpool.release(emf)
+            except:
+                self._emfpool.discard(emf)
+            finally:
+                slots.release()
+        future.add_done_callback(_done)
+        return future
+
+    def _backend_slots(self, emfetch_id):
+        """Return BackendSlots limiting fetches in flight for emfetch_id."""
+        with self._backend_lock:
+            slots = self._slots.get(emfetch_id)
+            if slots is None:
+                slots = self._slots[emfetch_id] = BackendSlots(
+                    self._backend_limit_for(emfetch_id))
+            return slots
+
+    def _backend_executor(self, emfetch_id):
+        """Return thread executor for blocking fetches for emfetch_id."""
+        with self._backend_lock:
+            executor = self._executors.get(emfetch_id)
+            if executor is None:
+                executor = self._executors[emfetch_id] = AxThreadExecutor(
+                    self._backend_limit_for(emfetch_id),
+                    name="mqe-%s" % emfetch_id)
+            return executor
+
+    def _backend_limit_for(self, emfetch_id):
+        """Return backend_limit for emfetch_id."""
+        return self.emfetch_option_for(
+            emfetch_id, 'backend_limit', self.backend_limit)
+
+    def _release_resources(self):
+        """
+        Override from MQEngine -
+        Also shut down backend executors, without waiting for any
+        abandoned (deadline expired) fetches, which finish in background.
+        """
+        with self._backend_lock:
+            executors = self._executors.values()
+            self._executors = dict()
+            self._slots = dict()
+        for executor in executors:
+            executor.shutdown(wait=False)
+        MQEngine._release_resources(self)
+
+    def __unicode__(self):
+        return (u"AsyncMQEngine({self._state})"
+        ).format(self=self)
+
+
+# ----------------------------------------------------------------------------
+
+
+class BackendSlots(object):
+    """
+    Non-blocking limit of fetches in flight at once for one backend.
+
+    Rather than waiting for a free slot, callers hand over a callable
+    to start their fetch, invoked (taking a slot) right away if one is
+    free, or else in turn from the thread releasing one.
+    Each started fetch must release() its slot exactly once when done.
+    Started callables must not raise.
+    """
+
+    def __init__(self, limit):
+        """Init with int max fetches in flight."""
+        self._lock     = threading.Lock()
+        self._free     = limit
+        self._waiting  = collections.deque()   # callables to start
+        self._draining = False
+
+    def start(self, func):
+        """Call func() once a slot is free, taking it."""
+        with self._lock:
+            self._waiting.append(func)
+        self._drain()
+
+    def release(self):
+        """Release slot taken by a started callable."""
+        with self._lock:
+            self._free += 1
+        self._drain()
+
+    def _drain(self):
+        """
+        Start waiting callables while slots are free.
+        Only one thread drains at a time, looping rather than recursing
+        if callables release slots right away (e.g. if cancelled).
+        """
+        with self._lock:
+            if self._draining:
+                return
+            self._draining = True
+        while True:
+            with self._lock:
+                if not (self._waiting and self._free):
+                    self._draining = False
+                    return
+                self._free -= 1
+                func = self._waiting.popleft()
+            func()
+
+
+# ----------------------------------------------------------------------------
+
+
+def _chain(future, func):
+    """
+    Return new AxFuture with result of the AxFuture returned by
+    func(result) once future is done, or same error if either failed
+    (or func raises).
+    """
+    future2 = AxFuture()
+    def _copy(future3):
+        try:
+            future2.set_result(future3.result())
+        except:
+            future2.set_exc_info(sys.exc_info())
+    def _then(future):
+        try:
+            future3 = func(future.result())
+        except:
+            future2.set_exc_info(sys.exc_info())
+        else:
+            future3.add_done_callback(_copy)
+    future.add_done_callback(_then)
+    return future2
@@ -0,0 +1,202 @@
+"""
+Ax_Metrics - MQEngine decomposition of overlapping steps
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import collections
+
+from axonchisel.metrics.foundation.chrono.timerange import FrozenTimeRange
+
+
+# ----------------------------------------------------------------------------
+
+
+# MetricDef funcs whose value over a range can be derived from values over
+# the elementary sub ranges partitioning it.
+# (AVG requires paired SUM and COUNT values, see combine_avg.)
+DECOMPOSABLE_FUNCS = ('SUM', 'COUNT', 'MIN', 'MAX', 'AVG', 'FIRST', 'LAST')
+
+# MetricDef data_types with integral values, whose SUMs (and AVGs)
+# combine exactly, unlike floats.
+INTEGRAL_DATA_TYPES = ('NUM_INT', 'MONEY_INT100')
+
+
+# ----------------------------------------------------------------------------
+
+
+def steps_overlap(steps):
+    """
+    Check T/F if any of list of TimeRange steps (in order) overlap,
+    as when smoothing or accumulating.
+    """
+    for n in range(1, len(steps)):
+        if steps[n].inc_begin < steps[n-1].exc_end:
+            return True
+    return False
+
+def elementary_ranges(steps):
+    """
+    Partition list of (possibly overlapping) TimeRange steps into sorted
+    non-overlapping elementary TimeRanges, split at every step boundary,
+    such that each step is the union of a contiguous run of them.
+    Returns tuple (ranges, spans) where ranges is list of elementary
+    TimeRanges (anchored at their begin) and spans is list parallel to
+    steps of (first, last+1) indexes into ranges.
+    """
+    # Find all boundaries, and which elementary ranges any step covers:
+    bounds = sorted(set([s.inc_begin for s in steps] +
+                        [s.exc_end for s in steps]))
+    bidx = dict((b, n) for (n, b) in enumerate(bounds))
+    cover = [0] * len(bounds)
+    for s in steps:
+        cover[bidx[s.inc_begin]] += 1
+        cover[bidx[s.exc_end]] -= 1
+
+    # Construct covered elementary ranges, mapping boundary to range index:
+    ranges = list()
+    ridx = dict()
+    depth = 0
+    for n in range(len(bounds) - 1):
+        ridx[bounds[n]] = len(ranges)
+        depth += cover[n]
+        if depth > 0:
+            ranges.append(FrozenTimeRange.from_trusted(anchor=bounds[n],
+                inc_begin=bounds[n], exc_end=bounds[n+1]))
+    ridx[bounds[-1]] = len(ranges)
+
+    # Map steps to spans of elementary ranges:
+    spans = [(ridx[s.inc_begin], ridx[s.exc_end]) for s in steps]
+    return (ranges, spans)
+
+def combines_exactly(func, data_type):
+    """
+    Check T/F if values of MetricDef func over data_type can be combined
+    from elementary ranges exactly as if fetched directly.
+    """
+    if func in ('SUM', 'AVG'):
+        return data_type in INTEGRAL_DATA_TYPES
+    return func in DECOMPOSABLE_FUNCS
+
+def all_integral(values):
+    """
+    Check T/F if all of values (None = missing) are ints (or longs),
+    so their sums combine exactly (unlike floats).
+    """
+    return all(isinstance(v, (int, long)) for v in values if v is not None)
+
+def combine_sums(values, spans):
+    """
+    Return list of sums of values (None = missing) over each span,
+    via prefix sums. Sum of all missing values is None.
+    E.g. accumulated steps (all spans starting at 0) yield running totals.
+    """
+    (sums, counts) = _prefix_sums(values)
+    return [(sums[j] - sums[i]) if counts[j] > counts[i] else None
+        for (i, j) in spans]
+
+def combine_firstlast(values, spans, func):
+    """
+    Return list of FIRST or LAST (per func) non-missing value (None =
+    missing) within each span, or None if all missing.
+    E.g. accumulated steps (all spans starting at 0) yield the first
+    value overall, and the latest value so far, respectively.
+    """
+    if func == 'FIRST':
+        # Index of first non-None value at or after each index:
+        nxt = [len(values)] * (len(values) + 1)
+        for k in range(len(values) - 1, -1, -1):
+            nxt[k] = k if values[k] is not None else nxt[k+1]
+        return [values[nxt[i]] if nxt[i] < j else None for (i, j) in spans]
+    elif func == 'LAST':
+        # Index of last non-None value before each index:
+        prv = [-1] * (len(values) + 1)
+        for k in range(len(values)):
+            prv[k+1] = k if values[k] is not None else prv[k]
+        return [values[prv[j]] if prv[j] >= i else None for (i, j) in spans]
+    else:
+        raise ValueError("Unsupported first/last func: {0}".format(func))
+
+def combine_avg(sums, counts, spans):
+    """
+    Return list of averages over each span from parallel lists of SUM and
+    COUNT values, or None where count is 0 or missing.
+    """
+    result = list()
+    for (s, c) in zip(combine_sums(sums, spans), combine_sums(counts, spans)):
+        if s is None or not c:
+            result.append(None)
+        else:
+            result.append(float(s) / c)
+    return result
+
+def combine_extremes(values, spans, func):
+    """
+    Return list of MIN or MAX (per func) of values (None = missing) over
+    each span, or None if all missing.
+    Uses monotonic deque sliding window when spans advance monotonically
+    (as Stepper steps do), else falls back to scanning each span.
+    """
+    if func == 'MIN':
+        better = lambda a, b: a <= b
+    elif func == 'MAX':
+        better = lambda a, b: a >= b
+    else:
+        raise ValueError("Unsupported extremes func: {0}".format(func))
+
+    # Fall back to simple scan unless spans monotonic:
+    for n in range(1, len(spans)):
+        if (spans[n][0] < spans[n-1][0]) or (spans[n][1] < spans[n-1][1]):
+            return [_scan_extreme(values[i:j], better) for (i, j) in spans]
+
+    # Slide window, keeping deque of indexes of candidate extremes:
+    result = list()
+    window = collections.deque()
+    hi = 0
+    for (i, j) in spans:
+        while hi < j:
+            v = values[hi]
+            if v is not None:
+                while window and better(v, values[window[-1]]):
+                    window.pop()
+                window.append(hi)
+            hi += 1
+        while window and window[0] < i:
+            window.popleft()
+        result.append(values[window[0]] if window else None)
+    return result
+
+
+# ----------------------------------------------------------------------------
+
+
+def _prefix_sums(values):
+    """
+    Return tuple (sums, counts) of prefix sums of values (None = 0) and
+    prefix counts of non-None values, each one longer than values.
+    """
+    sums = [0]
+    counts = [0]
+    for v in values:
+        if v is None:
+            sums.append(sums[-1])
+            counts.append(counts[-1])
+        else:
+            sums.append(sums[-1] + v)
+            counts.append(counts[-1] + 1)
+    return (sums, counts)
+
+def _scan_extreme(values, better):
+    """Return best of values (None = missing) per better(), or None."""
+    best = None
+    for v in values:
+        if v is not None and (best is None or better(v, best)):
+            best = v
+    return best
+
@@ -0,0 +1,139 @@
+"""
+Ax_Metrics - MQEngine pool of reusable EMFetcher plugin instances
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import collections
+import threading
+
+from axonchisel.metrics.foundation.ax.obj import AxObj
+
+import logging
+log =  logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------------
+
+
+class EMFetcherPool(AxObj):
+    """
+    Pool of created (plugin_create'd) EMFetchers reused across DataSeries.
+
+    Fetchers are keyed by MetricDef fingerprint (including extinfo),
+    so a fetcher is only ever reused for exactly what it was built for,
+    even across distinct but equivalent MetricDef objects.
+    Expensive setup done in plugin_create (e.g. HTTP sessions, DB
+    connections) is thus paid once per pool lifetime instead of once
+    per DataSeries.
+
+    Each acquired fetcher is owned exclusively by the caller until it is
+    released, honoring the AxPlugin rule that one plugin instance handles
+    only one operation at a time.  Concurrent callers asking for the same
+    key get distinct instances.
+
+    Lifecycle: acquire/release (or discard) any number of times from any
+    number of threads, then destroy() once to plugin_destroy all fetchers.
+    """
+
+    def __init__(self, factory):
+        """
+        Init around factory callable(mdef, extinfo) returning new EMFetcher.
+        """
+        self._factory = factory
+        self._lock    = threading.Lock()
+        self._idle    = collections.defaultdict(list)  # key: [emf, ...]
+        self._keys    = dict()   # id(emf): key, for all live fetchers
+        self._fetchers = list()  # all live fetchers (idle or acquired)
+        self.count_created  = 0
+        self.count_acquired = 0
+
+
+    #
+    # Public Methods
+    #
+
+    def acquire(self, mdef, extinfo):
+        """
+        Return an exclusively owned, created EMFetcher for MetricDef and
+        extinfo dict, reusing an idle one if available.
+        Caller must later release() or discard() it.
+        """
+        key = self._make_key(mdef, extinfo)
+        with self._lock:
+            self.count_acquired += 1
+            idle = self._idle[key]
+            if idle:
+                return idle.pop()
+
+        # Create new fetcher outside lock (AxPluginLoadError on error):
+        emf = self._factory(mdef, extinfo)
+        emf.plugin_create()
+        with self._lock:
+            self.count_created += 1
+            self._keys[id(emf)] = key
+            self._fetchers.append(emf)
+        return emf
+
+    def release(self, emf):
+        """
+        Return previously acquired EMFetcher to pool for reuse,
+        or destroy it if pool was destroyed since.
+        """
+        with self._lock:
+            key = self._keys.get(id(emf))
+            if key is not None:
+                self._idle[key].append(emf)
+                return
+        emf.plugin_destroy()
+
+    def discard(self, emf):
+        """
+        Remove previously acquired EMFetcher from pool and destroy it,
+        e.g. after it raised an error and may be in an unknown state.
+        """
+        with self._lock:
+            if self._keys.pop(id(emf), None) is not None:
+                self._fetchers.remove(emf)
+        emf.plugin_destroy()
+
+    def destroy(self):
+        """
+        Destroy all idle pooled EMFetchers and empty pool.
+        Any still acquired (e.g. by abandoned fetches) are destroyed
+        once released or discarded.
+        """
+        with self._lock:
+            fetchers = [emf for idle in self._idle.values() for emf in idle]
+            self._idle     = collections.defaultdict(list)
+            self._keys     = dict()
+            self._fetchers = list()
+        if fetchers:
+            log.info("Destroying %d pooled EMFetchers (%d acquisitions)",
+                len(fetchers), self.count_acquired)
+        for emf in fetchers:
+            emf.plugin_destroy()
+
+    def count_fetchers(self):
+        """Return number of live (created, not destroyed) EMFetchers."""
+        return len(self._fetchers)
+
+
+    #
+    # Internal Methods
+    #
+
+    def _make_key(self, mdef, extinfo):
+        """Return hashable pool key for MetricDef and extinfo."""
+        return mdef.fingerprint(extinfo)
+
+    def __unicode__(self):
+        return (u"EMFetcherPool({n} fetchers)"
+        ).format(n=len(self._fetchers))
+
@@ -11,20 +11,34 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 
 
 import collections
+import copy
+from datetime import datetime, timedelta
+import threading
 import time
 
 from axonchisel.metrics.foundation.ax.obj import AxObj
+from axonchisel.metrics.foundation.ax.future import AxFutureTimeout
 import axonchisel.metrics.foundation.ax.plugin as axplugin
+from axonchisel.metrics.foundation.ax.dictutil import dict_get_by_path
 
-from axonchisel.metrics.foundation.chrono.stepper import Stepper
+from axonchisel.metrics.foundation.chrono.stepper import StepPlans
+from axonchisel.metrics.foundation.chrono.tztable import TZOffset
 from axonchisel.metrics.foundation.metricdef.metset import MetSet
 from axonchisel.metrics.foundation.data.point import DataPoint
 from axonchisel.metrics.foundation.data.series import DataSeries 
+from axonchisel.metrics.foundation.data.columnar import ColumnarDataSeries
 from axonchisel.metrics.foundation.data.multi import MultiDataSeries 
 from axonchisel.metrics.foundation.query.query import Query
 import axonchisel.metrics.io.emfetch.base
+from axonchisel.metrics.io.emfetch.interface import FetchCancelled
 
 from .mqestate import MQEState
+from .emfpool import EMFetcherPool
+from .stepcache import StepCache
+from .singleflight import SingleFlight
+from .parallel import parallel_map, split_chunks, call_in_thread, \
+    ObtainedPoints
+from . import decompose
 
 import logging
 log =  logging.getLogger(__name__)
@@ -36,6 +50,15 @@ log =  logging.getLogger(__name__)
 # Special extinfo domain for common property defaults.
 EXTINFO_DOMAIN_DEFAULT = '_default'
 
+# Special extinfo key (within any emfetch_id domain) holding dict of
+# MQEngine options overriding engine defaults for that EMFetcher, e.g.:
+#   {'http': {'mqengine': {'fetch_workers': 8}}}
+EXTINFO_KEY_MQENGINE = 'mqengine'
+
+# Suffix format of fingerprint_for MetricDefs with nonzero settle_secs,
+# so steps closed under one horizon are never served under another.
+SETTLE_KEY_SUFFIX = '~settle{0!r}'
+
 
 # ----------------------------------------------------------------------------
 
@@ -48,54 +71,192 @@ class MQEngine(AxObj):
     It can execute a Query to generate MultiDataSeries result.
 
     Lifecycle: An MQEngine instance can execute as many queries
-    as desired, but only one at a time.
+    as desired, but only one at a time (or one batch via query_many,
+    which dedupes identical fetches across the batch).
+    EMFetchers are created once and reused across all series of a query,
+    then destroyed when the query completes.  To keep them alive across
+    multiple queries (e.g. a whole Servant request), bracket the queries
+    with open_session() and close_session().
+    Rather than waiting for all results, query_stream() delivers each
+    DataSeries (in order) as soon as it is complete.
+    Given a timeout, fetches still outstanding when it expires are
+    abandoned (and cancelled before any further backend requests,
+    even by fetches already in progress, though not those of queries
+    executed since),
+    with their DataPoint values left None (missing), so results are
+    still complete and well-formed, just with gaps.
+
+    Concurrency: All DataSeries of a query (each qmetric, div metric,
+    and ghost) are independent.  Those of the same metric are grouped,
+    with the distinct TimeRanges across them (e.g. primary and ghost
+    steps in common) each fetched once.  Up to series_workers groups may
+    be fetched concurrently, with results assembled in the same order
+    regardless.
+    Steps of each series may be fetched concurrently by up
+    to fetch_workers threads, each using its own EMFetcher instance
+    (as AxPlugins handle only one operation at a time).
+    The fetch_workers default may be overridden per emfetch_id via extinfo:
+      {'<emfetch_id>': {'mqengine': {'fetch_workers': 8}}}
+
+    Caching: If a StepCache is provided, each step's DataPoint value is
+    looked up there first (keyed by fingerprint_for MetricDef and
+    TimeRange, so engines with differently configured EMFetchers, or
+    metrics with different settle_secs, never share entries) and only
+    missing steps are fetched, with the results then stored.
+    Closed steps, ending at least MetricDef settle_secs before the pinned
+    reframe_dt (or the current time, if earlier), will never change and
+    so are cached with no expiry (until StepCache.invalidate).  Open
+    (in progress or unsettled) steps are cached for only stepcache_ttl
+    seconds (None = not cached).
+    A single StepCache may be shared by many MQEngines.
+    Even without one, refresh() reuses closed steps of a previous result.
+    Similarly, a shared SingleFlight makes concurrent MQEngines wait for
+    each other's in-flight fetches of the same steps rather than
+    duplicating them.
+
+    Decomposition: Overlapping steps (e.g. 30 DAY smoothing at DAY
+    granularity, or accumulation) would make the backend scan the same
+    data many times.  The engine instead fetches each elementary range
+    between step boundaries once and combines them per MetricDef func
+    (AVG via paired SUM and COUNT fetches), making e.g. accumulated
+    series running totals over disjoint gran buckets.
+    This changes the backend query pattern, so is opt-in: enable with
+    decompose=True, or per emfetch_id via extinfo:
+      {'<emfetch_id>': {'mqengine': {'decompose': True}}}
+    SUM (and AVG) are decomposed only for integral data_types (NUM_INT,
+    MONEY_INT100), whose sums combine exactly, while float data is
+    fetched directly (as are steps of any non-integral SUM values
+    encountered anyway), so results are always identical to direct
+    fetches.
+
+    Storage: With columnar=True, result DataSeries are
+    ColumnarDataSeries, storing points compactly in arrays rather than
+    as objects, e.g. for long fine grained series.
     """
 
     def __init__(self,
         metset,
-        emfetch_extinfo = None  #  dict  (map pluginid:dict)
+        emfetch_extinfo = None,  #  dict  (map pluginid:dict)
+        fetch_workers   = 1,     #  int   (max concurrent fetchers/series)
+        series_workers  = 1,     #  int   (max concurrent series/query)
+        stepcache       = None,  #  StepCache (optional)
+        stepcache_ttl   = 60,    #  int/float (open step secs, or None)
+        decompose       = False, #  bool  (decompose overlapping steps)
+        singleflight    = None,  #  SingleFlight (optional)
+        columnar        = False, #  bool  (ColumnarDataSeries results)
+        stepplans       = None,  #  StepPlans (optional, shared memo)
     ):
         # Set valid default state:
+        self._state           = None
         self._metset          = MetSet()
         self._emfetch_extinfo = dict()
+        self._fetch_workers   = 1
+        self._series_workers  = 1
+        self._stepcache       = None
+        self._stepcache_ttl   = 60
+        self._decompose       = False
+        self._singleflight    = None
+        self._columnar        = False
+        self._stepplans       = None
 
         # Apply initial values from kwargs:
         self.metset           = metset
         if emfetch_extinfo is not None:
             self.emfetch_extinfo  = emfetch_extinfo
+        self.fetch_workers    = fetch_workers
+        self.series_workers   = series_workers
+        self.stepcache        = stepcache
+        self.stepcache_ttl    = stepcache_ttl
+        self.decompose        = decompose
+        self.singleflight     = singleflight
+        self.columnar         = columnar
+        self.stepplans        = stepplans
 
         # Prep internal state:
         self._state = MQEState(self)
+        self._emfpool = EMFetcherPool(self._make_emfetcher_for_mdef)
+        self._session_open = False
+        self._derived_mdefs = dict()  # (id(mdef), func): (mdef, derived)
+        self._derived_lock = threading.Lock()
+        self._deadline = None   # time.time() to abandon fetches, or None
+        self._reused = dict()   # id(dseries): {(begin, end): value}
+        self._run_stepplans = None   # StepPlans of current execution
 
 
     #
     # Public Methods
     #
 
-    def query(self, q):
+    def query(self, q, timeout=None):
         """
         Main entrypoint to execute a Query and return a MultiDataSeries.
+        Optional timeout (secs) abandons fetches still outstanding by
+        then, leaving their values missing (see class docs).
         """
+        return self.query_many([q], timeout=timeout)[0]
 
-        # Prep:
-        self._assert_type("query", q, Query)
-        self._state.reset(query=q)
-        self._state.pin_tmfrspec()
-
-        # Log begin:
-        t0 = time.time()
-        log.info("Executing %s", q)
-
-        # Fetch stats:
-        self._fetch_main_metrics()
-        self._fetch_ghost_metrics()
+    def refresh(self, previous_mdseries, q, timeout=None):
+        """
+        Execute a Query as query() does, given MultiDataSeries previously
+        returned for it, returning a new MultiDataSeries.
+        Values of previous steps which are still stepped by the query and
+        are closed (see Caching) are reused rather than fetched again,
+        so e.g. re-running a CURRENT mode query each minute fetches only
+        its final open step (or new steps if the period rolled over).
+        """
+        return self.query_many([q], timeout=timeout,
+            previous=[previous_mdseries])[0]
 
-        # Log end:
-        t9 = time.time()
-        log.info("Completed %s in %0.3fs", q, t9-t0)
+    def query_many(self, queries, timeout=None, previous=None):
+        """
+        Execute list of Querys together, returning list of
+        MultiDataSeries in same order, each exactly as query() would.
+        All queries are planned up front and pinned to the same "now",
+        so identical (metric, TimeRange) fetches across them are
+        made only once.
+        Optional previous is list parallel to queries of MultiDataSeries
+        (or None) previously returned for them to refresh (see refresh).
+        """
+        def _on_series(state, dseries):
+            state.mdseries.add_series(dseries)
+        states = self._execute(queries, _on_series,
+            timeout=timeout, previous=previous)
+        return [state.mdseries for state in states]
+
+    def query_stream(self, queries, on_series, on_query_done=None,
+        timeout=None, previous=None):
+        """
+        Execute list of Querys together as query_many() does, but rather
+        than returning results, deliver each DataSeries by invoking
+        on_series(dseries, query) as soon as it and all DataSeries
+        before it are complete, in the same order query_many() would
+        return them.  Optional on_query_done(query) is invoked once all
+        DataSeries of each query have been delivered.
+        DataSeries are not retained once delivered, so memory use is
+        bounded by series in progress rather than all results.
+        Callbacks may be invoked from worker threads, but one at a time.
+        """
+        def _on_series(state, dseries):
+            on_series(dseries, state.query)
+        def _on_query_done(state):
+            if on_query_done is not None:
+                on_query_done(state.query)
+        self._execute(queries, _on_series, _on_query_done,
+            timeout=timeout, previous=previous)
+
+    def open_session(self):
+        """
+        Begin session during which EMFetchers are kept alive and reused
+        across queries, until close_session().
+        """
+        self._session_open = True
 
-        # Return MultiDataSeries:
-        return self._state.mdseries
+    def close_session(self):
+        """
+        End session begun by open_session(), destroying all EMFetchers.
+        """
+        self._session_open = False
+        self._release_resources()
 
     def emfetch_extinfo_for(self, plugin_id):
         """
@@ -106,6 +267,32 @@ class MQEngine(AxObj):
         extinfo.update(self.emfetch_extinfo.get(plugin_id, {}))
         return extinfo
 
+    def fingerprint_for(self, mdef):
+        """
+        Return fingerprint of MetricDef as fetched by this engine, i.e.
+        including its EMFetcher extinfo (less MQEngine options, which
+        don't change data), as used in StepCache and SingleFlight keys,
+        e.g. for StepCache.invalidate.
+        Any nonzero settle_secs is included too, as it decides which
+        steps are cached as closed (see class docs).
+        """
+        extinfo = self.emfetch_extinfo_for(mdef.emfetch_id)
+        extinfo.pop(EXTINFO_KEY_MQENGINE, None)
+        fingerprint = mdef.fingerprint(extinfo)
+        if mdef.settle_secs:
+            fingerprint += SETTLE_KEY_SUFFIX.format(float(mdef.settle_secs))
+        return fingerprint
+
+    def emfetch_option_for(self, plugin_id, option, default):
+        """
+        Return MQEngine option value for given plugin_id, using 'mqengine'
+        dict within its extinfo (see emfetch_extinfo_for) if specified
+        there, else default.
+        """
+        extinfo = self.emfetch_extinfo_for(plugin_id)
+        return dict_get_by_path(extinfo,
+            "%s.%s" % (EXTINFO_KEY_MQENGINE, option), default=default)
+
 
     #
     # Public Properties
@@ -135,53 +322,256 @@ class MQEngine(AxObj):
         self._assert_type("emfetch_extinfo", val, collections.Mapping)
         self._emfetch_extinfo = val
 
+    @property
+    def fetch_workers(self):
+        """
+        Default max number of worker threads (each with own EMFetcher)
+        fetching steps of a single series concurrently. 1 = serial.
+        May be overridden per emfetch_id in extinfo (see class docs).
+        """
+        return self._fetch_workers
+    @fetch_workers.setter
+    def fetch_workers(self, val):
+        self._assert_type_int("fetch_workers", val)
+        if val < 1:
+            raise ValueError("{self} fetch_workers must be >= 1: {val}"
+                .format(self=self, val=val))
+        self._fetch_workers = val
+
+    @property
+    def series_workers(self):
+        """
+        Max number of worker threads fetching independent DataSeries
+        (qmetrics, div metrics, ghosts) of a query concurrently. 1 = serial.
+        """
+        return self._series_workers
+    @series_workers.setter
+    def series_workers(self, val):
+        self._assert_type_int("series_workers", val)
+        if val < 1:
+            raise ValueError("{self} series_workers must be >= 1: {val}"
+                .format(self=self, val=val))
+        self._series_workers = val
+
+    @property
+    def stepcache(self):
+        """Optional StepCache of fetched step values (or None)."""
+        return self._stepcache
+    @stepcache.setter
+    def stepcache(self, val):
+        if val is not None:
+            self._assert_type("stepcache", val, StepCache)
+        self._stepcache = val
+
+    @property
+    def stepcache_ttl(self):
+        """
+        Seconds that stepcache entries for open (unsettled) steps live,
+        or None to not cache open steps at all. Closed steps never expire.
+        """
+        return self._stepcache_ttl
+    @stepcache_ttl.setter
+    def stepcache_ttl(self, val):
+        if val is not None:
+            self._assert_type_numeric("stepcache_ttl", val)
+            if val <= 0:
+                raise ValueError("{self} stepcache_ttl must be > 0: {val}"
+                    .format(self=self, val=val))
+        self._stepcache_ttl = val
+
+    @property
+    def decompose(self):
+        """
+        Whether to fetch overlapping (smoothed, accumulated) steps of
+        decomposable funcs via non-overlapping elementary ranges,
+        each fetched once, rather than fetching each wide step directly.
+        May be overridden per emfetch_id in extinfo (see class docs).
+        """
+        return self._decompose
+    @decompose.setter
+    def decompose(self, val):
+        self._assert_type_bool("decompose", val)
+        self._decompose = val
+
+    @property
+    def columnar(self):
+        """
+        Whether to return results as ColumnarDataSeries (see class docs)
+        rather than DataSeries.
+        """
+        return self._columnar
+    @columnar.setter
+    def columnar(self, val):
+        self._assert_type_bool("columnar", val)
+        self._columnar = val
+
+    @property
+    def singleflight(self):
+        """
+        Optional SingleFlight coalescing identical in-flight step fetches
+        (typically shared by all MQEngines of a process), or None.
+        """
+        return self._singleflight
+    @singleflight.setter
+    def singleflight(self, val):
+        if val is not None:
+            self._assert_type("singleflight", val, SingleFlight)
+        self._singleflight = val
+
+    @property
+    def stepplans(self):
+        """
+        Optional StepPlans memo of steps to share with others, such as
+        other MQEngine executions or EROuts of a Servant request, or None.
+        Each execution (query, query_many, ...) shares steps among all
+        its series regardless, using a new StepPlans if None.
+        """
+        return self._stepplans
+    @stepplans.setter
+    def stepplans(self, val):
+        if val is not None:
+            self._assert_type("stepplans", val, StepPlans)
+        self._stepplans = val
+
 
     #
     # Internal Methods
     #
 
-    def _fetch_main_metrics(self):
+    def _execute(self, queries, on_series, on_query_done=None,
+        timeout=None, previous=None):
+        """
+        Execute list of Querys together (see query_stream), invoking
+        on_series(state, dseries) for each DataSeries in order and
+        optional on_query_done(state) after each query, with MQEState of
+        its query, abandoning fetches after optional timeout secs,
+        and reusing closed steps of optional list of previous results.
+        Returns list of MQEStates in same order as queries.
+        """
+
+        # Prep:
+        queries = list(queries)
+        for q in queries:
+            self._assert_type("query", q, Query)
+        if previous is None:
+            previous = [None] * len(queries)
+        previous = list(previous)
+        if len(previous) != len(queries):
+            raise ValueError("{self} previous results must match {n} queries"
+                .format(self=self, n=len(queries)))
+        for mdseries in previous:
+            if mdseries is not None:
+                self._assert_type("previous", mdseries, MultiDataSeries)
+        if timeout is not None:
+            self._assert_type_numeric("timeout", timeout)
+        now = time.time()   # (absolute, as local time may be ambiguous)
+
+        # Log begin:
+        t0 = time.time()
+        for q in queries:
+            log.info("Executing %s", q)
+        self._deadline = (t0 + timeout) if timeout is not None else None
+        cancel = threading.Event()   # set once deadline expired
+        self._run_stepplans = self.stepplans
+        if self._run_stepplans is None:
+            self._run_stepplans = StepPlans()
+
+        # Plan all series of all queries up front, then fetch stats:
+        try:
+            states = list()
+            plans = list()
+            owners = list()   # index into states for each plan
+            for (q, prev_mdseries) in zip(queries, previous):
+                self._state = MQEState(self)
+                self._state.reset(query=q)
+                self._state.pin_tmfrspec(now=now)
+                qplans = self._plan_main_metrics()
+                qplans.extend(self._plan_ghost_metrics())
+                if prev_mdseries is not None:
+                    self._plan_reuse(qplans, prev_mdseries)
+                plans.extend(qplans)
+                owners.extend([len(states)] * len(qplans))
+                states.append(self._state)
+
+            # Deliver plans in order, finishing each query after its last:
+            remaining = [owners.count(n) for n in range(len(states))]
+            finished = [0]
+            def _finish_queries():
+                while (finished[0] < len(states)) and \
+                        not remaining[finished[0]]:
+                    if on_query_done is not None:
+                        on_query_done(states[finished[0]])
+                    finished[0] += 1
+            def _on_plan(n, plan):
+                on_series(states[owners[n]], self._assemble_plan(plan))
+                remaining[owners[n]] -= 1
+                _finish_queries()
+            _finish_queries()
+            self._fetch_plans(plans, _on_plan, cancel)
+        finally:
+            self._deadline = None
+            self._reused = dict()
+            self._run_stepplans = None
+            if not self._session_open:
+                self._release_resources()
+
+        # Log end:
+        t9 = time.time()
+        for q in queries:
+            log.info("Completed %s in %0.3fs", q, t9-t0)
+
+        return states
+
+    def _plan_main_metrics(self):
         """
-        Fetch the main metrics from the query QData.
-        Accumulates into MultiDataSeries.
+        Plan the main metrics from the query QData.
+        Returns list of series plans (see _plan_metrics).
         """
         log.info("Processing primary qmetrics from %s", self._state.query)
 
-        # Fetch primary metrics:
+        # Plan primary metrics:
         series_id_pfx = 'Q_{q.id}_M_'.format(
             q=self._state.query)
-        self._fetch_metrics(series_id_pfx)
+        return self._plan_metrics(series_id_pfx)
 
 
-    def _fetch_ghost_metrics(self):
+    def _plan_ghost_metrics(self):
         """
-        Fetch the ghost metrics from the query QGhosts.
+        Plan the ghost metrics from the query QGhosts.
+        Returns list of series plans (see _plan_metrics).
         """
         log.info("Processing ghost qmetrics from %s", self._state.query)
 
         # Loop over Ghosts:
+        plans = list()
         ghosts = self._state.query.qghosts.get_ghosts()
         for i, ghost in enumerate(ghosts):
 
             log.info("Processing ghost %d/%d %s from %s",
                 i+1, len(ghosts), ghost, self._state.query)
 
-            # Fetch ghost metrics:
+            # Plan ghost metrics:
             series_id_pfx = 'Q_{q.id}_G_{g.gtype}_'.format(
                 g=ghost, q=self._state.query)
-            self._fetch_metrics(series_id_pfx, ghost=ghost)
+            plans.extend(self._plan_metrics(series_id_pfx, ghost=ghost))
 
+        return plans
 
-    def _fetch_metrics(self, series_id_pfx, ghost=None):
+
+    def _plan_metrics(self, series_id_pfx, ghost=None):
         """
-        Fetch helper - Fetch metrics for tmfrspec with optional Ghost.
-        Adds a DataSeries for each defined metric.
+        Plan helper - Plan metrics for tmfrspec with optional Ghost.
+        Returns list of (dseries, dseries_div) series plans, one per
+        defined metric, each with new (empty) DataSeries to be fetched.
+        dseries_div is None unless the qmetric has a div metric.
         Typically invoked for normal metrics as well as for each ghost.
         """
         # Prep:
         tmfrspec = self._state.tmfrspec
+        series_cls = ColumnarDataSeries if self.columnar else DataSeries
 
         # Loop over QMetrics:
+        plans = list()
         qmetrics = list(self._state.query.qdata.iter_qmetrics())
         for i, qmetric in enumerate(qmetrics):
 
@@ -194,60 +584,541 @@ class MQEngine(AxObj):
             if qmetric.div_metric_id is not None:
                 divmdef = self.metset.get_metric_by_id(qmetric.div_metric_id)
 
-            # Create and add new (empty) DataSeries:
+            # Create new (empty) DataSeries:
             series_id = "{pfx}{n}_{mdef.id}{div}".format(
                 pfx=series_id_pfx, n=i+1, mdef=mdef, 
                 div='_div_%s'%divmdef.id if divmdef is not None else '')
-            dseries = DataSeries(id=series_id, query_id=self._state.query.id,
-                mdef=mdef, tmfrspec=tmfrspec, ghost=ghost, 
+            dseries = series_cls(id=series_id, query_id=self._state.query.id,
+                mdef=mdef, div_mdef=divmdef, tmfrspec=tmfrspec, ghost=ghost,
                 label=qmetric.label)
-            self._state.mdseries.add_series(dseries)
-
-            # Fetch data into new DataSeries:
-            self._fetch_series(dseries)
 
-            # If div metric, fetch it too, and divide into existing data:
+            # If div metric, create its (empty) DataSeries too:
+            dseries_div = None
             if divmdef is not None:
                 divsid = "DIV_{pfx}{n}_{divmdef.id}".format(
                     pfx=series_id_pfx, n=i+1, divmdef=divmdef)
-                dseries_div = DataSeries(id=divsid,
+                dseries_div = series_cls(id=divsid,
                     mdef=divmdef, tmfrspec=tmfrspec, ghost=ghost)
-                self._fetch_series(dseries_div)
-                dseries.div_series(dseries_div)
 
-            log.info("Obtained data from %s: %s",
-                qmetric, dseries)
+            plans.append((dseries, dseries_div))
 
+        return plans
 
-    def _fetch_series(self, dseries):
+
+    def _plan_reuse(self, plans, previous):
+        """
+        Plan helper - Note values of closed steps in previous
+        MultiDataSeries result of current query to reuse for list of its
+        series plans (see _plan_metrics) rather than fetching again.
+        Steps with missing values are not reused.
+        Previous series must match by id, MetricDef and any div MetricDef
+        fingerprints, and FrameSpec timezone.
+        Values are reused whole (after any div), so for div plans neither
+        series is fetched for those steps.
         """
-        Fetch a single DataSeries for MetricDef defined in series.
-        Adds DataPoints to series.
+        until = self._closed_until(self._state.tmfrspec.reframe_dt)
+        count = 0
+        for (dseries, dseries_div) in plans:
+            try:
+                prev = previous.get_series_by_id(dseries.id)
+            except KeyError:
+                continue
+            if (prev.mdef is None) or \
+                    (prev.mdef.fingerprint() != dseries.mdef.fingerprint()) or \
+                    (prev.tmfrspec.timezone != dseries.tmfrspec.timezone):
+                continue
+            if dseries_div is None:
+                if prev.div_mdef is not None:
+                    continue
+            elif (prev.div_mdef is None) or (prev.div_mdef.fingerprint() !=
+                    dseries_div.mdef.fingerprint()):
+                continue
+            mdefs = [dseries.mdef]
+            if dseries_div is not None:
+                mdefs.append(dseries_div.mdef)
+            reused = dict()
+            for dpoint in prev.iter_points():
+                if dpoint.value is None:
+                    continue
+                if all(self._is_step_closed(mdef, dpoint.tmrange, until)
+                        for mdef in mdefs):
+                    key = (dpoint.tmrange.inc_begin, dpoint.tmrange.exc_end)
+                    reused[key] = dpoint.value
+            if reused:
+                self._reused[id(dseries)] = reused
+                if dseries_div is not None:
+                    self._reused[id(dseries_div)] = reused
+                count += len(reused)
+        log.info("Reusing %d closed steps from previous results of %s",
+            count, self._state.query)
+
+    def _fetch_plans(self, plans, on_plan, cancel):
         """
+        Fetch all DataSeries in list of series plans (see _plan_metrics),
+        possibly from multiple queries, grouped by metric,
+        up to series_workers groups at once.
+        As soon as all series of a plan and of all plans before it are
+        fetched, invokes on_plan(n, plan) (one at a time), then drops our
+        reference to plans[n].
+        Fetches check cancel Event (of this execution) before each step.
+        """
+        # Group every independent DataSeries (including div series),
+        # noting how many are pending per plan:
+        groups = collections.defaultdict(list)
+        order = list()
+        pending = list()
+        plan_of = dict()   # id(dseries): plan index
+        for n, (dseries, dseries_div) in enumerate(plans):
+            pending.append(0)
+            for ds in (dseries, dseries_div):
+                if ds is None:
+                    continue
+                pending[n] += 1
+                plan_of[id(ds)] = n
+                # (by fingerprint_for, so only series with the same
+                # settle_secs share closed steps; steps framed in a
+                # timezone are aware datetimes, never mixed with naive ones)
+                gkey = (self.fingerprint_for(ds.mdef),
+                    ds.tmfrspec.timezone is not None)
+                if gkey not in groups:
+                    order.append(gkey)
+                groups[gkey].append(ds)
+        groups = [groups[gkey] for gkey in order]
+
+        # Fetch groups, delivering ready plans in order:
+        lock = threading.Lock()
+        delivered = [0]
+        def _group_done(idx):
+            group = groups[idx]
+            groups[idx] = None
+            with lock:
+                for ds in group:
+                    pending[plan_of[id(ds)]] -= 1
+                while (delivered[0] < len(plans)) and \
+                        not pending[delivered[0]]:
+                    n = delivered[0]
+                    (plan, plans[n]) = (plans[n], None)
+                    on_plan(n, plan)
+                    delivered[0] += 1
+        self._fetch_series_groups(groups, cancel, _group_done)
+
+    def _fetch_series_groups(self, groups, cancel, on_group_done):
+        """
+        Fetch list of series groups (see _fetch_series_group),
+        up to series_workers at once, invoking on_group_done(idx) as
+        each is fetched.
+        """
+        def _fetch_group(idx):
+            self._fetch_series_group(groups[idx], cancel)
+            on_group_done(idx)
+        parallel_map(_fetch_group, range(len(groups)), self.series_workers)
 
-        log.info("Fetching series %s", dseries)
+    def _assemble_plan(self, plan):
+        """
+        Divide any div metric of fetched series plan and fill in any
+        reused values, returning its final DataSeries.
+        """
+        (dseries, dseries_div) = plan
+        if dseries_div is not None:
+            dseries.div_series(dseries_div)
+        reused = self._reused.get(id(dseries))
+        if reused:
+            for (idx, dpoint) in enumerate(dseries.iter_points()):
+                key = (dpoint.tmrange.inc_begin, dpoint.tmrange.exc_end)
+                if key in reused:
+                    dseries.set_value(idx, reused[key])
+        log.info("Obtained data: %s", dseries)
+        return dseries
+
+
+    def _fetch_series_group(self, group, cancel):
+        """
+        Fetch list of DataSeries sharing same metric (fingerprint_for
+        MetricDef, including settle_secs), e.g. primary and its ghosts,
+        all framed either with or without a timezone.
+        The union of distinct TimeRanges stepped by all series is fetched
+        once, with values fanned out to every series needing them.
+        Adds DataPoints to each series.
+        """
+        (mdef, all_steps, ranges, reframe_dt) = \
+            self._plan_series_group(group)
+        dpoints = self._fetch_ranges_by_deadline(mdef, ranges, reframe_dt,
+            cancel)
+        self._fan_out_series_group(group, all_steps, dpoints)
 
-        # Load EMFetcher plugin (AxPluginLoadError on error):
-        emf = self._make_emfetcher_for_mdef(dseries.mdef)
-        emf.plugin_create()
+    def _plan_series_group(self, group):
+        """
+        Plan fetching list of DataSeries sharing same metric
+        (see _fetch_series_group).
+        Returns tuple (mdef, all_steps, ranges, reframe_dt) of MetricDef,
+        list parallel to group of lists of TimeRange steps of each series,
+        sorted list of distinct TimeRanges to fetch, and reframe_dt by
+        which to classify closed steps.
+        """
+        for dseries in group:
+            log.info("Fetching series %s", dseries)
+
+        # Step through each series, collecting distinct ranges
+        # (except any reused from previous results):
+        mdef = group[0].mdef
+        all_steps = list()
+        distinct = dict()  # (inc_begin, exc_end): TimeRange
+        for dseries in group:
+            steps = self._run_stepplans.steps(dseries.tmfrspec,
+                ghost=dseries.ghost)
+            all_steps.append(steps)
+            reused = self._reused.get(id(dseries), {})
+            for step in steps:
+                key = (step.inc_begin, step.exc_end)
+                if key not in reused:
+                    distinct.setdefault(key, step)
+        ranges = [distinct[k] for k in sorted(distinct)]
+        log.info("Fetching %d distinct ranges for %d steps of %s",
+            len(ranges), sum(len(steps) for steps in all_steps), mdef)
+
+        # Fetch each distinct range once, classifying closed steps
+        # conservatively by earliest pinned reframe_dt of any series:
+        reframe_dt = min(dseries.tmfrspec.reframe_dt for dseries in group)
+        return (mdef, all_steps, ranges, reframe_dt)
+
+    def _fan_out_series_group(self, group, all_steps, dpoints):
+        """
+        Add values of list of DataPoints fetched for list of DataSeries
+        sharing same metric (see _plan_series_group) to new DataPoints
+        with each series' own steps (missing if abandoned).
+        """
+        values = dict()
+        for dpoint in dpoints:
+            values[(dpoint.tmrange.inc_begin, dpoint.tmrange.exc_end)] = \
+                dpoint.value
+        for (dseries, steps) in zip(group, all_steps):
+            dseries.add_values(steps, [values.get((step.inc_begin,
+                step.exc_end)) for step in steps])
+
+    def _fetch_ranges_by_deadline(self, mdef, steps, reframe_dt, cancel):
+        """
+        Fetch list of TimeRange steps for MetricDef (see _fetch_ranges),
+        waiting only until deadline (if any).
+        Returns list of DataPoints in same order, or if deadline expired
+        first, of only the DataPoints obtained by then (or in StepCache,
+        if any), setting cancel Event to stop remaining fetches.
+        Abandoned fetches of individual steps in progress still complete
+        in background (populating StepCache, if any).
+        """
+        if self._deadline is None:
+            return self._fetch_ranges(mdef, steps, reframe_dt, cancel)
+
+        # Collect DataPoints as obtained, in case deadline expires:
+        obtained = ObtainedPoints()
+        remaining = self._deadline - time.time()
+        if remaining > 0:
+            future = call_in_thread(self._fetch_ranges,
+                mdef, steps, reframe_dt, cancel, obtained.add)
+            try:
+                return future.result(timeout=remaining)
+            except AxFutureTimeout:
+                pass
+        cancel.set()
+        return self._abandon_ranges(mdef, steps, obtained)
+
+    def _abandon_ranges(self, mdef, steps, obtained):
+        """
+        Return list of DataPoints for TimeRange steps for MetricDef
+        after deadline expired, in same order, of only those in
+        ObtainedPoints obtained, or else in StepCache (if any),
+        abandoning the rest.
+        """
+        (cached, missing) = self._stepcache_get(mdef, obtained.missing(steps))
+        obtained.add([dpoint for dpoint in cached if dpoint is not None])
+        dpoints = obtained.get(steps)
+        if len(dpoints) < len(steps):
+            log.warn("Deadline expired, abandoning %d of %d ranges of %s",
+                len(steps) - len(dpoints), len(steps), mdef)
+        return dpoints
+
+    def _fetch_ranges(self, mdef, steps, reframe_dt, cancel,
+            on_fetched=None):
+        """
+        Fetch list of TimeRange steps (sorted by begin) for MetricDef,
+        decomposing overlapping steps if possible.
+        Steps ending before reframe_dt (less settle_secs) are closed.
+        Optional on_fetched(dpoints) is invoked with DataPoints of steps
+        as soon as obtained (except when decomposing, as steps are only
+        combined once all ranges are fetched).
+        Returns list of DataPoints in same order.
+        """
+        if self._can_decompose(mdef, steps):
+            return self._fetch_decomposed(mdef, steps, reframe_dt, cancel)
+        return self._fetch_cached(mdef, steps, reframe_dt, cancel,
+            on_fetched)
+
+    def _fetch_cached(self, mdef, steps, reframe_dt, cancel,
+            on_fetched=None):
+        """
+        Fetch list of TimeRange steps for MetricDef, serving what we can
+        from cache, and splitting the rest among workers.
+        Steps ending before reframe_dt (less settle_secs) are closed.
+        Optional on_fetched(dpoints) is invoked with DataPoints as soon
+        as obtained.
+        Returns list of DataPoints in same order.
+        """
+        # Serve what we can from cache:
+        (cached, missing) = self._stepcache_get(mdef, steps)
+        if on_fetched is not None:
+            on_fetched([dpoint for dpoint in cached if dpoint is not None])
 
-        # Step through, fetching data points, assembling series:
+        # Fetch missing data points:
+        fetched = self._fetch_missing(mdef, missing, cancel, on_fetched)
+        self._stepcache_put(mdef, fetched, reframe_dt)
+
+        # Assemble in step order:
+        fetched.reverse()
+        return [dpoint if dpoint is not None else fetched.pop()
+            for dpoint in cached]
+
+    def _fetch_missing(self, mdef, steps, cancel, on_fetched=None):
+        """
+        Fetch list of TimeRange steps for MetricDef (bypassing cache),
+        splitting steps among workers.
+        Optional on_fetched(dpoints) is invoked with DataPoints as soon
+        as fetched.
+        Returns list of DataPoints in same order.
+        """
+        workers = self.emfetch_option_for(
+            mdef.emfetch_id, 'fetch_workers', self.fetch_workers)
+        chunks = split_chunks(steps, workers)
+        def _fetch_chunk(chunk):
+            if self.singleflight is None:
+                return self._fetch_steps(mdef, chunk, cancel, on_fetched)
+            return self._fetch_steps_coalesced(mdef, chunk, cancel,
+                on_fetched)
+        fetched = list()
+        for dpoints in parallel_map(_fetch_chunk, chunks, workers):
+            fetched.extend(dpoints)
+        return fetched
+
+    def _can_decompose(self, mdef, steps):
+        """
+        Check T/F if overlapping steps for MetricDef should be fetched
+        via elementary ranges (see _fetch_decomposed).
+        """
+        if not self.emfetch_option_for(
+                mdef.emfetch_id, 'decompose', self.decompose):
+            return False
+        if not decompose.combines_exactly(mdef.func, mdef.data_type):
+            return False
+        return decompose.steps_overlap(steps)
+
+    def _fetch_decomposed(self, mdef, steps, reframe_dt, cancel):
+        """
+        Fetch list of overlapping TimeRange steps for MetricDef by fetching
+        each non-overlapping elementary range once and combining them.
+        SUM, COUNT combine via prefix sums (running totals when
+        accumulating), MIN, MAX via sliding window, FIRST, LAST via first
+        or last non-missing value, and AVG via paired SUM and COUNT of
+        the same data.
+        SUM and AVG are only decomposed for integral data_types (see
+        _can_decompose), but if any SUM value is not integral after all,
+        fetches steps directly instead.
+        Returns list of DataPoints in same order.
+        """
+        (ranges, spans) = decompose.elementary_ranges(steps)
+        log.info("Decomposed %d %s steps into %d ranges for %s",
+            len(steps), mdef.func, len(ranges), mdef)
+
+        def _values(func):
+            dpoints = self._fetch_cached(
+                self._derive_mdef(mdef, func), ranges, reframe_dt, cancel)
+            return [dpoint.value for dpoint in dpoints]
+
+        dpoints = self._combine_decomposed(mdef, steps, spans, _values)
+        if dpoints is None:
+            return self._fetch_cached(mdef, steps, reframe_dt, cancel)
+        return dpoints
+
+    def _combine_decomposed(self, mdef, steps, spans, values_of):
+        """
+        Combine values of elementary ranges of list of overlapping
+        TimeRange steps for MetricDef (see _fetch_decomposed), given
+        spans of ranges per step and callable values_of(func) returning
+        list of values of ranges for MetricDef func.
+        Returns list of DataPoints in same order, or None if any SUM
+        value is not integral, so steps must be fetched directly.
+        """
+        if mdef.func in ('SUM', 'COUNT', 'AVG'):
+            # (float sums combined would not match direct fetches exactly)
+            sums = values_of('SUM' if mdef.func == 'AVG' else mdef.func)
+            if not decompose.all_integral(sums):
+                log.warn("Fetching %s steps directly, as %s data"
+                    " not integral", mdef, mdef.data_type)
+                return None
+        if mdef.func in ('SUM', 'COUNT'):
+            values = decompose.combine_sums(sums, spans)
+        elif mdef.func in ('MIN', 'MAX'):
+            values = decompose.combine_extremes(
+                values_of(mdef.func), spans, mdef.func)
+        elif mdef.func in ('FIRST', 'LAST'):
+            values = decompose.combine_firstlast(
+                values_of(mdef.func), spans, mdef.func)
+        elif mdef.func == 'AVG':
+            values = decompose.combine_avg(sums, values_of('COUNT'), spans)
+
+        return [DataPoint(tmrange=step, value=value)
+            for (step, value) in zip(steps, values)]
+
+    def _derive_mdef(self, mdef, func):
+        """
+        Return MetricDef like mdef but with different func,
+        kept for the life of the engine so pooled EMFetchers can be reused.
+        """
+        if func == mdef.func:
+            return mdef
+        key = (id(mdef), func)
+        with self._derived_lock:
+            derived = self._derived_mdefs.get(key)
+            if derived is None or derived[0] is not mdef:
+                mdef2 = copy.copy(mdef)
+                mdef2.func = func
+                derived = self._derived_mdefs[key] = (mdef, mdef2)
+        return derived[1]
+
+    def _stepcache_get(self, mdef, steps):
+        """
+        Look up list of TimeRange steps for MetricDef in stepcache.
+        Returns tuple (cached, missing) where cached is list parallel to
+        steps of new DataPoints (or None where not cached), and missing
+        is list of steps not cached.
+        """
+        if self.stepcache is None:
+            return ([None] * len(steps), steps)
+        fingerprint = self.fingerprint_for(mdef)
+        keys = [StepCache.make_key(fingerprint, step) for step in steps]
+        found = self.stepcache.get_many(keys)
+        cached = list()
+        missing = list()
+        for (step, key) in zip(steps, keys):
+            if key in found:
+                # (always new DataPoint, as callers may modify them)
+                cached.append(DataPoint(tmrange=step, value=found[key]))
+            else:
+                cached.append(None)
+                missing.append(step)
+        return (cached, missing)
+
+    def _stepcache_put(self, mdef, dpoints, reframe_dt):
+        """
+        Store values of list of fetched DataPoints for MetricDef
+        in stepcache (if any), closed steps (per reframe_dt) with no expiry
+        and open steps with stepcache_ttl (see class docs).
+        """
+        if self.stepcache is None or not dpoints:
+            return
+        fingerprint = self.fingerprint_for(mdef)
+        until = self._closed_until(reframe_dt)
+        closed = list()
+        opened = list()
+        for dpoint in dpoints:
+            item = (StepCache.make_key(fingerprint, dpoint.tmrange),
+                dpoint.value)
+            if self._is_step_closed(mdef, dpoint.tmrange, until):
+                closed.append(item)
+            else:
+                opened.append(item)
+        if closed:
+            self.stepcache.put_many(closed, ttl=None)
+        if opened and self.stepcache_ttl is not None:
+            self.stepcache.put_many(opened, ttl=self.stepcache_ttl)
+
+    def _closed_until(self, reframe_dt):
+        """
+        Return datetime that closed steps end before (see _is_step_closed)
+        for pinned reframe_dt: reframe_dt itself, or the current time if
+        earlier, as steps after now have not happened yet even if
+        reframe_dt is in the future.
+        Current time is naive server local time for naive reframe_dt,
+        else aware in the same timezone.
+        """
+        tzinfo = reframe_dt.tzinfo
+        if tzinfo is None:
+            now = datetime.now()
+        elif isinstance(tzinfo, TZOffset):
+            now = tzinfo.tztable.now()
+        else:
+            now = datetime.now(tzinfo)
+        return min(reframe_dt, now)
+
+    def _is_step_closed(self, mdef, tmrange, until):
+        """
+        Check T/F if TimeRange step for MetricDef is closed, i.e. ends at
+        least mdef.settle_secs before until datetime (see _closed_until),
+        so its data is final and will never change.
+        """
+        settle = timedelta(seconds=mdef.settle_secs)
+        return tmrange.exc_end <= until - settle
+
+    def _fetch_steps(self, mdef, steps, cancel, on_fetched=None):
+        """
+        Fetch list of TimeRange steps for MetricDef with a pooled EMFetcher,
+        returning list of DataPoints in same order.
+        Safe to call concurrently, as each call has its own EMFetcher.
+        Raises FetchCancelled once cancel Event is set (checked before
+        each step).
+        Optional on_fetched(dpoints) is invoked with DataPoints as soon
+        as fetched (see EMFetcher.fetch_batch).
+        """
+        if cancel.is_set():
+            raise FetchCancelled("{self} deadline expired".format(self=self))
+
+        # Acquire EMFetcher plugin (AxPluginLoadError on error):
+        extinfo = self.emfetch_extinfo_for(mdef.emfetch_id)
+        emf = self._emfpool.acquire(mdef, extinfo)
+
+        # Fetch data points (batched if plugin supports it),
+        # discarding rather than reusing fetcher if it fails:
         try:
-            stepper = Stepper(dseries.tmfrspec, ghost=dseries.ghost)
-            for step in stepper.steps():
-                # print step
-                dpoint = emf.fetch(step)
-                dseries.add_point(dpoint)
-        finally:
-            emf.plugin_destroy()
+            dpoints = emf.fetch_batch(steps, cancel, on_fetched)
+        except:
+            self._emfpool.discard(emf)
+            raise
+        self._emfpool.release(emf)
+        return dpoints
 
 
-    def _make_emfetcher_for_mdef(self, mdef):
+    def _fetch_steps_coalesced(self, mdef, steps, cancel, on_fetched=None):
+        """
+        Fetch list of TimeRange steps for MetricDef like _fetch_steps,
+        but via singleflight, waiting for any identical steps already
+        being fetched elsewhere instead of fetching them again
+        (so on_fetched is invoked with those only once all are done).
+        """
+        fingerprint = self.fingerprint_for(mdef)
+        def _keyfunc(step):
+            return StepCache.make_key(fingerprint, step)
+        def _fetch_values(owned_steps):
+            return [dpoint.value for dpoint in self._fetch_steps(
+                mdef, owned_steps, cancel, on_fetched)]
+        values = self.singleflight.do_many(_fetch_values, steps, _keyfunc)
+        dpoints = [DataPoint(tmrange=step, value=value)
+            for (step, value) in zip(steps, values)]
+        if on_fetched is not None:
+            on_fetched(dpoints)
+        return dpoints
+
+    def _release_resources(self):
+        """
+        Release resources held across queries (e.g. pooled EMFetchers),
+        invoked after each query unless session is open.
+        """
+        self._emfpool.destroy()
+
+    def _make_emfetcher_for_mdef(self, mdef, extinfo=None):
         """
         Construct and return EMFetcher for given MetricDef.
+        Uses extinfo for its emfetch_id unless extinfo dict specified.
         """
         # Get extinfo for this emfetch_id:
-        extinfo = self.emfetch_extinfo_for(mdef.emfetch_id)
+        if extinfo is None:
+            extinfo = self.emfetch_extinfo_for(mdef.emfetch_id)
 
         # Make EMFetcher (AxPluginLoadError on error):
         emf_cls = axplugin.load_plugin_class(
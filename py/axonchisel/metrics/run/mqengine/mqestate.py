@@ -12,10 +12,12 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 
 import copy
 from datetime import datetime
+import time
 
 from axonchisel.metrics.foundation.ax.obj import AxObj
 
 from axonchisel.metrics.foundation.chrono.framespec import FrameSpec
+from axonchisel.metrics.foundation.chrono.tztable import get_table
 from axonchisel.metrics.foundation.metricdef.metset import MetSet
 from axonchisel.metrics.foundation.data.point import DataPoint
 from axonchisel.metrics.foundation.data.series import DataSeries 
@@ -54,15 +56,38 @@ class MQEState(AxObj):
         if query:
             self.query    = query              # current Query obj
 
-    def pin_tmfrspec(self):
+    def pin_tmfrspec(self, now=None):
         """
         Saves pinned (fixed reframe_dt) copy of Query's FrameSpec.
         Ensures all step sequences run over same time frame even if some
         take a long time to execute (because "now" doesn't change).
+        Optional now, as epoch secs (e.g. from time.time()) or datetime
+        (default current time), allows pinning multiple queries to the
+        same moment.
+        Epoch secs are pinned as server local time, or if FrameSpec has
+        a timezone, as the same moment in that timezone, which is exact
+        even when local wall clock time repeats (e.g. DST fall back).
+        If FrameSpec has a timezone, naive now datetime is taken as server
+        local time and pinned as the same moment in that timezone, while
+        naive explicit reframe_dt is taken as wall clock time in that
+        timezone.
         """
         tmfrspec = copy.deepcopy(self.query.qtimeframe.tmfrspec)
         if tmfrspec.reframe_dt is None:
-            tmfrspec.reframe_dt = datetime.now()
+            if now is None:
+                now = time.time()
+            if not isinstance(now, datetime):
+                if tmfrspec.timezone is not None:
+                    now = get_table(tmfrspec.timezone).fromutc_usec(
+                        int(round(now * 1000000)))
+                else:
+                    now = datetime.fromtimestamp(now)
+            elif tmfrspec.timezone is not None and now.tzinfo is None:
+                now = get_table(tmfrspec.timezone).fromlocal(now)
+            tmfrspec.reframe_dt = now
+        elif tmfrspec.timezone is not None:
+            tmfrspec.reframe_dt = get_table(tmfrspec.timezone).convert(
+                tmfrspec.reframe_dt)
         self.tmfrspec = tmfrspec
 
 
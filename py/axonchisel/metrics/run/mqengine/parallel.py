@@ -0,0 +1,142 @@
+"""
+Ax_Metrics - MQEngine bounded thread pool and concurrent fetch helpers
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import sys
+import threading
+import Queue
+
+from axonchisel.metrics.foundation.ax.future import AxFuture
+
+
+# ----------------------------------------------------------------------------
+
+
+def parallel_map(func, items, max_workers=1):
+    """
+    Return list of func(item) for each item in items, preserving order.
+    Runs up to max_workers calls concurrently in worker threads.
+    With max_workers <= 1 (or fewer than 2 items), runs serially in
+    the calling thread.
+    If any call raises, remaining unstarted items are skipped and the
+    first exception is re-raised (with original traceback) in the
+    calling thread once all workers have stopped.
+    """
+    items = list(items)
+    workers = min(max_workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    # Queue up work with indexes so results can be placed in order:
+    work = Queue.Queue()
+    for idx, item in enumerate(items):
+        work.put((idx, item))
+    results = [None] * len(items)
+    errors = list()
+
+    def _worker():
+        while not errors:
+            try:
+                (idx, item) = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[idx] = func(item)
+            except Exception:
+                errors.append(sys.exc_info())
+
+    # Run workers to completion:
+    threads = [threading.Thread(target=_worker, name="mqe-worker-%d" % n)
+        for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Re-raise first error, if any:
+    if errors:
+        (etype, evalue, etb) = errors[0]
+        raise etype, evalue, etb
+    return results
+
+def split_chunks(items, count):
+    """
+    Split list of items into count contiguous chunks of near equal size,
+    returning list of lists (omitting empty chunks).
+    """
+    items = list(items)
+    count = max(1, min(count, len(items)))
+    size, extra = divmod(len(items), count)
+    chunks = list()
+    idx = 0
+    for n in range(count):
+        end = idx + size + (1 if n < extra else 0)
+        if end > idx:
+            chunks.append(items[idx:end])
+        idx = end
+    return chunks
+
+def call_in_thread(func, *args):
+    """
+    Start func(*args) in new daemon thread, returning AxFuture of its
+    result (or error).
+    Useful to wait for work with a timeout, abandoning it if need be.
+    """
+    future = AxFuture()
+    def _run():
+        try:
+            result = func(*args)
+        except:
+            future.set_exc_info(sys.exc_info())
+        else:
+            future.set_result(result)
+    thread = threading.Thread(target=_run, name="mqe-call")
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+# ----------------------------------------------------------------------------
+
+
+class ObtainedPoints(object):
+    """
+    Thread-safe collection of DataPoints obtained so far by concurrent
+    fetches, keyed by TimeRange begin and end, so those obtained by a
+    deadline can be kept even if the rest are abandoned.
+    """
+
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._dpoints = dict()   # (inc_begin, exc_end): DataPoint
+
+    def add(self, dpoints):
+        """Add list of obtained DataPoints (usable as on_fetched)."""
+        with self._lock:
+            for dpoint in dpoints:
+                self._dpoints[(dpoint.tmrange.inc_begin,
+                    dpoint.tmrange.exc_end)] = dpoint
+
+    def missing(self, steps):
+        """Return list of TimeRange steps not obtained."""
+        with self._lock:
+            return [step for step in steps
+                if (step.inc_begin, step.exc_end) not in self._dpoints]
+
+    def get(self, steps):
+        """
+        Return list of DataPoints obtained for list of TimeRange steps,
+        in same order, omitting those not obtained.
+        """
+        with self._lock:
+            return [self._dpoints[(step.inc_begin, step.exc_end)]
+                for step in steps
+                if (step.inc_begin, step.exc_end) in self._dpoints]
@@ -0,0 +1,152 @@
+"""
+Ax_Metrics - MQEngine single-flight coalescing of identical fetches
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import sys
+import threading
+
+from axonchisel.metrics.foundation.ax.obj import AxObj
+from axonchisel.metrics.io.emfetch.interface import FetchCancelled
+
+
+# ----------------------------------------------------------------------------
+
+
+class SingleFlight(AxObj):
+    """
+    Coalesces identical concurrent calls, so that while a call for a key
+    is in flight, other callers asking for the same key wait for its
+    result instead of making their own call.
+    If the call raises, the error is re-raised to all waiters too,
+    except FetchCancelled (a deadline of that caller only), after which
+    waiters make the call themselves.
+
+    Nothing is remembered once a call completes (see StepCache for that).
+
+    A single SingleFlight may be shared by many MQEngines in many threads
+    (e.g. via ServantConfig.mqengine_opts), to protect backends from
+    bursts of identical requests.
+    """
+
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._calls   = dict()   # key: _Call, for calls in flight
+        self.count_calls  = 0    # items actually called for
+        self.count_shared = 0    # items waited on from others' calls
+
+
+    #
+    # Public Methods
+    #
+
+    def do_many(self, func, items, keyfunc):
+        """
+        Return list of results for list of items, in same order, where
+        func(items) returns list of results for a list of items and
+        keyfunc(item) returns hashable key identifying item.
+        Calls func once with those items not already in flight,
+        and waits for the others.
+        If func raises FetchCancelled (its caller's deadline expired),
+        that is raised only to us: its items are released, and waiters
+        claim them again (one becoming the new caller).
+        """
+        keys = [keyfunc(item) for item in items]
+        results = [None] * len(items)
+        pending = range(len(items))
+        while pending:
+            # Claim items not in flight, noting calls to wait for:
+            calls = list()   # (idx, call) tuples
+            owned = list()   # (key, call, item) tuples we call for
+            with self._lock:
+                for idx in pending:
+                    call = self._calls.get(keys[idx])
+                    if call is None:
+                        call = self._calls[keys[idx]] = _Call()
+                        owned.append((keys[idx], call, items[idx]))
+                    else:
+                        self.count_shared += 1
+                    calls.append((idx, call))
+                self.count_calls += len(owned)
+
+            # Make our call, publishing results or error to all waiters
+            # (including ourselves, below):
+            if owned:
+                self._call(func, owned)
+
+            # Collect results (waiting on others as needed),
+            # retrying items whose callers were cancelled:
+            pending = list()
+            for (idx, call) in calls:
+                call.done.wait()
+                if call.cancelled:
+                    pending.append(idx)
+                else:
+                    results[idx] = call.wait()
+        return results
+
+
+    #
+    # Internal Methods
+    #
+
+    def _call(self, func, owned):
+        """
+        Call func for list of (key, call, item) tuples we claimed,
+        publishing results or error to their calls and releasing keys.
+        Re-raises FetchCancelled (after marking calls abandoned).
+        """
+        cancelled = None
+        try:
+            results = func([item for (key, call, item) in owned])
+            for ((key, call, item), result) in zip(owned, results):
+                call.result = result
+        except FetchCancelled:
+            cancelled = sys.exc_info()
+            for (key, call, item) in owned:
+                call.cancelled = True
+        except:
+            exc_info = sys.exc_info()
+            for (key, call, item) in owned:
+                call.exc_info = exc_info
+        with self._lock:
+            for (key, call, item) in owned:
+                del self._calls[key]
+        for (key, call, item) in owned:
+            call.done.set()
+        if cancelled is not None:
+            (etype, evalue, etb) = cancelled
+            raise etype, evalue, etb
+
+    def __unicode__(self):
+        return (u"SingleFlight({n} in flight)"
+        ).format(n=len(self._calls))
+
+
+# ----------------------------------------------------------------------------
+
+
+class _Call(object):
+    """Internal: single in-flight call result holder."""
+
+    def __init__(self):
+        self.done      = threading.Event()
+        self.result    = None
+        self.exc_info  = None
+        self.cancelled = False   # (caller's deadline expired)
+
+    def wait(self):
+        """Wait for and return result, or re-raise error."""
+        self.done.wait()
+        if self.exc_info is not None:
+            (etype, evalue, etb) = self.exc_info
+            raise etype, evalue, etb
+        return self.result
+
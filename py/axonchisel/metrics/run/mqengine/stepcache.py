@@ -0,0 +1,468 @@
+"""
+Ax_Metrics - MQEngine step-level result caches
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import collections
+import sqlite3
+import threading
+import time
+
+from axonchisel.metrics.foundation.ax.obj import AxObj
+import axonchisel.metrics.foundation.chrono.dtmath as dtmath
+
+
+# ----------------------------------------------------------------------------
+
+
+# Suffix of fingerprint in step keys of aware (timezone framed) steps
+UTC_KEY_SUFFIX = '@utc'
+
+
+# ----------------------------------------------------------------------------
+
+
+class StepCache(AxObj):
+    """
+    Step cache interface - abstract base class.
+
+    A StepCache holds fetched DataPoint values, keyed by step key tuples:
+      (MetricDef fingerprint, inc_begin datetime, exc_end datetime)
+    (see make_key).
+    A cached value may itself be None (missing data), which is distinct
+    from a cache miss.
+
+    Implementations must be safe to use from multiple threads, as MQEngine
+    fetches series concurrently, and a single cache may be shared by
+    many MQEngines (e.g. via ServantConfig.mqengine_opts).
+    """
+
+    #
+    # Abstract Methods
+    #
+
+    def get_many(self, keys):
+        """
+        Look up list of step keys, returning dict mapping key to value
+        for those found (and not expired). Missing keys are omitted.
+        """
+        raise NotImplementedError("StepCache abstract superclass")
+
+    def put_many(self, items, ttl=None):
+        """
+        Store list of (key, value) tuples, each expiring after ttl seconds,
+        or never if ttl is None.
+        """
+        raise NotImplementedError("StepCache abstract superclass")
+
+    def invalidate(self, fingerprint):
+        """Remove all entries for MetricDef fingerprint (e.g. backfills)."""
+        raise NotImplementedError("StepCache abstract superclass")
+
+    def clear(self):
+        """Remove all entries."""
+        raise NotImplementedError("StepCache abstract superclass")
+
+    def stats(self):
+        """Return dict of usage counters (e.g. 'hits', 'misses', 'size')."""
+        raise NotImplementedError("StepCache abstract superclass")
+
+
+    #
+    # Public Methods
+    #
+
+    @staticmethod
+    def make_key(fingerprint, tmrange):
+        """
+        Return step key tuple for MetricDef fingerprint and TimeRange.
+        Aware steps (framed in a timezone) are keyed by naive UTC
+        datetimes under fingerprint + UTC_KEY_SUFFIX, apart from naive
+        (server local time) steps.
+        """
+        (inc_begin, exc_end) = (tmrange.inc_begin, tmrange.exc_end)
+        if inc_begin.tzinfo is not None:
+            return (fingerprint + UTC_KEY_SUFFIX,
+                inc_begin.replace(tzinfo=None) - inc_begin.utcoffset(),
+                exc_end.replace(tzinfo=None) - exc_end.utcoffset())
+        return (fingerprint, inc_begin, exc_end)
+
+
+# ----------------------------------------------------------------------------
+
+
+class MemoryStepCache(StepCache):
+    """
+    In-process StepCache with LRU eviction and per-entry TTL.
+
+    Holds at most maxsize entries, evicting least recently used ones
+    beyond that.  Expired entries are dropped as they are encountered.
+    """
+
+    # Link list node field indexes:
+    _PREV, _NEXT, _KEY, _VALUE, _EXPIRES = range(5)
+
+    def __init__(self, maxsize=100000):
+        """
+        Initialize empty cache holding at most maxsize entries.
+        """
+        # Set valid default state:
+        self._maxsize   = 1
+        self._lock      = threading.Lock()
+        self._clear_entries()
+        self.hits       = 0
+        self.misses     = 0
+        self.evictions  = 0
+
+        # Apply initial values:
+        self.maxsize    = maxsize
+
+
+    #
+    # Public Methods
+    #
+
+    def get_many(self, keys):
+        """
+        Look up list of step keys, returning dict mapping key to value
+        for those found (and not expired). Missing keys are omitted.
+        """
+        found = dict()
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                node = self._map.get(key)
+                if node is not None:
+                    expires = node[self._EXPIRES]
+                    if expires is not None and expires <= now:
+                        self._unlink(node)
+                        node = None
+                if node is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                self._unlink(node)
+                self._link(node)
+                found[key] = node[self._VALUE]
+        return found
+
+    def put_many(self, items, ttl=None):
+        """
+        Store list of (key, value) tuples, each expiring after ttl seconds,
+        or never if ttl is None.
+        """
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            for (key, value) in items:
+                node = self._map.get(key)
+                if node is not None:
+                    self._unlink(node)
+                self._link([None, None, key, value, expires])
+            while len(self._map) > self._maxsize:
+                self._unlink(self._root[self._NEXT])
+                self.evictions += 1
+
+    def invalidate(self, fingerprint):
+        """Remove all entries for MetricDef fingerprint (e.g. backfills)."""
+        with self._lock:
+            fingerprints = (fingerprint, fingerprint + UTC_KEY_SUFFIX)
+            for node in self._map.values():
+                if node[self._KEY][0] in fingerprints:
+                    self._unlink(node)
+
+    def clear(self):
+        """Remove all entries (counters are kept)."""
+        with self._lock:
+            self._clear_entries()
+
+    def stats(self):
+        """Return dict of usage counters."""
+        return {
+            'hits':      self.hits,
+            'misses':    self.misses,
+            'evictions': self.evictions,
+            'size':      len(self._map),
+            'maxsize':   self._maxsize,
+        }
+
+
+    #
+    # Public Properties
+    #
+
+    @property
+    def maxsize(self):
+        """Max number of entries held before LRU eviction."""
+        return self._maxsize
+    @maxsize.setter
+    def maxsize(self, val):
+        self._assert_type_int("maxsize", val)
+        if val < 1:
+            raise ValueError("{self} maxsize must be >= 1: {val}"
+                .format(self=self, val=val))
+        self._maxsize = val
+
+
+    #
+    # Internal Methods
+    #
+
+    def _clear_entries(self):
+        """Reset to empty. Entries are kept in dict and circular list."""
+        self._map = dict()   # key: node
+        self._root = root = [None, None, None, None, None]
+        root[self._PREV] = root[self._NEXT] = root  # (oldest at NEXT)
+
+    def _link(self, node):
+        """Insert node as most recently used. Caller holds lock."""
+        root = self._root
+        last = root[self._PREV]
+        node[self._PREV] = last
+        node[self._NEXT] = root
+        last[self._NEXT] = root[self._PREV] = node
+        self._map[node[self._KEY]] = node
+
+    def _unlink(self, node):
+        """Remove node. Caller holds lock."""
+        node[self._PREV][self._NEXT] = node[self._NEXT]
+        node[self._NEXT][self._PREV] = node[self._PREV]
+        del self._map[node[self._KEY]]
+
+    def __unicode__(self):
+        return (u"MemoryStepCache({n}/{self._maxsize} entries)"
+        ).format(self=self, n=len(self._map))
+
+
+# ----------------------------------------------------------------------------
+
+
+class SQLiteStepCache(StepCache):
+    """
+    Persistent StepCache stored in local SQLite database file,
+    surviving process restarts.
+
+    Only entries without expiry (i.e. closed steps, see MQEngine) are
+    stored; entries put with a ttl are ignored, as they would soon be
+    stale anyway.
+    Entries are indexed by fingerprint and inc_begin/exc_end epoch
+    (microseconds, treating naive datetimes as UTC for stable keys).
+    Lookups for a whole step sequence of one MetricDef take a single
+    SELECT, and puts a single transaction.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize around SQLite database file path (created if needed),
+        or ':memory:' for non-persistent database.
+        """
+        # Set valid default state:
+        self._path   = path
+        self._lock   = threading.Lock()
+        self.hits    = 0
+        self.misses  = 0
+
+        # Open database and ensure schema:
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS step_cache ("
+                    " fingerprint TEXT NOT NULL,"
+                    " inc_begin INTEGER NOT NULL,"
+                    " exc_end INTEGER NOT NULL,"
+                    " value,"
+                    " PRIMARY KEY (fingerprint, inc_begin, exc_end))")
+
+
+    #
+    # Public Methods
+    #
+
+    def get_many(self, keys):
+        """
+        Look up list of step keys, returning dict mapping key to value
+        for those found. Missing keys are omitted.
+        """
+        # Group wanted keys by fingerprint, indexed by epoch range:
+        wanted = collections.defaultdict(dict)
+        for key in keys:
+            (fingerprint, inc_begin, exc_end) = key
+            epochs = (dtmath.to_epoch_usec(inc_begin),
+                dtmath.to_epoch_usec(exc_end))
+            wanted[fingerprint][epochs] = key
+
+        # Query each fingerprint's whole span at once:
+        found = dict()
+        with self._lock:
+            for (fingerprint, epochkeys) in wanted.iteritems():
+                begins = [epochs[0] for epochs in epochkeys]
+                rows = self._conn.execute(
+                    "SELECT inc_begin, exc_end, value FROM step_cache"
+                    " WHERE fingerprint = ? AND inc_begin BETWEEN ? AND ?",
+                    (fingerprint, min(begins), max(begins)))
+                for (inc_begin, exc_end, value) in rows:
+                    key = epochkeys.get((inc_begin, exc_end))
+                    if key is not None:
+                        found[key] = value
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items, ttl=None):
+        """
+        Store list of (key, value) tuples in one transaction.
+        Ignored if ttl is not None (only permanent entries are stored).
+        """
+        if ttl is not None:
+            return
+        rows = [(fingerprint, dtmath.to_epoch_usec(inc_begin),
+                dtmath.to_epoch_usec(exc_end), value)
+            for ((fingerprint, inc_begin, exc_end), value) in items]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO step_cache"
+                    " (fingerprint, inc_begin, exc_end, value)"
+                    " VALUES (?, ?, ?, ?)", rows)
+
+    def invalidate(self, fingerprint):
+        """Remove all entries for MetricDef fingerprint (e.g. backfills)."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM step_cache WHERE fingerprint IN (?, ?)",
+                    (fingerprint, fingerprint + UTC_KEY_SUFFIX))
+
+    def clear(self):
+        """Remove all entries (counters are kept)."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM step_cache")
+
+    def stats(self):
+        """Return dict of usage counters."""
+        with self._lock:
+            (size,) = self._conn.execute(
+                "SELECT COUNT(*) FROM step_cache").fetchone()
+        return {
+            'hits':      self.hits,
+            'misses':    self.misses,
+            'size':      size,
+        }
+
+    def close(self):
+        """Close database. Cache may not be used after this."""
+        with self._lock:
+            self._conn.close()
+
+
+    #
+    # Internal Methods
+    #
+
+    def __unicode__(self):
+        return (u"SQLiteStepCache('{self._path}')"
+        ).format(self=self)
+
+
+# ----------------------------------------------------------------------------
+
+
+class LayeredStepCache(StepCache):
+    """
+    StepCache combining list of StepCache layers, fastest first,
+    e.g. [MemoryStepCache(), SQLiteStepCache('steps.db')].
+
+    Lookups try each layer in turn for keys still missing, promoting
+    values found in lower layers into the layers above (with no expiry,
+    so lower layers should hold only closed steps, as SQLiteStepCache
+    does). Puts, invalidations, and clears go to all layers.
+    """
+
+    def __init__(self, layers):
+        """
+        Initialize around list of StepCache layers, fastest first.
+        """
+        # Set valid default state:
+        self._layers = list()
+        self._lock   = threading.Lock()
+        self.hits    = 0
+        self.misses  = 0
+
+        # Apply initial values:
+        self._assert_type_list("layers", layers, ofsupercls=StepCache)
+        if not layers:
+            raise ValueError("{self} requires at least one layer"
+                .format(self=self))
+        self._layers = list(layers)
+
+
+    #
+    # Public Methods
+    #
+
+    def get_many(self, keys):
+        """
+        Look up list of step keys, returning dict mapping key to value
+        for those found in any layer. Missing keys are omitted.
+        """
+        found = dict()
+        missing = list(keys)
+        for (n, layer) in enumerate(self._layers):
+            if not missing:
+                break
+            layer_found = layer.get_many(missing)
+            if layer_found:
+                found.update(layer_found)
+                missing = [key for key in missing if key not in layer_found]
+                for upper in self._layers[:n]:
+                    upper.put_many(layer_found.items())
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found
+
+    def put_many(self, items, ttl=None):
+        """Store list of (key, value) tuples in all layers."""
+        items = list(items)
+        for layer in self._layers:
+            layer.put_many(items, ttl=ttl)
+
+    def invalidate(self, fingerprint):
+        """Remove all entries for MetricDef fingerprint from all layers."""
+        for layer in self._layers:
+            layer.invalidate(fingerprint)
+
+    def clear(self):
+        """Remove all entries from all layers."""
+        for layer in self._layers:
+            layer.clear()
+
+    def stats(self):
+        """Return dict of usage counters, including list of layer stats."""
+        return {
+            'hits':   self.hits,
+            'misses': self.misses,
+            'layers': [layer.stats() for layer in self._layers],
+        }
+
+
+    #
+    # Internal Methods
+    #
+
+    def __unicode__(self):
+        return (u"LayeredStepCache({layers})"
+        ).format(layers=u", ".join(map(unicode, self._layers)))
+
+
+# ----------------------------------------------------------------------------
+
+
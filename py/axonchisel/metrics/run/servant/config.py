@@ -40,11 +40,14 @@ class ServantConfig(AxObj):
         self._queryset        = None  # (QuerySet)
         self._emfetch_extinfo = None  # (dict)
         self._erout_extinfo   = None  # (dict)
+        self._mqengine_opts   = dict()  # (dict)
+        self._mqengine_async  = False   # (bool)
 
         # Apply initial values from kwargs:
         self._init_kwargs(kwargs, [
             'metset', 'queryset',
             'emfetch_extinfo', 'erout_extinfo',
+            'mqengine_opts', 'mqengine_async',
         ])
 
 
@@ -130,6 +133,34 @@ class ServantConfig(AxObj):
         self._assert_type_mapping("erout_extinfo", val)
         self._erout_extinfo = val
 
+    @property
+    def mqengine_opts(self):
+        """
+        Optional extra MQEngine constructor options, as dict of kwargs,
+        e.g. {'series_workers': 4, 'fetch_workers': 8}.
+        A StepCache or SingleFlight given here (as 'stepcache' or
+        'singleflight') is shared by all requests.
+        Default is empty dict (all MQEngine defaults).
+        """
+        return self._mqengine_opts
+    @mqengine_opts.setter
+    def mqengine_opts(self, val):
+        self._assert_type_mapping("mqengine_opts", val)
+        self._mqengine_opts = val
+
+    @property
+    def mqengine_async(self):
+        """
+        Whether to run queries with AsyncMQEngine rather than MQEngine,
+        in which case mqengine_opts may also include 'backend_limit'.
+        Default False.
+        """
+        return self._mqengine_async
+    @mqengine_async.setter
+    def mqengine_async(self, val):
+        self._assert_type_bool("mqengine_async", val)
+        self._mqengine_async = val
+
 
     #
     # Internal Methods
@@ -36,10 +36,13 @@ class ServantRequest(AxObj):
         self._erout_plugin_ids = list()  # list(str)
         self._collapse         = False   # bool
         self._noghosts         = False   # bool
+        self._deadline         = None    # int/float secs (or None)
+        self._refresh          = False   # bool
 
         # Apply initial values from kwargs:
         self._init_kwargs(kwargs, [
             'query_ids', 'erout_plugin_ids', 'collapse', 'noghosts',
+            'deadline', 'refresh',
         ])
 
         # Validate:
@@ -63,6 +66,8 @@ class ServantRequest(AxObj):
             - erout : CSL of erout plugin ids, e.g. "csv,json"
             - collapse : '1' for collapse mode, or '0' (default) for normal
             - noghosts : '1' to disable ghosts, or '0' (default) for normal
+            - deadline : secs to wait for data, e.g. "2.5" (default none)
+            - refresh : '1' for refresh mode, or '0' (default) for normal
         """
         def parse_csl_ids(csl):
             return [id.strip() for id in filter(len, csl.split(','))]
@@ -73,6 +78,14 @@ class ServantRequest(AxObj):
             sreq.collapse = True
         if params.get('noghosts') == '1':
             sreq.noghosts = True
+        if params.get('refresh') == '1':
+            sreq.refresh = True
+        if params.get('deadline'):
+            try:
+                sreq.deadline = float(params['deadline'])
+            except ValueError:
+                raise ValueError("Invalid deadline param: {0!r}"
+                    .format(params['deadline']))
         return sreq
 
 
@@ -129,6 +142,39 @@ class ServantRequest(AxObj):
         self._assert_type_bool("noghosts", val)
         self._noghosts = val
 
+    @property
+    def deadline(self):
+        """
+        Max secs to wait for data, or None (default) to wait indefinitely.
+        Fetches still outstanding by then are abandoned, leaving their
+        values missing (None), so EROuts still receive complete results,
+        just with gaps (e.g. rendered by dashboards as such).
+        """
+        return self._deadline
+    @deadline.setter
+    def deadline(self, val):
+        if val is not None:
+            self._assert_type_numeric("deadline", val)
+            if val <= 0:
+                raise ValueError("{self} deadline must be > 0: {val}"
+                    .format(self=self, val=val))
+        self._deadline = val
+
+    @property
+    def refresh(self):
+        """
+        Refresh previous results? (bool)
+        Useful for dashboards re-running the same queries periodically.
+        When refreshing, the Servant reuses closed steps of the results
+        it last produced for the same queries in refresh requests
+        (if any), fetching only new or open steps.
+        """
+        return self._refresh
+    @refresh.setter
+    def refresh(self, val):
+        self._assert_type_bool("refresh", val)
+        self._refresh = val
+
 
     #
     # Internal Methods
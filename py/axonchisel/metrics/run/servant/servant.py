@@ -18,7 +18,9 @@ import axonchisel.metrics.foundation.ax.plugin as axplugin
 from axonchisel.metrics.foundation.data.multi import MultiDataSeries
 from axonchisel.metrics.foundation.query.qghosts import QGhosts
 from axonchisel.metrics.io.erout.interface import EROut
+from axonchisel.metrics.io.erout.base import EROutBase
 from axonchisel.metrics.run.mqengine.mqengine import MQEngine
+from axonchisel.metrics.run.mqengine.asyncengine import AsyncMQEngine
 
 from .config import ServantConfig
 from .request import ServantRequest
@@ -50,14 +52,17 @@ class Servant(AxObj):
 
     Lifecycle: A Servant instance can process as many requests
     as desired, but only one at a time.
-    EROut plugins are created and destroyed around each request
+    EROut and EMFetch plugins are created and destroyed around each request
     (which may itself contain multiple queries).
+    The latest results of each query in refresh requests are kept, so the
+    next refresh request of it fetches only what may have changed since.
     """
 
     def __init__(self, config):
         # Set valid default state:
         self._config          = None  # (ServantConfig)
         self._state           = None  # (ServantState)
+        self._refreshable     = dict()  # refresh key: MultiDataSeries
         self._reset_state()
 
         # Apply initial values from kwargs:
@@ -85,7 +90,11 @@ class Servant(AxObj):
         self._reset_state(request)
         self._create_erouts()
         self._create_mqengine()
-        self._run_queries()
+        self._state.mqengine.open_session()
+        try:
+            self._run_queries()
+        finally:
+            self._state.mqengine.close_session()
         self._destroy_erouts()
 
         # Log end:
@@ -133,6 +142,8 @@ class Servant(AxObj):
         cls = axplugin.load_plugin_class(**plugin_load)
         extinfo = self._config.erout_extinfo_for(erout_plugin_id)
         ero = cls(extinfo=extinfo)
+        if isinstance(ero, EROutBase):
+            ero.stepplans = self._state.stepplans
         ero.plugin_create()
         return ero
 
@@ -144,29 +155,72 @@ class Servant(AxObj):
 
     def _create_mqengine(self):
         """Create and configure MQEngine, storing in state."""
-        log.info("Creating MQEngine")
-        self._state.mqengine = MQEngine(
+        mqengine_cls = MQEngine
+        if self._config.mqengine_async:
+            mqengine_cls = AsyncMQEngine
+        log.info("Creating %s", mqengine_cls.__name__)
+        self._state.mqengine = mqengine_cls(
             metset = self._config.metset,
             emfetch_extinfo = self._config.emfetch_extinfo,
+            **self._config.mqengine_opts
         )
+        self._state.mqengine.stepplans = self._state.stepplans
 
     def _run_queries(self):
         """Run our queries and output results -- the core logic loop."""
-        # Iterate requested queries:
+        # Load and adjust requested queries:
         query_ids = self._state.request.query_ids
-        for i, query_id in enumerate(query_ids):
-
-            log.info("Running query (%d/%d) #%s", i+1, len(query_ids), query_id)
-
-            # Load and adjust query:
+        queries = list()
+        for query_id in query_ids:
             q = self._config.queryset.get_query_by_id(query_id)
             if self._state.request.collapse:
                 q = self._collapse_query(q)
             if self._state.request.noghosts:
                 q = self._bust_query_ghosts(q)
+            queries.append(q)
+
+        # Find previous results to refresh, if refreshing:
+        refresh = self._state.request.refresh
+        previous = None
+        if refresh:
+            previous = [self._refreshable.get(self._refresh_key(q))
+                for q in queries]
+
+        # Stream results if there are EROuts and all support it
+        # (collecting them too if refreshing):
+        if self._state.erouts and \
+                all(ero.can_stream for ero in self._state.erouts):
+            log.info("Streaming %d queries %s", len(queries), query_ids)
+            # (queries are delivered in order, so track position,
+            # as the same query may be requested more than once)
+            results = [MultiDataSeries() for q in queries]
+            current = [0]
+            def _on_series(dseries, q):
+                if refresh:
+                    results[current[0]].add_series(dseries)
+                self._output_series(dseries, q)
+            def _on_query_done(q):
+                self._output_finish(q)
+                current[0] += 1
+            self._state.mqengine.query_stream(queries,
+                _on_series, _on_query_done,
+                timeout=self._state.request.deadline, previous=previous)
+            if refresh:
+                self._keep_refreshable(queries, results)
+            return
+
+        # Else run all queries together in MQEngine (deduping fetches):
+        log.info("Running %d queries %s", len(queries), query_ids)
+        all_mdseries = self._state.mqengine.query_many(queries,
+            timeout=self._state.request.deadline, previous=previous)
+        if refresh:
+            self._keep_refreshable(queries, all_mdseries)
+
+        # Iterate query results:
+        for i, (q, mdseries) in enumerate(zip(queries, all_mdseries)):
+
+            log.info("Outputting query (%d/%d) #%s", i+1, len(queries), q.id)
 
-            # Run query in MQEngine
-            mdseries = self._state.mqengine.query(q)
             if self._state.request.collapse:
                 mdseries = self._collapse_mdseries(mdseries)
 
@@ -174,6 +228,29 @@ class Servant(AxObj):
             for ero in self._state.erouts:
                 ero.output(mdseries, query=q)
 
+    def _refresh_key(self, q):
+        """Return key identifying results of (adjusted) query to refresh."""
+        return (q.id, self._state.request.collapse,
+            self._state.request.noghosts)
+
+    def _keep_refreshable(self, queries, all_mdseries):
+        """Keep list of results of queries for later refresh requests."""
+        for (q, mdseries) in zip(queries, all_mdseries):
+            self._refreshable[self._refresh_key(q)] = mdseries
+
+    def _output_series(self, dseries, q):
+        """Stream single completed DataSeries of query through all EROuts."""
+        if self._state.request.collapse:
+            dseries = self._collapse_dseries(dseries)
+        for ero in self._state.erouts:
+            ero.output_series(dseries, query=q)
+
+    def _output_finish(self, q):
+        """Finish streaming query through all EROuts."""
+        log.info("Finished streaming query #%s", q.id)
+        for ero in self._state.erouts:
+            ero.output_finish(query=q)
+
     def _collapse_query(self, q):
         """
         Return copy of query, collapsed for collapse mode.
@@ -203,12 +280,19 @@ class Servant(AxObj):
         """
         mdseries2 = MultiDataSeries()
         for dseries in mdseries.iter_series():
-            dseries2 = copy.deepcopy(dseries)
-            dseries2.reset_points()
-            dseries2.add_point(dseries.get_point(-1)) # (keep only last point)
-            mdseries2.add_series(dseries2)
+            mdseries2.add_series(self._collapse_dseries(dseries))
         return mdseries2
 
+    def _collapse_dseries(self, dseries):
+        """
+        Return copy of DataSeries, collapsed for collapse mode
+        (see _collapse_mdseries).
+        """
+        dseries2 = copy.deepcopy(dseries)
+        dseries2.reset_points()
+        dseries2.add_point(dseries.get_point(-1)) # (keep only last point)
+        return dseries2
+
     def __unicode__(self):
         return (u"Servant({self._config}, {self._state})"
             .format(self=self))
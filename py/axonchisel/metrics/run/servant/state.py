@@ -11,6 +11,7 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 
 
 from axonchisel.metrics.foundation.ax.obj import AxObj
+from axonchisel.metrics.foundation.chrono.stepper import StepPlans
 from axonchisel.metrics.foundation.query.query import Query
 from axonchisel.metrics.foundation.data.multi import MultiDataSeries
 from axonchisel.metrics.io.erout.interface import EROut
@@ -32,6 +33,7 @@ class ServantState(AxObj):
         self._request   = None    # (ServantRequest)
         self._erouts    = list()  # (list(EROut))
         self._mqengine  = None    # (MQEngine)
+        self._stepplans = StepPlans()  # (StepPlans)
 
 
     #
@@ -70,6 +72,15 @@ class ServantState(AxObj):
         self._assert_type("mqengine", val, MQEngine)
         self._mqengine = val
 
+    @property
+    def stepplans(self):
+        """StepPlans shared by MQEngine and EROuts during request."""
+        return self._stepplans
+    @stepplans.setter
+    def stepplans(self, val):
+        self._assert_type("stepplans", val, StepPlans)
+        self._stepplans = val
+
 
 
     #
@@ -32,6 +32,10 @@ install_requires = [
     'requests>=2.4.3', # HTTP requests for humans (used by EMFetcher_http)
 ]
 
+extras_require = {
+    'numpy': ['numpy>=1.7'],  # vectorized ops on ColumnarDataSeries
+}
+
 test_requires = [
     'pytest>=2.6.4',   # py.test test harness
     'coverage>=3.7.1', # code coverage assessment
@@ -141,6 +145,7 @@ setup(
     # These extra options trigger harmless distutils warning.  ignore.
     # setuptools (including pip) likes and uses it.
     install_requires = install_requires,
+    extras_require = extras_require,
     tests_require = test_requires,  # (yes, 'tests_require')
 )
 
@@ -0,0 +1,130 @@
+"""
+Ax_Metrics - Test foundation AxFuture and AxThreadExecutor
+
+------------------------------------------------------------------------------
+Author: Dan Kamins <dos at axonchisel dot net>
+Copyright (c) 2014 Dan Kamins, AxonChisel.net
+"""
+
+
+# ----------------------------------------------------------------------------
+
+
+import sys
+import threading
+
+import pytest
+
+from axonchisel.metrics.foundation.ax.future import \
+    AxFuture, AxFutureTimeout, AxThreadExecutor
+
+
+# ----------------------------------------------------------------------------
+
+
+class TestAxFuture(object):
+    """
+    Test AxFuture object.
+    """
+
+    #
+    # Tests
+    #
+
+    def test_result(self):
+        future = AxFuture()
+        assert not future.done()
+        with pytest.raises(AxFutureTimeout):
+            future.result(timeout=0.01)
+        done = list()
+        future.add_done_callback(done.append)
+        future.set_result(42)
+        assert future.done()
+        assert future.result() == 42
+        assert done == [future]
+        future.add_done_callback(done.append)
+        assert done == [future, future]
+        with pytest.raises(ValueError):
+            future.set_result(43)
+        str(future)
+
+    def test_error(self):
+        future = AxFuture()
+        try:
+            raise KeyError("oops")
+        except KeyError:
+            future.set_exc_info(sys.exc_info())
+        with pytest.raises(KeyError):
+            future.result()
+
+    def test_then(self):
+        future = AxFuture()
+        future2 = future.then(lambda x: x * 2)
+        future3 = future2.then(lambda x: 1 / 0)
+        future.set_result(21)
+        assert future2.result() == 42
+        with pytest.raises(ZeroDivisionError):
+            future3.result()
+
+    def test_gather(self):
+        futures = [AxFuture() for n in range(3)]
+        all = AxFuture.gather(futures)
+        for n in (2, 0, 1):
+            assert not all.done()
+            futures[n].set_result(n * 10)
+        assert all.result() == [0, 10, 20]
+        assert AxFuture.gather([]).result() == []
+        futures = [AxFuture.from_result(1), AxFuture()]
+        futures[1].set_exc_info((KeyError, KeyError("x"), None))
+        with pytest.raises(KeyError):
+            AxFuture.gather(futures).result()
+
+
+# ----------------------------------------------------------------------------
+
+
+class TestAxThreadExecutor(object):
+    """
+    Test AxThreadExecutor object.
+    """
+
+    #
+    # Tests
+    #
+
+    def test_submit(self):
+        executor = AxThreadExecutor(max_workers=3)
+        futures = [executor.submit(pow, n, 2) for n in range(10)]
+        assert AxFuture.gather(futures).result() == [n*n for n in range(10)]
+        assert len(executor._threads) == 3
+        with pytest.raises(ZeroDivisionError):
+            executor.submit(lambda: 1 / 0).result()
+        executor.shutdown()
+        with pytest.raises(RuntimeError):
+            executor.submit(pow, 2, 2)
+        str(executor)
+
+    def test_max_workers(self):
+        executor = AxThreadExecutor(max_workers=2)
+        lock = threading.Lock()
+        running = [0, 0]   # current, max
+        release = threading.Event()
+        def _work():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            release.wait()
+            with lock:
+                running[0] -= 1
+        futures = [executor.submit(_work) for n in range(5)]
+        threading.Timer(0.05, release.set).start()
+        AxFuture.gather(futures).result()
+        assert running == [0, 2]
+        executor.shutdown()
+
+    def test_bad(self):
+        with pytest.raises(TypeError):
+            AxThreadExecutor(max_workers='Not int')
+        with pytest.raises(ValueError):
+            AxThreadExecutor(max_workers=0)
+
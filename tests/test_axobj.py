@@ -13,7 +13,8 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 import pytest
 from datetime import datetime
 
-from axonchisel.metrics.foundation.ax.obj import AxObj
+import axonchisel.metrics.foundation.ax.obj as obj
+from axonchisel.metrics.foundation.ax.obj import AxObj, AxSlotsObj
 
 
 # ----------------------------------------------------------------------------
@@ -109,6 +110,29 @@ class TestAxObj(object):
         with pytest.raises(TypeError):
             axo._assert_type_list("param", [A(), 10], ofsupercls=A)
 
+    def test_slots(self):
+        class C(AxSlotsObj):
+            __slots__ = ('a',)
+        c = C()
+        c.a = 1
+        with pytest.raises(AttributeError):
+            c.b = 2
+        with pytest.raises(TypeError):
+            c._assert_type_string("a", c.a)
+        str(c)
+
+    def test_validation_level(self):
+        assert obj.get_validation_level() == 'FULL'
+        assert obj.is_validation_full()
+        try:
+            obj.set_validation_level('BOUNDARY')
+            assert obj.get_validation_level() == 'BOUNDARY'
+            assert not obj.is_validation_full()
+            with pytest.raises(ValueError):
+                obj.set_validation_level('BOGUS')
+        finally:
+            obj.set_validation_level('FULL')
+
 
     #
     # Internal Helpers
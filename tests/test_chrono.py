@@ -12,15 +12,20 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
+import copy
+import pickle
+
 import pytest
 from datetime import datetime, timedelta
 
 from .util import dt
 
+import axonchisel.metrics.foundation.ax.obj as obj
 import axonchisel.metrics.foundation.chrono.timerange as timerange
 import axonchisel.metrics.foundation.chrono.framespec as framespec
 import axonchisel.metrics.foundation.chrono.ghost as ghost
 import axonchisel.metrics.foundation.chrono.stepper as stepper
+import axonchisel.metrics.foundation.chrono.dtmath as dtmath
 
 
 # ----------------------------------------------------------------------------
@@ -95,6 +100,63 @@ class TestTimeRange(object):
         tmrange = timerange.TimeRange(inc_begin=dts[4], exc_end=dts[5])
         assert tmrange.duration == timedelta(days=59, seconds=720)
 
+    def test_compare(self, dts):
+        tmrange1 = timerange.TimeRange(inc_begin=dts[0], exc_end=dts[1])
+        tmrange2 = timerange.TimeRange(inc_begin=dts[0], exc_end=dts[1])
+        tmrange3 = timerange.TimeRange(inc_begin=dts[1], exc_end=dts[2])
+        tmrange4 = timerange.TimeRange(inc_begin=dts[4], exc_end=dts[5])
+        assert tmrange1 == tmrange2
+        assert tmrange1 <= tmrange2
+        assert not (tmrange1 < tmrange2)
+        tmrange2.anchor = dts[0]
+        assert tmrange1 != tmrange2
+        assert tmrange1 < tmrange3 and tmrange1 <= tmrange3
+        assert tmrange3 > tmrange1 and tmrange3 >= tmrange1
+        assert not (tmrange1 < tmrange4 or tmrange1 > tmrange4 or
+            tmrange1 == tmrange4)   # (overlap)
+        assert tmrange1 != 'Not TimeRange'
+        with pytest.raises(TypeError):
+            hash(tmrange1)
+        assert {tmrange1.frozen(): 1}[tmrange1.frozen()] == 1
+
+    def test_frozen(self, dts):
+        tmrange1 = timerange.TimeRange(inc_begin=dts[4], exc_end=dts[5],
+            anchor=dts[4])
+        ftmrange1 = tmrange1.frozen()
+        ftmrange2 = timerange.FrozenTimeRange(inc_begin=dts[4],
+            exc_end=dts[5], anchor=dts[4])
+        ftmrange3 = timerange.FrozenTimeRange.from_trusted(dts[4], dts[5])
+        assert ftmrange1 == tmrange1 == ftmrange2 != ftmrange3
+        assert len(set([ftmrange1, ftmrange2, ftmrange3])) == 2
+        assert ftmrange2.inc_end == tmrange1.inc_end
+        assert ftmrange2.frozen() is ftmrange2
+        assert copy.deepcopy(ftmrange2) is ftmrange2
+        assert pickle.loads(pickle.dumps(ftmrange2)) == ftmrange2
+        assert pickle.loads(pickle.dumps(tmrange1)) == tmrange1
+        with pytest.raises(AttributeError):
+            ftmrange1.anchor = dts[5]
+        with pytest.raises(AttributeError):
+            ftmrange1.inc_begin = dts[5]
+        with pytest.raises(AttributeError):
+            ftmrange1.foo = 123
+        with pytest.raises(ValueError):
+            timerange.FrozenTimeRange(inc_begin=dts[4])
+        with pytest.raises(ValueError):
+            timerange.TimeRange().frozen()
+        str(ftmrange1)
+
+    def test_frozen_validation_level(self, dts):
+        ftmrange = timerange.FrozenTimeRange.from_trusted(dts[4], None)
+        with pytest.raises(ValueError):
+            ftmrange.validate()
+        try:
+            obj.set_validation_level('BOUNDARY')
+            ftmrange.validate()   # (trusted)
+            with pytest.raises(ValueError):
+                timerange.TimeRange(inc_begin=dts[4]).validate()
+        finally:
+            obj.set_validation_level('FULL')
+
     #
     # Internal Helpers
     #
@@ -134,6 +196,18 @@ class TestFrameSpec(object):
         tmfrspec = framespec.FrameSpec(smooth_val=4, smooth_unit='HOUR')
         assert tmfrspec.smooth_val == 4
 
+    def test_key(self, dts):
+        tmfrspec1 = framespec.FrameSpec(reframe_dt=dts[4])
+        tmfrspec2 = framespec.FrameSpec(reframe_dt=dts[4], smooth_unit='WEEK')
+        assert tmfrspec1.key() == tmfrspec2.key()
+        assert len(set([tmfrspec1.key(), tmfrspec2.key()])) == 1
+        tmfrspec2.smooth_val = 2
+        assert tmfrspec1.key() != tmfrspec2.key()
+        tmfrspec2.accumulate = tmfrspec1.accumulate = True
+        assert tmfrspec1.key() == tmfrspec2.key()
+        tmfrspec2.reframe_dt = dts[5]
+        assert tmfrspec1.key() != tmfrspec2.key()
+
     def test_invalid(self):
         tmfrspec = framespec.FrameSpec()
         with pytest.raises(ValueError):
@@ -146,6 +220,21 @@ class TestFrameSpec(object):
             framespec.FrameSpec(mode='BOGUSMODE')
         with pytest.raises(TypeError):
             framespec.FrameSpec(reframe_dt='not a datetime')
+        with pytest.raises(ValueError):
+            framespec.FrameSpec(timezone='Mars/Olympus')
+        with pytest.raises(TypeError):
+            framespec.FrameSpec(timezone=123)
+
+    def test_timezone(self, dts):
+        tmfrspec1 = framespec.FrameSpec(reframe_dt=dts[4])
+        tmfrspec2 = framespec.FrameSpec(reframe_dt=dts[4],
+            timezone='America/New_York')
+        assert tmfrspec1.timezone is None
+        assert tmfrspec2.timezone == 'America/New_York'
+        assert tmfrspec1.key() != tmfrspec2.key()
+        assert 'America/New_York' in str(tmfrspec2)
+        tmfrspec2.timezone = None
+        assert tmfrspec1.key() == tmfrspec2.key()
 
     #
     # Internal Helpers
@@ -155,6 +244,49 @@ class TestFrameSpec(object):
 # ----------------------------------------------------------------------------
 
 
+class TestGhost(object):
+    """
+    Test Ghost object on its own.
+    """
+
+    #
+    # Tests
+    #
+
+    def test_compare(self):
+        g1 = ghost.Ghost('PREV_YEAR1')
+        g2 = ghost.Ghost('PREV_YEAR1')
+        assert g1 == g2 and not (g1 != g2)
+        g2.gtype = 'PREV_YEAR2'
+        assert g1 != g2
+        assert g1 != 'Not Ghost'
+        with pytest.raises(TypeError):
+            hash(g1)
+        assert pickle.loads(pickle.dumps(g1)) == g1
+
+    def test_frozen(self):
+        g1 = ghost.Ghost('PREV_PERIOD2')
+        fg1 = g1.frozen()
+        fg2 = ghost.FrozenGhost('PREV_PERIOD2')
+        assert fg1 == g1 == fg2
+        assert len(set([fg1, fg2, ghost.FrozenGhost('PREV_YEAR1')])) == 2
+        assert fg2.frozen() is fg2
+        assert copy.deepcopy(fg2) is fg2
+        assert pickle.loads(pickle.dumps(fg2)) == fg2
+        with pytest.raises(AttributeError):
+            fg1.gtype = 'PREV_YEAR1'
+        with pytest.raises(AttributeError):
+            fg1.foo = 123
+        with pytest.raises(ValueError):
+            ghost.FrozenGhost('BOGUS')
+        with pytest.raises(TypeError):
+            ghost.FrozenGhost(123)
+        str(fg1)
+
+
+# ----------------------------------------------------------------------------
+
+
 class TestStepper(object):
     """
     Test Stepper object.
@@ -178,6 +310,8 @@ class TestStepper(object):
         })
         assert len(steps) == 28
         assert steps[5].inc_begin == dt('2014-02-06 00:00:00 000000')
+        assert len(set(steps)) == 28
+        assert steps[4] < steps[5]
 
     def test_str(self, dts):
         tmfrspec_dict = {
@@ -381,6 +515,108 @@ class TestStepper(object):
         steps = list(stepper.Stepper(tmfrspec, ghost=g1).steps())
         assert steps[0].anchor == dt('2014-01-25 00:00:00 000000')
         #
+        tmfrspec.reframe_dt = dt('2016-02-29 12:00')
+        tmfrspec.range_val = 1
+        g1 = ghost.Ghost('PREV_YEAR1')
+        steps = list(stepper.Stepper(tmfrspec, ghost=g1).steps())
+        assert steps[0].anchor == dt('2015-02-28 00:00:00 000000')
+        assert steps[0].exc_end == dt('2015-03-01 00:00:00 000000')
+
+    def test_timezone_dst(self):
+        tz = 'America/Los_Angeles'
+        def _dst_steps(reframe_dt, range_unit='DAY', gran_unit='HOUR'):
+            return self._steps({
+                'range_unit' : range_unit,
+                'range_val'  : 1,
+                'gran_unit'  : gran_unit,
+                'mode'       : 'CURRENT',
+                'reframe_dt' : reframe_dt,
+                'timezone'   : tz,
+            })
+        steps = _dst_steps(dt('2014-03-09 12:00'))
+        assert len(steps) == 23
+        assert steps[2].inc_begin.replace(tzinfo=None) == dt('2014-03-09 03:00')
+        assert steps[-1].exc_end - steps[0].inc_begin == timedelta(hours=23)
+        steps = _dst_steps(dt('2014-11-02 12:00'))
+        assert len(steps) == 25
+        assert steps[1].inc_begin.replace(tzinfo=None) == \
+            steps[2].inc_begin.replace(tzinfo=None)   # (01:00 twice)
+        steps = _dst_steps(dt('2014-03-12'), 'WEEK', 'DAY')
+        assert len(steps) == 7
+        durations = [s.exc_end - s.inc_begin for s in steps]
+        assert durations[0] == timedelta(hours=23)
+        assert durations[1:] == [timedelta(hours=24)] * 6
+        # (same moment framed in another zone steps differently:)
+        reframe_dt = steps[0].inc_begin
+        tmfrspec = framespec.FrameSpec(range_unit='DAY', gran_unit='HOUR',
+            reframe_dt=reframe_dt, timezone='America/New_York')
+        steps = list(stepper.Stepper(tmfrspec).steps())
+        assert steps[0].inc_begin.replace(tzinfo=None) == dt('2014-03-09')
+        assert steps[0].inc_begin == reframe_dt - timedelta(hours=3)
+
+    def test_timezone_ghosts(self):
+        tmfrspec = framespec.FrameSpec(range_unit='DAY', range_val=1,
+            gran_unit='HOUR', reframe_dt=dt('2014-11-03 12:00'),
+            timezone='America/Los_Angeles')
+        g1 = ghost.Ghost('PREV_PERIOD1')
+        steps = list(stepper.Stepper(tmfrspec, ghost=g1).steps())
+        assert len(steps) == 25
+        g1 = ghost.Ghost('PREV_YEAR1')
+        steps = list(stepper.Stepper(tmfrspec, ghost=g1).steps())
+        assert len(steps) == 25   # (2013 DST ended Nov 3)
+        assert steps[0].inc_begin.replace(tzinfo=None) == dt('2013-11-03')
+        assert steps[0].inc_begin.utcoffset() == timedelta(hours=-7)
+
+    def test_stepplans(self, dts):
+        tmfrspec = framespec.FrameSpec(reframe_dt=dts[4])
+        plans = stepper.StepPlans()
+        steps = plans.steps(tmfrspec)
+        assert steps == tuple(stepper.Stepper(tmfrspec).steps())
+        assert plans.steps(copy.deepcopy(tmfrspec)) is steps
+        assert plans.analyze(tmfrspec) == \
+            stepper.Stepper(tmfrspec).analyze()
+        g1 = ghost.Ghost('PREV_PERIOD1')
+        assert plans.steps(tmfrspec, ghost=g1)[0].anchor == dt('2014-01-01')
+        assert plans.stats() == {'hits': 2, 'misses': 2, 'size': 2}
+        tmfrspec.reframe_dt = None
+        assert plans.steps(tmfrspec) is not plans.steps(tmfrspec)
+        plans.clear()
+        assert plans.stats()['size'] == 0
+        str(plans)
+
+    def test_steps_array(self):
+        frames = [
+            ('YEAR', 1, 'MONTH', None, 0),
+            ('YEAR', 2, 'QUARTER', 'MONTH', 5),
+            ('QUARTER', 1, 'WEEK', 'DAY', 14),
+            ('MONTH', 2, 'DAY', 'DAY', 10),
+            ('YEAR', 1, 'MONTH', 'MONTH', 2),
+            ('MONTH', 1, 'MONTH', None, 0),
+            ('WEEK', 1, 'HOUR', 'MINUTE30', 7),
+            ('DAY', 1, 'MINUTE', None, 0),
+            ('DAY', 3, 'MINUTE15', 'HOUR', 2),
+            ('HOUR', 5, 'SECOND', 'MINUTE', 1),
+            ('DAY', 1, 'WEEK', None, 0),
+        ]
+        reframes = [dt('2016-03-15 16:30:45 001234'),
+            dt('2014-12-31 23:59:59 999999')]
+        ghosts = [None, ghost.Ghost('PREV_PERIOD1'), ghost.Ghost('PREV_YEAR1')]
+        for (range_unit, range_val, gran_unit, smooth_unit, smooth_val) \
+                in frames:
+            for n in range(8):
+                tmfrspec = framespec.FrameSpec(range_unit=range_unit,
+                    range_val=range_val, gran_unit=gran_unit,
+                    mode=['CURRENT', 'LASTWHOLE'][n % 2],
+                    reframe_dt=reframes[n // 2 % 2],
+                    accumulate=(n == 7),
+                    allow_overflow_begin=(n // 4 == 1),
+                    allow_overflow_end=(n // 4 == 1))
+                if smooth_unit:
+                    tmfrspec.smooth_unit = smooth_unit
+                    tmfrspec.smooth_val = smooth_val
+                self._assert_steps_array(stepper.Stepper(tmfrspec,
+                    ghost=ghosts[n % 3]))
+
 
 
     #
@@ -395,6 +631,17 @@ class TestStepper(object):
             step1.set_option(o, v)
         steps = list(step1.steps())
         # print "steps=", len(steps), "\n", "\n".join([str(s) for s in steps])
+        self._assert_steps_array(step1)
         return steps
 
+    def _assert_steps_array(self, step1):
+        """Assert Stepper steps_array() matches its steps()."""
+        to_usec = dtmath.to_epoch_usec
+        expected = ([], [], [])
+        for s in step1.steps():
+            expected[0].append(to_usec(s.anchor))
+            expected[1].append(to_usec(s.inc_begin))
+            expected[2].append(to_usec(s.exc_end))
+        assert tuple(list(a) for a in step1.steps_array()) == expected
+
 
@@ -10,8 +10,15 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
+import copy
+
 import pytest
 
+import axonchisel.metrics.foundation.ax.obj as obj
+import axonchisel.metrics.foundation.data.columnar as columnar
+from axonchisel.metrics.foundation.data.series import DataSeries
+from axonchisel.metrics.foundation.metricdef.metricdef import FUNCS
+
 
 # ----------------------------------------------------------------------------
 
@@ -119,6 +126,19 @@ class TestDataSeries(object):
         dpoints = [dpoints[1], dpoints[2]]
         dseries[1].add_points(dpoints)
 
+    def test_add_values_validation_level(self, tmranges, dseries):
+        with pytest.raises(ValueError):
+            dseries[1].add_values(tmranges[0:2], [1, 2])
+        cds = columnar.ColumnarDataSeries()
+        try:
+            obj.set_validation_level('BOUNDARY')
+            dseries[1].add_values(tmranges[1:3], [1, None])
+            cds.add_values(tmranges[1:3], [1, None])
+        finally:
+            obj.set_validation_level('FULL')
+        assert dseries[1].values() == cds.values() == [1, None]
+        assert dseries[1].get_point(0).tmrange is tmranges[1]
+
     def test_div(self, dpoints, dseries):
         dpoints = [dpoints[1], dpoints[2]]
         dseries[1].add_points(dpoints)
@@ -177,6 +197,9 @@ class TestDataSeries(object):
             dseries[1].mdef = 'Not a MetricDef'
         with pytest.raises(TypeError):
             dseries[1].mdef = None
+        assert dseries[1].div_mdef is None
+        with pytest.raises(TypeError):
+            dseries[1].div_mdef = 'Not a MetricDef'
 
     #
     # Internal Helpers
@@ -186,6 +209,169 @@ class TestDataSeries(object):
 # ----------------------------------------------------------------------------
 
 
+class TestColumnarDataSeries(object):
+    """
+    Test ColumnarDataSeries class.
+    """
+
+    #
+    # Setup / Teardown
+    #
+
+    def setup_method(self, method):
+        self.cds1 = columnar.ColumnarDataSeries(id='c1')
+        self.cds2 = columnar.ColumnarDataSeries(id='c2')
+
+    #
+    # Tests
+    #
+
+    def test_points(self, dpoints, dseries):
+        self.cds1.add_points(dseries[3].iter_points())
+        assert self.cds1.count_points() == 3
+        for (dp1, dp2) in zip(dseries[3].iter_points(),
+                self.cds1.iter_points()):
+            assert dp2 is not dp1
+            assert dp2.value == dp1.value
+            assert type(dp2.value) is type(dp1.value)
+            assert dp2.tmrange.anchor == dp1.tmrange.anchor
+            assert dp2.tmrange.inc_begin == dp1.tmrange.inc_begin
+            assert dp2.tmrange.exc_end == dp1.tmrange.exc_end
+        assert self.cds1.get_point(-1).value == 2
+        with pytest.raises(IndexError):
+            self.cds1.get_point(3)
+        assert self.cds1.values() == dseries[3].values()
+        assert self.cds1.reduce('SUM') == 134
+        self.cds1.reset_points()
+        assert self.cds1.count_points() == 0
+        with pytest.raises(TypeError):
+            self.cds1.add_point('Not a DataPoint')
+        str(self.cds1)
+
+    def test_add_values(self, tmranges):
+        tmranges[1].anchor = None
+        self.cds1.add_values(tmranges[1:3], [None, 2.5])
+        assert self.cds1.values() == [None, 2.5]
+        assert self.cds1.count_missing() == 1
+        assert self.cds1.get_point(0).tmrange.anchor is None
+        with pytest.raises(TypeError):
+            self.cds1.add_values(tmranges[1:2], ['Not numeric'])
+        with pytest.raises(ValueError):
+            self.cds1.add_values([tmranges[0]], [1])
+
+    def test_set_value(self, dseries):
+        self.cds1.add_points(dseries[3].iter_points())
+        self.cds1.get_point(0).value = 99
+        assert self.cds1.get_point(0).value == 42
+        self.cds1.set_value(0, 99)
+        self.cds1.set_value(1, None)
+        self.cds1.set_value(2, 0.5)
+        assert self.cds1.values() == [99, None, 0.5]
+        with pytest.raises(TypeError):
+            self.cds1.set_value(0, 'Not numeric')
+
+    def test_div(self, dseries):
+        self.cds1.add_points(dseries[3].iter_points())
+        self.cds2.add_points(dseries[3].iter_points())
+        self.cds2.set_value(1, None)
+        self.cds1.div_series(self.cds2)
+        assert self.cds1.values() == [1, None, 1]
+        self.cds1.div_series(dseries[1])
+        assert self.cds1.count_missing() == 3
+
+    def test_scale(self, dseries):
+        self.cds1.add_points(dseries[3].iter_points())
+        self.cds1.set_value(1, None)
+        self.cds1.scale(3)
+        assert self.cds1.values() == [126, None, 6]
+        self.cds1.scale(0.5)
+        assert self.cds1.values() == [63.0, None, 3.0]
+        with pytest.raises(TypeError):
+            self.cds1.scale('Not numeric')
+        dseries[3].scale(2)
+        assert dseries[3].values() == [84, 180, 4]
+
+    def test_big_ints(self, tmranges):
+        big = [2**53 + 1, -(2**63 + 5), 7]
+        self.cds1.add_values(tmranges[1:4], big)
+        assert self.cds1.values() == big
+        assert self.cds1.get_point(-2).value == big[1]
+        assert self.cds1.reduce('SUM') == sum(big)
+        assert self.cds1.reduce('MAX') == big[0]
+        self.cds1.set_value(0, 2**70 + 3)
+        self.cds1.set_value(-2, 5)
+        assert self.cds1.values() == [2**70 + 3, 5, 7]
+        self.cds1.scale(3)
+        assert self.cds1.values() == [3 * 2**70 + 9, 15, 21]
+        self.cds1.set_value(0, 1)
+        assert self.cds1.values() == [1, 15, 21]
+        cds3 = copy.deepcopy(self.cds1)
+        cds3.set_value(1, 2**60 + 1)
+        assert cds3.values() == [1, 2**60 + 1, 21]
+        assert self.cds1.values() == [1, 15, 21]
+
+    @pytest.mark.skipif("columnar.numpy is None")
+    def test_numpy_matches_python(self, tmranges):
+        nan = float('nan')
+        valsets = [
+            [None], [None, None], [3], [0.5, None, -2],
+            [7, None, 7.0, -3, 11, None], [1e16, 1, -1e16, 2.5, 1],
+            [2**60, 2**60, 1], [1.5, nan, -1.0, None], [-7, 4, 0, 9],
+            [3002399751580331, 5], [-0.0, None, -0.0],
+        ]
+        def _results(vals, vals2, use_numpy):
+            columnar.USE_NUMPY = use_numpy
+            try:
+                results = list()
+                cds1 = columnar.ColumnarDataSeries()
+                cds1.add_values([tmranges[1]] * len(vals), vals)
+                for func in sorted(FUNCS):
+                    try:
+                        results.append(repr(cds1.reduce(func)))
+                    except ValueError:
+                        results.append('ValueError')
+                cds2 = columnar.ColumnarDataSeries()
+                cds2.add_values([tmranges[1]] * len(vals2), vals2)
+                try:
+                    cds1.div_series(cds2)
+                    results.append(repr(cds1.values()))
+                except ZeroDivisionError:
+                    results.append('ZeroDivisionError')
+                for factor in (3, -0.5):
+                    cds1.scale(factor)
+                    results.append(repr(cds1.values()))
+                return results
+            finally:
+                columnar.USE_NUMPY = columnar.numpy is not None
+        for vals in valsets:
+            for vals2 in valsets:
+                assert (_results(vals, vals2, True) ==
+                    _results(vals, vals2, False))
+
+    def test_scale_matches_dataseries(self, tmranges):
+        vals = [3002399751580331, 5, None, -(2**52)]
+        for factor in (3, 2, 2**53, 0.5, -1):
+            ds1 = DataSeries()
+            ds1.add_values(tmranges[1:5], vals)
+            self.cds1.reset_points()
+            self.cds1.add_values(tmranges[1:5], vals)
+            ds1.scale(factor)
+            self.cds1.scale(factor)
+            assert self.cds1.values() == ds1.values()
+            if factor == 3:
+                assert self.cds1.get_point(0).value == 9007199254740993
+
+    def test_copy(self, dseries):
+        self.cds1.add_points(dseries[3].iter_points())
+        cds3 = copy.deepcopy(self.cds1)
+        cds3.set_value(0, None)
+        assert self.cds1.get_point(0).value == 42
+        assert cds3.count_missing() == 1
+
+
+# ----------------------------------------------------------------------------
+
+
 class TestMultiDataSeries(object):
     """
     Test MultiDataSeries class.
@@ -10,11 +10,18 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
+import pickle
+import time
+from datetime import timedelta
+
 import pytest
 
 from .util import dt
 
 import axonchisel.metrics.foundation.chrono.dtmath as dtmath
+import axonchisel.metrics.foundation.chrono.calindex as calindex
+import axonchisel.metrics.foundation.chrono.epochconv as epochconv
+import axonchisel.metrics.foundation.chrono.tztable as tztable
 
 
 # ----------------------------------------------------------------------------
@@ -184,6 +191,14 @@ class TestMathAdd(object):
         t(+150,  '2164-02-14 16:30:45 001234')
         t(-150,  '1864-02-14 16:30:45 001234')
 
+    def test_add_clamp_day(self, dts):
+        assert dtmath.add_years(dt('2016-02-29 12:00'), 1) == dt('2017-02-28 12:00')
+        assert dtmath.add_years(dt('2016-02-29'), -4) == dt('2012-02-29')
+        assert dtmath.add_months(dt('2014-01-31'), 1) == dt('2014-02-28')
+        assert dtmath.add_months(dt('2016-03-31'), -1) == dt('2016-02-29')
+        assert dtmath.add_quarters(dt('2014-05-31'), 1) == dt('2014-08-31')
+        assert dtmath.add_months(dt('2014-12-31'), 12) == dt('2015-12-31')
+
     def test_add_macro(self, dts):
         dt2 = dtmath.add(dts[4],
             years=1, quarters=2, months=3, weeks=4, days=5,
@@ -194,8 +209,186 @@ class TestMathAdd(object):
         )
         assert dt2 == dt('2015-12-20 07:51:57 014248')
 
+    def test_epoch_usec(self, dts):
+        assert dtmath.to_epoch_usec(dt('1970-01-01')) == 0
+        assert dtmath.to_epoch_usec(dt('1970-01-02 00:00:01')) == 86401000000
+        assert dtmath.to_epoch_usec(dt('1969-12-31 23:59:59')) == -1000000
+        for d in dts[1:]:
+            assert dtmath.from_epoch_usec(dtmath.to_epoch_usec(d)) == d
+
     #
     # Internal Helpers
     #
 
 
+# ----------------------------------------------------------------------------
+
+
+class TestCalendarIndex(object):
+    """
+    Test CalendarIndex of period boundaries.
+    """
+
+    #
+    # Tests
+    #
+
+    def test_begin(self, dts):
+        for unit, (fn_begin, fn_add) in calindex.UNITS.iteritems():
+            for ofs in (0, 1, -1):
+                calidx = calindex.CalendarIndex(unit, ofs)
+                for d in dts[1:] + [dt('2016-02-29 23:59:59 999999')]:
+                    if unit == 'WEEK':
+                        assert calidx.begin(d) == fn_begin(d, ofs)
+                    else:
+                        assert calidx.begin(d) == fn_begin(d)
+        calidx = calindex.CalendarIndex('MONTH')
+        assert calidx.begin(dt('1000-05-05 05:05')) == dt('1000-05-01')
+        assert calidx.begin(dt('0001-05-05')).year == 1   # (not indexed)
+        str(calidx)
+
+    def test_add(self, dts):
+        for unit, (fn_begin, fn_add) in calindex.UNITS.iteritems():
+            calidx = calindex.CalendarIndex(unit)
+            for d in dts[1:]:
+                for d2 in (d, calidx.begin(d)):
+                    for delta in (0, 1, -1, 13, -57, 400, -1500):
+                        assert calidx.add(d2, delta) == fn_add(d2, delta)
+        calidx = calindex.get_index('MONTH')
+        assert calidx is calindex.get_index('MONTH', 3)
+        assert calidx.add(dt('2016-01-31'), 1) == dt('2016-02-29')
+        assert calindex.add_years(dt('2016-02-29'), -1) == dt('2015-02-28')
+        assert calindex.add_years(dt('2016-02-01'), -2) == dt('2014-02-01')
+        assert calidx.add(dt('9990-01-01'), 100) == dt('9998-05-01')
+        with pytest.raises(ValueError):
+            calidx.add(dt('9990-01-01'), 1000)
+
+    def test_bounds_usec(self, dts):
+        calidx = calindex.CalendarIndex('QUARTER')
+        bounds = calidx.bounds_usec(dt('2014-01-01'), dt('2014-07-01 00:00:01'))
+        assert bounds == [dtmath.to_epoch_usec(dt(s)) for s in (
+            '2014-01-01', '2014-04-01', '2014-07-01', '2014-10-01')]
+        bounds = calidx.bounds_usec(dt('2000-01-01'), dt('2030-01-01'))
+        assert len(bounds) == 121
+        assert calidx.bounds_usec(dt('2014-01-01'), dt('2014-01-01')) == []
+        assert calidx.bounds_usec(dt('2014-01-02'), dt('2015-01-01')) is None
+
+    def test_bad(self):
+        with pytest.raises(ValueError):
+            calindex.CalendarIndex('DAY')
+        with pytest.raises(TypeError):
+            calindex.CalendarIndex('WEEK', 'Not int')
+
+
+# ----------------------------------------------------------------------------
+
+
+class TestEpochConverter(object):
+    """
+    Test EpochConverter datetime to time_t conversion.
+    """
+
+    #
+    # Tests
+    #
+
+    def test_local(self, dts):
+        conv = epochconv.EpochConverter()
+        def t(d):
+            assert conv.to_time_t(d) == int(time.mktime(d.timetuple()))
+        for d in dts[1:]:
+            t(d)
+        # (DST transition days, in steps through gaps and repeats:)
+        for day in ('2014-03-09', '2014-11-02', '1999-10-31'):
+            for minutes in xrange(0, 48*60, 20):
+                t(dt(day) + timedelta(minutes=minutes))
+        assert conv.to_time_t_list([dts[1], None]) == \
+            [conv.to_time_t(dts[1]), None]
+        assert epochconv.get_converter() is epochconv.get_converter(None)
+        str(conv)
+
+    def test_fixed(self, dts):
+        def t(tz, d, check):
+            assert epochconv.get_converter(tz).to_time_t(dt(d)) == check
+        t('UTC',    '1970-01-01 00:00:01 999999', 1)
+        t('GMT',    '2014-04-14', 1397433600)
+        t('+05:30', '1970-01-01 05:30', 0)
+        t('-0800',  '1969-12-31 16:00', 0)
+        t('-08',    '1970-01-01', 28800)
+        assert epochconv.get_converter('+01:00').timezone == '+01:00'
+
+    def test_bad(self):
+        with pytest.raises(TypeError):
+            epochconv.EpochConverter(123)
+        for tz in ('Mars/Olympus', '+5', '+05:75', ''):
+            with pytest.raises(ValueError):
+                epochconv.EpochConverter(tz)
+
+
+class TestTZTable(object):
+    """
+    Test TZTable timezone transition tables.
+    """
+
+    #
+    # Tests
+    #
+
+    def test_offsets(self):
+        tzt = tztable.get_table('America/Los_Angeles')
+        assert tzt is tztable.get_table('America/Los_Angeles')
+        assert tzt.zone_id == 'America/Los_Angeles'
+        assert tzt.utcoffset_at(1392395445) == -8 * 3600   # 2014-02-14
+        assert tzt.utcoffset_at(1397493765) == -7 * 3600   # 2014-04-14
+        # (beyond 2037, from POSIX TZ rule:)
+        d = tzt.localize(dt('2050-07-01'))
+        assert d.utcoffset() == timedelta(hours=-7)
+        assert tzt.localize(dt('2050-12-01')).tzname() == 'PST'
+        assert tztable.get_table('UTC').localize(dt('2014-04-14')) \
+            .utcoffset() == timedelta(0)
+        str(tzt)
+
+    def test_localize(self):
+        tzt = tztable.get_table('America/Los_Angeles')
+        def t(d, check, hours):
+            d2 = tzt.localize(dt(d))
+            assert d2.replace(tzinfo=None) == dt(check)
+            assert d2.utcoffset() == timedelta(hours=hours)
+        t('2014-03-09 01:59', '2014-03-09 01:59', -8)
+        t('2014-03-09 02:30', '2014-03-09 03:30', -7)   # (skipped)
+        t('2014-11-02 01:30', '2014-11-02 01:30', -7)   # (repeated)
+        t('2014-11-02 02:00', '2014-11-02 02:00', -8)
+        assert tzt.localize(dt('2014-03-10')) - \
+            tzt.localize(dt('2014-03-09')) == timedelta(hours=23)
+        assert tzt.localize(dt('2014-11-03')) - \
+            tzt.localize(dt('2014-11-02')) == timedelta(hours=25)
+
+    def test_convert(self):
+        tzt = tztable.get_table('America/Los_Angeles')
+        tzt_ny = tztable.get_table('America/New_York')
+        d = tzt.localize(dt('2014-11-02 01:30'))
+        d2 = tzt_ny.convert(d)
+        assert d2.replace(tzinfo=None) == dt('2014-11-02 03:30')   # (EST)
+        assert d2 == d
+        assert tzt.fromutc(dt('2014-11-02 09:30')).utcoffset() == \
+            timedelta(hours=-8)
+        assert tzt.convert(dt('2014-04-14')) == tzt.localize(dt('2014-04-14'))
+        assert tzt.fromlocal(dt('2014-04-14 12:00')).tzinfo.zone_id == \
+            'America/Los_Angeles'
+
+    def test_pickle(self):
+        d = tztable.get_table('America/Los_Angeles').localize(dt('2014-04-14'))
+        d2 = pickle.loads(pickle.dumps(d, pickle.HIGHEST_PROTOCOL))
+        assert d2 == d
+        assert d2.utcoffset() == d.utcoffset()
+        assert d2.tzinfo.tztable is d.tzinfo.tztable
+
+    def test_bad(self):
+        with pytest.raises(TypeError):
+            tztable.TZTable(123)
+        for zone_id in ('Mars/Olympus', '../etc/passwd', '/etc/localtime', ''):
+            with pytest.raises(ValueError):
+                tztable.get_table(zone_id)
+        with pytest.raises(ValueError):
+            tztable.TZTable('Bad/Zone', data='not a TZif file')
+
@@ -10,10 +10,17 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
+import pickle
+import threading
+import time
+
 import pytest
 
 import axonchisel.metrics.foundation.chrono.timerange as timerange
-from axonchisel.metrics.io.emfetch.interface import EMFetcher
+from axonchisel.metrics.foundation.ax.future import AxFuture
+from axonchisel.metrics.foundation.chrono.epochconv import get_converter
+from axonchisel.metrics.foundation.data.point import DataPoint
+from axonchisel.metrics.io.emfetch.interface import EMFetcher, FetchCancelled
 from axonchisel.metrics.io.emfetch.base import EMFetcherBase
 import axonchisel.metrics.io.emfetch.plugins.emf_random as emf_random
 from axonchisel.metrics.io.emfetch.tmrange_time_t import TimeRange_time_t
@@ -88,6 +95,107 @@ class TestEMFetcher(object):
         with pytest.raises(TypeError):
             emf.fetch(tmranges[1])
 
+    def test_fetch_batch_fallback(self, mdefs, tmranges):
+        emf = emf_random.EMFetcher_random(mdefs[1])
+        emf.plugin_create()
+        dpoints = emf.fetch_batch(tmranges[1:])
+        assert len(dpoints) == 3
+        for dpoint, tmrange in zip(dpoints, tmranges[1:]):
+            assert dpoint.tmrange is tmrange
+        assert emf.fetch_batch([]) == []
+        with pytest.raises(TypeError):
+            emf.fetch_batch(['Not TimeRange'])
+        with pytest.raises(ValueError):
+            emf.fetch_batch([tmranges[1], tmranges[0]])
+        emf.plugin_destroy()
+
+    def test_fetch_batch_cancel(self, mdefs, tmranges):
+        cancel = threading.Event()
+        class EMFetcher_cancel(EMFetcherBase):
+            fetched = 0
+            def plugin_create(self): pass
+            def plugin_destroy(self): pass
+            def plugin_fetch(self, tmrange):
+                self.fetched += 1
+                cancel.set()   # (deadline expires during first fetch)
+                return DataPoint(tmrange=tmrange, value=1)
+        emf = EMFetcher_cancel(mdefs[1])
+        with pytest.raises(FetchCancelled):
+            emf.fetch_batch(tmranges[1:], cancel)
+        assert emf.fetched == 1
+        with pytest.raises(FetchCancelled):
+            emf.fetch_batch(tmranges[1:], cancel)
+        assert emf.fetched == 1
+        assert len(emf.fetch_batch(tmranges[1:])) == 3
+        # (points fetched before cancel are still delivered:)
+        cancel.clear()
+        fetched = list()
+        with pytest.raises(FetchCancelled):
+            emf.fetch_batch(tmranges[1:], cancel, fetched.extend)
+        assert [dp.tmrange for dp in fetched] == [tmranges[1]]
+
+    def test_fetch_batch(self, mdefs, tmranges):
+        class EMFetcher_batch(EMFetcherBase):
+            def plugin_create(self): pass
+            def plugin_destroy(self): pass
+            def plugin_fetch(self, tmrange): raise AssertionError("unbatched")
+            def plugin_fetch_batch(self, tmranges):
+                self.spanned = self._tmrange
+                return [DataPoint(tmrange=t, value=i)
+                    for i, t in enumerate(tmranges)]
+        emf = EMFetcher_batch(mdefs[1])
+        fetched = list()
+        dpoints = emf.fetch_batch(tmranges[1:], on_fetched=fetched.append)
+        assert [dp.value for dp in dpoints] == [0, 1, 2]
+        assert fetched == [dpoints]
+        assert emf.spanned.inc_begin == tmranges[1].inc_begin
+        assert emf.spanned.exc_end == tmranges[2].exc_end
+
+    def test_fetch_batch_bad_result(self, mdefs, tmranges):
+        class EMFetcher_bad_batch(EMFetcherBase):
+            def plugin_create(self): pass
+            def plugin_destroy(self): pass
+            def plugin_fetch(self, tmrange): pass
+            def plugin_fetch_batch(self, tmranges):
+                return [DataPoint(tmrange=tmranges[0])]
+        emf = EMFetcher_bad_batch(mdefs[1])
+        with pytest.raises(ValueError):
+            emf.fetch_batch(tmranges[1:])
+
+    def test_fetch_batch_async(self, mdefs, tmranges):
+        class EMFetcher_async(EMFetcherBase):
+            def plugin_create(self): pass
+            def plugin_destroy(self): pass
+            def plugin_fetch(self, tmrange): raise AssertionError("sync")
+            def plugin_fetch_async(self, tmrange):
+                return AxFuture.from_result(
+                    DataPoint(tmrange=tmrange, value=7))
+        class EMFetcher_batch_async(EMFetcher_async):
+            def plugin_fetch_batch_async(self, tmranges):
+                return AxFuture.from_result([DataPoint(tmrange=t, value=i)
+                    for i, t in enumerate(tmranges)])
+        emf = EMFetcher_async(mdefs[1])
+        dpoints = emf.fetch_batch_async(tmranges[1:]).result()
+        assert [dp.value for dp in dpoints] == [7, 7, 7]
+        assert emf.fetch_batch_async([]).result() == []
+        emf = EMFetcher_batch_async(mdefs[1])
+        dpoints = emf.fetch_batch_async(tmranges[1:]).result()
+        assert [dp.value for dp in dpoints] == [0, 1, 2]
+        emf = emf_random.EMFetcher_random(mdefs[1])
+        assert emf.fetch_batch_async(tmranges[1:]) is None
+
+    def test_fetch_batch_async_bad_result(self, mdefs, tmranges):
+        class EMFetcher_bad_async(EMFetcherBase):
+            def plugin_create(self): pass
+            def plugin_destroy(self): pass
+            def plugin_fetch(self, tmrange): pass
+            def plugin_fetch_batch_async(self, tmranges):
+                return AxFuture.from_result([DataPoint(tmrange=tmranges[0])])
+        emf = EMFetcher_bad_async(mdefs[1])
+        future = emf.fetch_batch_async(tmranges[1:])
+        with pytest.raises(ValueError):
+            future.result()
+
     def test_plugin_option(self, mdefs):
         emf = emf_random.EMFetcher_random(mdefs[1])
         assert emf.plugin_option('foo') == 123
@@ -169,6 +277,25 @@ class TestEMFetcher(object):
         assert tmrange.exc_begin_time_t == 1397518964
         assert tmrange.inc_end_time_t == 1397605364
         assert tmrange.exc_end_time_t == 1397605365
+        tmrange = TimeRange_time_t(tmranges[2], get_converter('+01:00'))
+        assert tmrange.inc_begin_time_t == 1397490165
+        assert pickle.loads(pickle.dumps(tmrange)).exc_end_time_t == 1397576565
+
+    def test_tmrange_time_t_list(self, mdefs, tmranges):
+        tmranges_t = TimeRange_time_t.from_list(tmranges[1:])
+        for tmrange, tmrange_t in zip(tmranges[1:], tmranges_t):
+            assert tmrange_t == tmrange
+            for name in ('inc_begin', 'exc_begin', 'inc_end', 'exc_end'):
+                assert getattr(tmrange_t, name + '_time_t') == int(
+                    time.mktime(getattr(tmrange, name).timetuple()))
+
+    def test_timezone_extinfo(self, mdefs, tmranges):
+        emf = emf_random.EMFetcher_random(mdefs[1],
+            extinfo={'timezone': 'UTC'})
+        emf.fetch(tmranges[2])
+        assert emf._format_str("{tmrange.exc_end:%s}") == "1397580165"
+        emf.fetch_batch(tmranges[1:3])
+        assert emf._format_str("{tmrange.exc_end:%s}") == "1397580165"
 
 
 
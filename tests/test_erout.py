@@ -53,6 +53,9 @@ class TestEROut(object):
             absbase.plugin_destroy()
         with pytest.raises(NotImplementedError):
             absbase.plugin_output(mdseries[1], query=queries[2])
+        with pytest.raises(NotImplementedError):
+            absbase.plugin_output_series(None, query=queries[2])
+        absbase.plugin_output_finish(query=queries[2])
 
     def test_plugin_extinfo(self, queries):
         ero = ero_strbuf.EROut_strbuf(extinfo=self.extinfo)
@@ -120,6 +123,24 @@ class TestEROut_csv(object):
         assert lines[6] == 'q3,s3,PREV_PERIOD1,2014-02-14 16:30:45,2014-02-14 16:30:45,2014-04-14 16:42:45,2'
         ero.plugin_destroy()
 
+    def test_plugin_stream(self, queries, mdseries):
+        ero = ero_csv.EROut_csv(extinfo=self.extinfo)
+        ero.plugin_create()
+        ero.output(mdseries[3], query=queries[4])
+        lines1 = self.buf.getvalue().splitlines()
+        self.buf.truncate(0)
+        ero.plugin_create()
+        assert ero.can_stream
+        for dseries in mdseries[3].iter_series():
+            ero.output_series(dseries, query=queries[4])
+        ero.output_finish(query=queries[4])
+        assert self.buf.getvalue().splitlines() == lines1
+        assert ero.mdseries is None
+        with pytest.raises(TypeError):
+            ero.output_series(mdseries[3], query=queries[4])
+        ero.plugin_destroy()
+        assert not ero_strbuf.EROut_strbuf().can_stream
+
     def test_plugin_date_format1(self, queries, mdseries):
         ero = ero_csv.EROut_csv(extinfo=self.extinfo)
         ero._format_datetime('%Y-%m-%d', None)
@@ -139,6 +160,16 @@ class TestEROut_csv(object):
         assert lines[6] == 'q3,s3,PREV_PERIOD1,1392424245,1392424245,1397518965,2'
         ero.plugin_destroy()
 
+    def test_plugin_date_format_timezone(self, queries, mdseries):
+        self.extinfo['timezone'] = 'UTC'
+        ero = ero_csv.EROut_csv(extinfo=self.extinfo)
+        ero.configure(options={'date_format': '%s'})
+        ero.plugin_create()
+        ero.output(mdseries[3], query=queries[4])
+        lines = self.buf.getvalue().splitlines()
+        assert lines[6] == 'q3,s3,PREV_PERIOD1,1392395445,1392395445,1397493765,2'
+        ero.plugin_destroy()
+
 
 
 
@@ -19,6 +19,10 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 import pytest
 import logging
 import json
+import time
+
+import axonchisel.metrics.foundation.chrono.dtmath as dtmath
+import axonchisel.metrics.foundation.chrono.tztable as tztable
 
 import axonchisel.metrics.io.erout.plugins.ero_geckoboard as ero_geckoboard
 from axonchisel.metrics.run.servant.config import ServantConfig
@@ -26,7 +30,7 @@ from axonchisel.metrics.run.servant.request import ServantRequest
 from axonchisel.metrics.run.servant.state import ServantState
 from axonchisel.metrics.run.servant.servant import Servant
 
-from .util import log_config, load_metset, load_queryset
+from .util import dt, log_config, load_metset, load_queryset
 
 
 # ----------------------------------------------------------------------------
@@ -102,6 +106,37 @@ class TestEROut_geckoboard(object):
         assert jout2['orientation'] == 'vertical'
         assert jout2['item'][0]['label'] == "New Users"
 
+    def test_bullet_timezone(self, monkeypatch):
+        # (frame day in zone far from server local time, half over:)
+        tz = 'Pacific/Kiritimati'
+        for query_id in self.query_ids:
+            tmfrspec = self.queryset1.get_query_by_id(query_id) \
+                .qtimeframe.tmfrspec
+            tmfrspec.range_unit = 'DAY'
+            tmfrspec.range_val = 1
+            tmfrspec.gran_unit = 'HOUR'
+            tmfrspec.reframe_dt = dt('2014-04-14 12:00')
+            tmfrspec.timezone = tz
+        tnow = dtmath.to_epoch_usec(tztable.get_table(tz).localize(
+            dt('2014-04-14 12:00'))) / 1e6
+        monkeypatch.setattr(time, 'time', lambda: tnow)
+        self.erout_extinfo.update({
+            'geckoboard_bullet': {
+            }
+        })
+        servant = Servant(self.sconfig)
+        self.sreq.collapse = True
+        self.sreq.noghosts = True
+        self.sreq.erout_plugin_ids = ['geckoboard_bullet']
+        servant.process(self.sreq)
+        jout2 = json.loads(json.dumps(self.jout))
+        assert len(jout2['item']) == 4
+        for item in jout2['item']:
+            measure = item['measure']
+            assert measure['projected']['end'] == pytest.approx(
+                measure['projected']['start'] + 2 *
+                (measure['current']['end'] - measure['projected']['start']))
+
     def test_numsec_comp(self):
         self.erout_extinfo.update({
             'geckoboard_numsec_comp': {
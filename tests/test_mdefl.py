@@ -52,7 +52,7 @@ class TestMetricDefParse(object):
 
     def test_parse_missing_ok(self):
         missing_ok = [
-            'data_field', 'data_type', 'emfetch_opts',
+            'data_field', 'data_type', 'emfetch_opts', 'settle_secs',
         ]
         for m in missing_ok:
             qobj = yaml.load(self.yaml_metric1)
@@ -74,6 +74,7 @@ class TestMetricDefParse(object):
         mdef2.validate()
         assert mdef2.emfetch_id == 'mysql'
         assert mdef2.emfetch_opts.get('db') == 'mydb1'
+        assert mdef2.settle_secs == 3600
         assert mdef2.table == 'first_sales'
         assert mdef2.func == 'COUNT'
         assert mdef2.time_field == 'timeCreated'
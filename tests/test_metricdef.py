@@ -66,6 +66,33 @@ class TestMetricDef(object):
         assert mdefs[1].data_field == 'myval'
         assert mdefs[1].data_type == 'NUM_INT'
 
+    def test_fingerprint(self, mdefs, filters):
+        fp1 = mdefs[1].fingerprint()
+        assert len(fp1) == 40
+        mdef2 = copy.deepcopy(mdefs[1])
+        mdef2.id = 'other_id'
+        assert mdef2.fingerprint() == fp1
+        mdef2.settle_secs = 3600
+        assert mdef2.fingerprint() == fp1
+        mdef2.emfetch_opts['foo'] = 124
+        assert mdef2.fingerprint() != fp1
+        mdef3 = copy.deepcopy(mdefs[1])
+        mdef3.filters.add_filter(filters[1])
+        assert mdef3.fingerprint() != fp1
+        assert mdefs[0].fingerprint() != fp1
+        fp2 = mdefs[1].fingerprint({'host': 'db1'})
+        assert fp2 != fp1
+        assert mdefs[1].fingerprint({'host': 'db1'}) == fp2
+        assert mdefs[1].fingerprint({'host': 'db2'}) != fp2
+
+    def test_settle_secs(self, mdefs):
+        assert mdefs[1].settle_secs == 0
+        mdefs[1].settle_secs = 90.5
+        with pytest.raises(ValueError):
+            mdefs[1].settle_secs = -1
+        with pytest.raises(TypeError):
+            mdefs[1].settle_secs = 'soon'
+
     def test_filters_misc(self, mdefs, filters):
         str(mdefs[1].filters)
         filter1 = filters[3]
@@ -10,10 +10,17 @@ Copyright (c) 2014 Dan Kamins, AxonChisel.net
 # ----------------------------------------------------------------------------
 
 
+import copy
+from datetime import datetime, timedelta
+import threading
+import time
+
 import pytest
 
 import axonchisel.metrics.foundation.chrono.framespec as framespec
+import axonchisel.metrics.foundation.chrono.stepper as stepper
 import axonchisel.metrics.foundation.metricdef.mdefl as mdefl
+import axonchisel.metrics.foundation.metricdef.metricdef as metricdef
 import axonchisel.metrics.foundation.query.query as query
 import axonchisel.metrics.foundation.query.qdata as qdata
 import axonchisel.metrics.foundation.query.qtimeframe as qtimeframe
@@ -22,6 +29,20 @@ import axonchisel.metrics.foundation.query.qghosts as qghosts
 import axonchisel.metrics.foundation.query.queryset as queryset
 import axonchisel.metrics.foundation.query.mql as mql
 import axonchisel.metrics.run.mqengine.mqengine as mqengine
+import axonchisel.metrics.run.mqengine.mqestate as mqestate
+import axonchisel.metrics.run.mqengine.asyncengine as asyncengine
+import axonchisel.metrics.run.mqengine.parallel as parallel
+import axonchisel.metrics.run.mqengine.emfpool as emfpool
+import axonchisel.metrics.run.mqengine.stepcache as stepcache
+import axonchisel.metrics.run.mqengine.decompose as decompose
+import axonchisel.metrics.run.mqengine.singleflight as singleflight
+from axonchisel.metrics.foundation.ax.future import AxFuture
+import axonchisel.metrics.foundation.data.columnar as columnar
+import axonchisel.metrics.foundation.chrono.dtmath as dtmath
+import axonchisel.metrics.foundation.chrono.tztable as tztable
+from axonchisel.metrics.foundation.chrono.timerange import TimeRange
+from axonchisel.metrics.foundation.data.point import DataPoint
+from axonchisel.metrics.io.emfetch.base import EMFetcherBase
 
 from .util import dt, log_config, load_metset, load_query
 
@@ -41,6 +62,109 @@ TEST_EXTRA_HTTP = False
 # ----------------------------------------------------------------------------
 
 
+class EMFetcher_hourly(EMFetcherBase):
+    """
+    Deterministic test EMFetcher, applying MetricDef func to synthetic
+    data with one value per hour, counting hours scanned.
+    """
+    scan_count = 0
+    def plugin_create(self): pass
+    def plugin_destroy(self): pass
+    def plugin_fetch(self, tmrange):
+        vals = list()
+        hour = tmrange.inc_begin
+        while hour < tmrange.exc_end:
+            vals.append((hour.toordinal() * 24 + hour.hour) % 7)
+            EMFetcher_hourly.scan_count += 1
+            hour += timedelta(hours=1)
+        reduce_func = metricdef.FUNCS[self.mdef.func]['reduce']
+        return DataPoint(tmrange=tmrange, value=reduce_func(vals))
+
+class EMFetcher_hourly_float(EMFetcher_hourly):
+    """
+    EMFetcher_hourly variant with float hourly values (inexact sums).
+    """
+    def plugin_fetch(self, tmrange):
+        vals = list()
+        hour = tmrange.inc_begin
+        while hour < tmrange.exc_end:
+            vals.append(((hour.toordinal() * 24 + hour.hour) % 7) * 0.1)
+            EMFetcher_hourly.scan_count += 1
+            hour += timedelta(hours=1)
+        reduce_func = metricdef.FUNCS[self.mdef.func]['reduce']
+        return DataPoint(tmrange=tmrange, value=reduce_func(vals))
+
+class EMFetcher_hourly_async(EMFetcher_hourly):
+    """
+    EMFetcher_hourly variant supporting async fetch, completing each
+    batch from another thread, counting batches in flight.
+    """
+    lock = threading.Lock()
+    in_flight = [0, 0]   # current, max
+    fail = False
+    def plugin_fetch_batch_async(self, tmranges):
+        with EMFetcher_hourly_async.lock:
+            self.in_flight[0] += 1
+            self.in_flight[1] = max(self.in_flight)
+        future = AxFuture()
+        def _complete():
+            dpoints = [self.plugin_fetch(t) for t in tmranges]
+            with EMFetcher_hourly_async.lock:
+                self.in_flight[0] -= 1
+            if self.fail:
+                future.set_exc_info((KeyError, KeyError("failed"), None))
+            else:
+                future.set_result(dpoints)
+        threading.Timer(0.001, _complete).start()
+        return future
+
+
+class EMFetcher_overlap(EMFetcher_hourly):
+    """
+    EMFetcher_hourly variant taking a moment per blocking fetch,
+    counting fetches in flight.
+    """
+    lock = threading.Lock()
+    in_flight = [0, 0]   # current, max
+    def plugin_fetch(self, tmrange):
+        with EMFetcher_overlap.lock:
+            self.in_flight[0] += 1
+            self.in_flight[1] = max(self.in_flight)
+        try:
+            time.sleep(0.005)
+            return EMFetcher_hourly.plugin_fetch(self, tmrange)
+        finally:
+            with EMFetcher_overlap.lock:
+                self.in_flight[0] -= 1
+
+
+class EMFetcher_slow(EMFetcher_hourly):
+    """
+    EMFetcher_hourly variant taking delay secs per fetch,
+    counting fetches.
+    """
+    delay = 0.2
+    fetch_count = 0
+    def plugin_fetch(self, tmrange):
+        EMFetcher_slow.fetch_count += 1
+        time.sleep(self.delay)
+        return EMFetcher_hourly.plugin_fetch(self, tmrange)
+
+
+class EMFetcher_slow_recent(EMFetcher_slow):
+    """
+    EMFetcher_slow variant taking delay secs only for steps
+    from 2013-08-14 on.
+    """
+    def plugin_fetch(self, tmrange):
+        if tmrange.inc_begin < dt('2013-08-14'):
+            return EMFetcher_hourly.plugin_fetch(self, tmrange)
+        return EMFetcher_slow.plugin_fetch(self, tmrange)
+
+
+# ----------------------------------------------------------------------------
+
+
 def setup_module(module):
     log_config(level=logging.INFO)
     # log_config(level=logging.DEBUG)
@@ -89,6 +213,537 @@ class TestMQEngine(object):
         str(self.mqe1)
         str(self.mqe1._state)
 
+    def test_fetch_workers(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        mds1 = self.mqe1.query( self.query1 )
+        mqe2 = mqengine.MQEngine( self.metset1, fetch_workers=3 )
+        mds2 = mqe2.query( self.query1 )
+        assert mds1.count_series() == mds2.count_series()
+        for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+            assert ds1.id == ds2.id
+            assert ds1.count_points() == ds2.count_points()
+            anchors1 = [dp.tmrange.anchor for dp in ds1.iter_points()]
+            anchors2 = [dp.tmrange.anchor for dp in ds2.iter_points()]
+            assert anchors1 == anchors2
+
+    def test_series_workers(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        mds1 = self.mqe1.query( self.query1 )
+        mqe2 = mqengine.MQEngine( self.metset1,
+            series_workers=4, fetch_workers=2 )
+        mds2 = mqe2.query( self.query1 )
+        assert mds1.count_series() == mds2.count_series() == 4
+        for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+            assert ds1.id == ds2.id
+            assert ds1.count_points() == ds2.count_points()
+        with pytest.raises(ValueError):
+            mqengine.MQEngine( self.metset1, series_workers=0 )
+
+    def test_fetch_workers_extinfo(self):
+        emfetch_extinfo = { 'random': { 'mqengine': { 'fetch_workers': 4 } } }
+        mqe2 = mqengine.MQEngine( self.metset1, emfetch_extinfo )
+        assert mqe2.fetch_workers == 1
+        assert mqe2.emfetch_option_for('random', 'fetch_workers', 1) == 4
+        assert mqe2.emfetch_option_for('other', 'fetch_workers', 1) == 1
+        mds = mqe2.query( self.query1 )
+
+    def test_fetch_workers_bad(self):
+        with pytest.raises(ValueError):
+            mqengine.MQEngine( self.metset1, fetch_workers=0 )
+        with pytest.raises(TypeError):
+            mqengine.MQEngine( self.metset1, fetch_workers='many' )
+
+    def test_emfetcher_reuse(self):
+        mds = self.mqe1.query( self.query1 )
+        pool = self.mqe1._emfpool
+        assert pool.count_fetchers() == 0
+        assert pool.count_created == pool.count_acquired == 2  # (2 metrics)
+
+    def test_emfetcher_session(self):
+        pool = self.mqe1._emfpool
+        self.mqe1.open_session()
+        mds1 = self.mqe1.query( self.query1 )
+        created = pool.count_created
+        assert pool.count_fetchers() == created
+        mds2 = self.mqe1.query( self.query1 )
+        assert pool.count_created == created
+        assert pool.count_acquired == 4
+        self.mqe1.close_session()
+        assert pool.count_fetchers() == 0
+
+    def test_ghost_ranges_shared(self):
+        tmfrspec = self.query1.qtimeframe.tmfrspec
+        tmfrspec.reframe_dt = dt('2013-08-15')
+        tmfrspec.smooth_unit = 'DAY'
+        tmfrspec.smooth_val = 7
+        tmfrspec.allow_overflow_begin = True
+        self.query1.qdata.get_qmetric(0).div_metric_id = None
+        mdef = self.metset1.get_metric_by_id('rev_new_sales')
+        mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        mdef.data_type = 'MONEY_INT100'
+        mqe2 = mqengine.MQEngine( self.metset1, decompose=True )
+        EMFetcher_hourly.scan_count = 0
+        mds = mqe2.query( self.query1 )
+        hours = set()
+        for ds in mds.iter_series():
+            if ds.mdef is mdef:
+                for dp in ds.iter_points():
+                    hour = dp.tmrange.inc_begin
+                    while hour < dp.tmrange.exc_end:
+                        hours.add(hour)
+                        hour += timedelta(hours=1)
+        assert EMFetcher_hourly.scan_count == len(hours)
+
+    def test_query_many(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef = self.metset1.get_metric_by_id(mid)
+            mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        query2 = copy.deepcopy(self.query1)
+        query2.id = 'other_query'
+        EMFetcher_hourly.scan_count = 0
+        mds1 = self.mqe1.query( self.query1 )
+        scanned1 = EMFetcher_hourly.scan_count
+        EMFetcher_hourly.scan_count = 0
+        (mds2a, mds2b) = self.mqe1.query_many([ self.query1, query2 ])
+        assert EMFetcher_hourly.scan_count == scanned1
+        assert self.mqe1.query_many([]) == []
+        for (mds2, q) in ((mds2a, self.query1), (mds2b, query2)):
+            assert mds2.count_series() == mds1.count_series()
+            for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+                assert ds2.id == ds1.id.replace(self.query1.id, q.id)
+                assert [dp.value for dp in ds1.iter_points()] == \
+                    [dp.value for dp in ds2.iter_points()]
+        assert mds2b.get_series(0).query_id == 'other_query'
+
+    def test_query_stream(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef = self.metset1.get_metric_by_id(mid)
+            mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        query2 = copy.deepcopy(self.query1)
+        query2.id = 'other_query'
+        mds_list = self.mqe1.query_many([self.query1, query2])
+        events = list()
+        mqe2 = mqengine.MQEngine( self.metset1, series_workers=3 )
+        mqe2.query_stream([self.query1, query2],
+            lambda ds, q: events.append((q.id, ds.id,
+                [dp.value for dp in ds.iter_points()])),
+            lambda q: events.append(q.id))
+        expected = list()
+        for q, mds in zip([self.query1, query2], mds_list):
+            for ds in mds.iter_series():
+                expected.append((q.id, ds.id,
+                    [dp.value for dp in ds.iter_points()]))
+            expected.append(q.id)
+        assert events == expected
+
+    def test_refresh(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15 12:00')
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef = self.metset1.get_metric_by_id(mid)
+            mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        EMFetcher_hourly.scan_count = 0
+        mds1 = self.mqe1.query( self.query1 )
+        scanned1 = EMFetcher_hourly.scan_count
+        EMFetcher_hourly.scan_count = 0
+        mds2 = self.mqe1.refresh( mds1, self.query1 )
+        assert 0 < EMFetcher_hourly.scan_count < scanned1 / 5
+        assert mds2 is not mds1
+        for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+            assert ds2.id == ds1.id
+            assert [(dp.tmrange.inc_begin, dp.value)
+                for dp in ds2.iter_points()] == \
+                [(dp.tmrange.inc_begin, dp.value) for dp in ds1.iter_points()]
+        with pytest.raises(TypeError):
+            self.mqe1.refresh( 'Not MDS', self.query1 )
+        with pytest.raises(ValueError):
+            self.mqe1.query_many( [self.query1], previous=[] )
+
+    def test_refresh_div_mdef(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15 12:00')
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef = self.metset1.get_metric_by_id(mid)
+            mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        EMFetcher_hourly.scan_count = 0
+        mds1 = self.mqe1.query( self.query1 )
+        scanned1 = EMFetcher_hourly.scan_count
+        assert mds1.get_series(0).div_mdef is mdef
+        mdef = copy.deepcopy(mdef)
+        mdef.emfetch_opts['redefined'] = True
+        self.metset1.add_metric(mdef)
+        EMFetcher_hourly.scan_count = 0
+        mds2 = self.mqe1.refresh( mds1, self.query1 )
+        assert EMFetcher_hourly.scan_count == scanned1
+        assert mds2.count_series() == mds1.count_series()
+
+    def test_columnar(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef = self.metset1.get_metric_by_id(mid)
+            mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        mds1 = self.mqe1.query( self.query1 )
+        mqe2 = mqengine.MQEngine( self.metset1, columnar=True )
+        mds2 = mqe2.query( self.query1 )
+        for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+            assert isinstance(ds2, columnar.ColumnarDataSeries)
+            assert ds2.id == ds1.id
+            assert [(dp.tmrange.anchor, dp.tmrange.inc_begin,
+                    dp.tmrange.exc_end, dp.value)
+                for dp in ds2.iter_points()] == \
+                [(dp.tmrange.anchor, dp.tmrange.inc_begin,
+                    dp.tmrange.exc_end, dp.value)
+                for dp in ds1.iter_points()]
+        mds3 = mqe2.refresh( mds2, self.query1 )
+        assert mds3.get_series(0).values() == mds2.get_series(0).values()
+        with pytest.raises(TypeError):
+            mqengine.MQEngine( self.metset1, columnar='Not bool' )
+
+    def test_stepplans(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        query2 = copy.deepcopy(self.query1)
+        query2.id = 'other_query'
+        stepplans = stepper.StepPlans()
+        mqe2 = mqengine.MQEngine( self.metset1, stepplans=stepplans )
+        (mds1, mds2) = mqe2.query_many([ self.query1, query2 ])
+        # (one plan each for primary and its ghosts, shared by all series):
+        stats = stepplans.stats()
+        assert stats['size'] == 1 + self.query1.qghosts.count_ghosts()
+        assert stats['misses'] == stats['size']
+        assert stats['hits'] >= mds1.count_series() + mds2.count_series() \
+            - stats['size']
+        assert mds2.get_series(0).values() == mds1.get_series(0).values()
+        with pytest.raises(TypeError):
+            mqengine.MQEngine( self.metset1, stepplans='Not StepPlans' )
+
+    def test_deadline(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        mds1 = self.mqe1.query( self.query1 )
+        mdef = self.metset1.get_metric_by_id('new_users')
+        mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_slow'
+        EMFetcher_slow.fetch_count = 0
+        t0 = time.time()
+        mds2 = self.mqe1.query( self.query1, timeout=0.1 )
+        assert time.time() - t0 < 1.0
+        assert mds2.count_series() == mds1.count_series()
+        for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+            assert ds2.id == ds1.id
+            assert ds2.count_points() == ds1.count_points()
+            if 'new_users' in ds2.id:  # (incl div by it)
+                assert ds2.count_missing() == ds2.count_points()
+            else:
+                assert ds2.count_missing() < ds2.count_points()
+        # (abandoned fetches stop once current step is done:)
+        for thread in threading.enumerate():
+            if thread.name == 'mqe-call':
+                thread.join(5.0)
+        assert 0 < EMFetcher_slow.fetch_count <= 2
+        # (and deadline of next query on engine does not revive them:)
+        self.mqe1.query( self.query1, timeout=0.1 )
+        for thread in threading.enumerate():
+            if thread.name == 'mqe-call':
+                thread.join(5.0)
+        assert EMFetcher_slow.fetch_count <= 4
+        mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        mds3 = self.mqe1.query( self.query1, timeout=30 )
+        assert mds3.get_series(0).count_missing() == 0
+        with pytest.raises(TypeError):
+            self.mqe1.query( self.query1, timeout='Not numeric' )
+
+    def test_deadline_partial(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef = self.metset1.get_metric_by_id(mid)
+            mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        mds1 = self.mqe1.query( self.query1 )
+        mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_slow_recent'
+        EMFetcher_slow.delay = 1.0
+        try:
+            for mqe2 in (mqengine.MQEngine( self.metset1 ),
+                    asyncengine.AsyncMQEngine( self.metset1 )):
+                mds2 = mqe2.query( self.query1, timeout=0.3 )
+                for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+                    for dp1, dp2 in zip(ds1.iter_points(),
+                            ds2.iter_points()):
+                        if dp2.tmrange.inc_begin < dt('2013-08-14'):
+                            assert dp2.value == dp1.value
+                        else:
+                            assert dp2.value is None
+                assert 0 < mds2.get_series(0).count_missing() < \
+                    mds2.get_series(0).count_points()
+        finally:
+            EMFetcher_slow.delay = 0.2
+            for thread in threading.enumerate():
+                if thread.name.startswith('mqe-'):
+                    thread.join(5.0)
+
+    def test_deadline_cached(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        self.query1.qdata.get_qmetric(0).div_metric_id = None
+        mdef = self.metset1.get_metric_by_id('rev_new_sales')
+        mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        cache = stepcache.MemoryStepCache()
+        for mqe2 in (mqengine.MQEngine( self.metset1, stepcache=cache ),
+                asyncengine.AsyncMQEngine( self.metset1, stepcache=cache )):
+            cache.clear()
+            mds1 = mqe2.query( self.query1, timeout=0 )
+            ds = mds1.get_series(0)
+            assert ds.count_missing() == ds.count_points()
+            mds2 = mqe2.query( self.query1 )
+            EMFetcher_hourly.scan_count = 0
+            mds3 = mqe2.query( self.query1, timeout=0 )
+            assert EMFetcher_hourly.scan_count == 0
+            for ds2, ds3 in zip(mds2.iter_series(), mds3.iter_series()):
+                assert ds3.count_missing() == 0
+                assert ds3.values() == ds2.values()
+
+    def test_singleflight(self):
+        sflight = singleflight.SingleFlight()
+        mqe2 = mqengine.MQEngine( self.metset1, singleflight=sflight,
+            fetch_workers=2 )
+        mds = mqe2.query( self.query1 )
+        assert sflight.count_calls > 0
+        assert mds.count_series() == 4
+        with pytest.raises(TypeError):
+            mqengine.MQEngine( self.metset1, singleflight='Not SingleFlight' )
+
+    def test_stepcache(self):
+        cache = stepcache.MemoryStepCache()
+        mqe2 = mqengine.MQEngine( self.metset1, stepcache=cache )
+        mds1 = mqe2.query( self.query1 )
+        stats1 = cache.stats()
+        assert stats1['hits'] < stats1['misses']
+        mqe3 = mqengine.MQEngine( self.metset1, stepcache=cache,
+            fetch_workers=2 )
+        mds2 = mqe3.query( self.query1 )
+        stats2 = cache.stats()
+        assert stats2['misses'] == stats1['misses']
+        assert stats2['size'] == stats1['size']
+        for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+            assert ds1.id == ds2.id
+            values1 = [dp.value for dp in ds1.iter_points()]
+            values2 = [dp.value for dp in ds2.iter_points()]
+            assert values1 == values2
+
+    def test_stepcache_extinfo(self):
+        cache = stepcache.MemoryStepCache()
+        mqe2 = mqengine.MQEngine( self.metset1, stepcache=cache )
+        mqe2.query( self.query1 )
+        stats1 = cache.stats()
+        mqe3 = mqengine.MQEngine( self.metset1,
+            { '_default': { 'host': 'other' } }, stepcache=cache )
+        mqe3.query( self.query1 )
+        stats2 = cache.stats()
+        assert stats2['misses'] == 2 * stats1['misses']
+        assert stats2['size'] == 2 * stats1['size']
+        mqe4 = mqengine.MQEngine( self.metset1,
+            { '_default': { 'mqengine': { 'fetch_workers': 2 } } },
+            stepcache=cache )
+        mqe4.query( self.query1 )
+        assert cache.stats()['misses'] == stats2['misses']
+        mdef = self.metset1.get_metric_by_id('new_users')
+        assert mqe2.fingerprint_for(mdef) == mdef.fingerprint({})
+        assert mqe3.fingerprint_for(mdef) != mqe2.fingerprint_for(mdef)
+        assert mqe4.fingerprint_for(mdef) == mqe2.fingerprint_for(mdef)
+
+    def test_stepcache_closed_steps(self):
+        cache = stepcache.MemoryStepCache()
+        mqe2 = mqengine.MQEngine( self.metset1, stepcache=cache,
+            stepcache_ttl=None )
+        mds1 = mqe2.query( self.query1 )
+        stats1 = cache.stats()
+        assert 0 < stats1['size'] < stats1['misses']
+        cache.clear()
+        for mid in ('rev_new_sales', 'new_users'):
+            self.metset1.get_metric_by_id(mid).settle_secs = 86400*365*10
+        mds2 = mqe2.query( self.query1 )
+        assert cache.stats()['size'] == 0
+
+    def test_stepcache_settle_secs(self):
+        cache = stepcache.MemoryStepCache()
+        mqe2 = mqengine.MQEngine( self.metset1, stepcache=cache,
+            stepcache_ttl=None )
+        mds1 = mqe2.query( self.query1 )
+        stats1 = cache.stats()
+        assert stats1['size'] > 0
+        metset2 = copy.deepcopy(self.metset1)
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef1 = self.metset1.get_metric_by_id(mid)
+            mdef2 = metset2.get_metric_by_id(mid)
+            mdef2.settle_secs = 86400*365*10
+            assert mdef2.fingerprint() == mdef1.fingerprint()
+            assert mqe2.fingerprint_for(mdef2) != mqe2.fingerprint_for(mdef1)
+        mqe3 = mqengine.MQEngine( metset2, stepcache=cache,
+            stepcache_ttl=None )
+        mds2 = mqe3.query( self.query1 )
+        stats2 = cache.stats()
+        assert stats2['hits'] == stats1['hits']
+        assert stats2['misses'] == 2 * stats1['misses']
+        assert stats2['size'] == stats1['size']
+        assert mds2.count_series() == mds1.count_series()
+
+    def test_group_settle_secs(self):
+        cache = stepcache.MemoryStepCache()
+        mqe2 = mqengine.MQEngine( self.metset1, stepcache=cache,
+            stepcache_ttl=None )
+        mqe2.query( self.query1 )
+        stats0 = cache.stats()
+        mqe2.query( self.query1 )
+        stats1 = cache.stats()
+        mdef = copy.deepcopy(self.metset1.get_metric_by_id('new_users'))
+        mdef.id = 'new_users_settled'
+        mdef.settle_secs = 86400*365*10
+        self.metset1.add_metric(mdef)
+        self.query1.qdata.add_qmetric(qdata.QMetric(metric_id=mdef.id))
+        mds2 = mqe2.query( self.query1 )
+        stats2 = cache.stats()
+        assert mds2.count_series() == 8
+        # (settled series fetched apart, never served closed steps:)
+        assert stats2['hits'] - stats1['hits'] == \
+            stats1['hits'] - stats0['hits']
+        assert stats2['misses'] - stats1['misses'] > \
+            stats1['misses'] - stats0['misses']
+        assert stats2['size'] == stats1['size']
+
+    def test_stepcache_future_reframe_dt(self):
+        tmfrspec = self.query1.qtimeframe.tmfrspec
+        tmfrspec.reframe_dt = datetime.now() + timedelta(days=1000)
+        cache = stepcache.MemoryStepCache()
+        mqe2 = mqengine.MQEngine( self.metset1, stepcache=cache,
+            stepcache_ttl=None )
+        mds1 = mqe2.query( self.query1 )
+        assert cache.stats()['size'] == 0
+        mqe2.refresh( mds1, self.query1 )
+        assert cache.stats()['size'] == 0
+        tmfrspec.timezone = 'America/Los_Angeles'
+        mqe2.query( self.query1 )
+        assert cache.stats()['size'] == 0
+        until = mqe2._closed_until(tmfrspec.reframe_dt)
+        assert until < tmfrspec.reframe_dt
+        assert mqe2._closed_until(dt('2013-08-15')) == dt('2013-08-15')
+
+    def test_timezone(self):
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2014-03-12')
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef = self.metset1.get_metric_by_id(mid)
+            mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        query2 = copy.deepcopy(self.query1)
+        query2.id = 'other_query'
+        query2.qtimeframe.tmfrspec.timezone = 'America/Los_Angeles'
+        cache = stepcache.MemoryStepCache()
+        mqe2 = mqengine.MQEngine( self.metset1, stepcache=cache )
+        (mds1, mds2) = mqe2.query_many([ self.query1, query2 ])
+        ds1 = mds1.get_series(0)
+        ds2 = mds2.get_series(0)
+        assert ds1.tmfrspec.reframe_dt.tzinfo is None
+        assert ds2.tmfrspec.reframe_dt.tzinfo.zone_id == 'America/Los_Angeles'
+        steps1 = [dp.tmrange for dp in ds1.iter_points()]
+        steps2 = [dp.tmrange for dp in ds2.iter_points()]
+        assert [s.inc_begin for s in steps1] == \
+            [s.inc_begin.replace(tzinfo=None) for s in steps2]
+        assert steps2[0].exc_end - steps2[0].inc_begin == timedelta(hours=23)
+        assert cache.stats()['size'] > 0
+        mds3 = mqe2.refresh( mds2, query2 )
+        assert mds3.get_series(0).values() == ds2.values()
+        query2.qtimeframe.tmfrspec.reframe_dt = None
+        state = mqestate.MQEState(mqe2)
+        state.reset(query2)
+        state.pin_tmfrspec(dt('2014-03-12 09:30'))   # (server local)
+        reframe_dt = state.tmfrspec.reframe_dt
+        assert reframe_dt.tzinfo.zone_id == 'America/Los_Angeles'
+        assert dtmath.to_epoch_usec(reframe_dt) // 1000000 == \
+            int(time.mktime(dt('2014-03-12 09:30').timetuple()))
+
+    def test_timezone_pin_epoch(self):
+        query2 = copy.deepcopy(self.query1)
+        query2.qtimeframe.tmfrspec.timezone = 'America/Los_Angeles'
+        state = mqestate.MQEState(self.mqe1)
+        state.reset(query2)
+        # (2013-11-03 01:30 PST, after DST fall back repeats 01:00-02:00:)
+        secs = dtmath.to_epoch_usec(dt('2013-11-03 09:30')) // 1000000
+        state.pin_tmfrspec(secs + 0.25)
+        reframe_dt = state.tmfrspec.reframe_dt
+        assert reframe_dt.replace(tzinfo=None) == dt('2013-11-03 01:30:00 250000')
+        assert reframe_dt.utcoffset() == timedelta(hours=-8)
+        assert dtmath.to_epoch_usec(reframe_dt) == secs * 1000000 + 250000
+        state.reset(self.query1)
+        state.pin_tmfrspec(secs)
+        assert state.tmfrspec.reframe_dt == datetime.fromtimestamp(secs)
+        state.pin_tmfrspec()
+        assert state.tmfrspec.reframe_dt.tzinfo is None
+
+    def test_decompose(self):
+        tmfrspec = self.query1.qtimeframe.tmfrspec
+        tmfrspec.reframe_dt = dt('2013-08-15')
+        tmfrspec.range_unit = 'MONTH'
+        tmfrspec.smooth_unit = 'DAY'
+        tmfrspec.smooth_val = 7
+        qmetric = self.query1.qdata.get_qmetric(0)
+        qmetric.div_metric_id = None
+        mdef = self.metset1.get_metric_by_id(qmetric.metric_id)
+        mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        mdef.data_type = 'NUM_INT'
+        self._assert_decompose_same(mdef)
+
+    def test_decompose_accumulate(self):
+        tmfrspec = self.query1.qtimeframe.tmfrspec
+        tmfrspec.reframe_dt = dt('2013-08-15')
+        tmfrspec.range_unit = 'MONTH'
+        tmfrspec.accumulate = True
+        qmetric = self.query1.qdata.get_qmetric(0)
+        qmetric.div_metric_id = None
+        mdef = self.metset1.get_metric_by_id(qmetric.metric_id)
+        mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly'
+        mdef.data_type = 'MONEY_INT100'
+        self._assert_decompose_same(mdef)
+
+    def test_decompose_float(self):
+        tmfrspec = self.query1.qtimeframe.tmfrspec
+        tmfrspec.reframe_dt = dt('2013-08-15')
+        tmfrspec.range_unit = 'MONTH'
+        tmfrspec.accumulate = True
+        qmetric = self.query1.qdata.get_qmetric(0)
+        qmetric.div_metric_id = None
+        mdef = self.metset1.get_metric_by_id(qmetric.metric_id)
+        mdef.emfetch_id = 'tests.test_mqengine.EMFetcher_hourly_float'
+        assert mdef.data_type == 'MONEY_FLOAT'
+        assert not mqengine.MQEngine( self.metset1 ).decompose
+        self._assert_decompose_same(mdef, ('SUM', 'AVG'), fewer=False)
+        self._assert_decompose_same(mdef, ('MIN', 'MAX', 'FIRST', 'LAST'))
+        # (even if misdeclared integral, results still same:)
+        mdef.data_type = 'NUM_INT'
+        self._assert_decompose_same(mdef, ('SUM', 'AVG'), fewer=None)
+
+    def _assert_decompose_same(self, mdef, funcs=metricdef.FUNCS,
+            fewer=True):
+        """
+        Assert results same (exactly) with and without decompose,
+        with fewer (True) or same (False) hours scanned, unless None.
+        """
+        for func in funcs:
+            mdef.func = func
+            results = list()
+            counts = list()
+            for decomp in (False, True):
+                EMFetcher_hourly.scan_count = 0
+                mqe2 = mqengine.MQEngine( self.metset1, decompose=decomp )
+                mds = mqe2.query( self.query1 )
+                counts.append(EMFetcher_hourly.scan_count)
+                results.append([[(dp.tmrange.anchor, dp.tmrange.inc_begin,
+                        dp.tmrange.exc_end, dp.value)
+                    for dp in ds.iter_points()] for ds in mds.iter_series()])
+            assert results[0] == results[1]
+            if fewer:
+                assert counts[1] < counts[0]
+            elif fewer is not None:
+                assert counts[1] == counts[0]
+
+    def test_stepcache_bad(self):
+        with pytest.raises(TypeError):
+            mqengine.MQEngine( self.metset1, stepcache={} )
+        with pytest.raises(ValueError):
+            mqengine.MQEngine( self.metset1, stepcache_ttl=0 )
+
     @pytest.mark.skipif("not TEST_EXTRA_HTTP")
     def test_real_http_backend(self):
         metset1 = load_metset('mqe-metset2.yml')
@@ -105,3 +760,566 @@ class TestMQEngine(object):
         mds = mqe.query(query1)
 
 
+# ----------------------------------------------------------------------------
+
+
+class TestAsyncMQEngine(object):
+    """
+    Test AsyncMQEngine running Querys.
+    """
+
+    #
+    # Setup / Teardown
+    #
+
+    def setup_method(self, method):
+        self.metset1 = load_metset( 'mqe-metset1.yml' )
+        self.query1 = load_query( 'mqe-query1.yml' )
+        self.query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+
+    def _values(self, mds):
+        return [[(dp.tmrange.inc_begin, dp.value) for dp in ds.iter_points()]
+            for ds in mds.iter_series()]
+
+    def _use_emfetch(self, emfetch_id):
+        for mid in ('rev_new_sales', 'new_users'):
+            mdef = self.metset1.get_metric_by_id(mid)
+            mdef.emfetch_id = emfetch_id
+
+    #
+    # Tests
+    #
+
+    def test_same_as_sync(self):
+        self._use_emfetch('tests.test_mqengine.EMFetcher_hourly')
+        mds1 = mqengine.MQEngine( self.metset1 ).query( self.query1 )
+        mqe2 = asyncengine.AsyncMQEngine( self.metset1, fetch_workers=3 )
+        mds2 = mqe2.query( self.query1 )
+        assert self._values(mds2) == self._values(mds1)
+        assert mqe2._executors == {}
+        str(mqe2)
+
+    def test_async_fetcher(self):
+        self._use_emfetch('tests.test_mqengine.EMFetcher_hourly')
+        mds1 = mqengine.MQEngine( self.metset1 ).query( self.query1 )
+        self._use_emfetch('tests.test_mqengine.EMFetcher_hourly_async')
+        EMFetcher_hourly_async.in_flight[:] = [0, 0]
+        extinfo = { 'tests.test_mqengine.EMFetcher_hourly_async': {
+            'mqengine': { 'backend_limit': 2 } } }
+        mqe2 = asyncengine.AsyncMQEngine( self.metset1, extinfo,
+            fetch_workers=4, backend_limit=8 )
+        mqe2.open_session()
+        mds2 = mqe2.query( self.query1 )
+        assert self._values(mds2) == self._values(mds1)
+        assert EMFetcher_hourly_async.in_flight[0] == 0
+        assert 1 <= EMFetcher_hourly_async.in_flight[1] <= 2
+        assert mqe2._executors == {}
+        mqe2.close_session()
+
+    def test_overlap(self):
+        self._use_emfetch('tests.test_mqengine.EMFetcher_hourly')
+        mds1 = mqengine.MQEngine( self.metset1 ).query( self.query1 )
+        self._use_emfetch('tests.test_mqengine.EMFetcher_overlap')
+        for (mqe2, overlap) in ((mqengine.MQEngine( self.metset1 ), 1),
+                (asyncengine.AsyncMQEngine( self.metset1 ), 2)):
+            EMFetcher_overlap.in_flight[:] = [0, 0]
+            mds2 = mqe2.query( self.query1 )
+            assert self._values(mds2) == self._values(mds1)
+            assert EMFetcher_overlap.in_flight[1] == overlap  # (2 metrics)
+        extinfo = { 'tests.test_mqengine.EMFetcher_overlap': {
+            'mqengine': { 'backend_limit': 1 } } }
+        EMFetcher_overlap.in_flight[:] = [0, 0]
+        mqe2 = asyncengine.AsyncMQEngine( self.metset1, extinfo,
+            fetch_workers=4 )
+        mds2 = mqe2.query( self.query1 )
+        assert self._values(mds2) == self._values(mds1)
+        assert EMFetcher_overlap.in_flight[1] == 1
+
+    def test_backend_slots(self):
+        slots = asyncengine.BackendSlots(2)
+        started = list()
+        for n in range(5):
+            slots.start(lambda n=n: started.append(n))
+        assert started == [0, 1]
+        slots.release()
+        assert started == [0, 1, 2]
+        slots = asyncengine.BackendSlots(1)
+        slots.start(lambda: None)
+        del started[:]
+        def _start_and_release(n):
+            started.append(n)
+            slots.release()
+        for n in range(5000):
+            slots.start(lambda n=n: _start_and_release(n))
+        assert started == []
+        slots.release()   # (drains all without recursing)
+        assert started == range(5000)
+
+    def test_singleflight(self):
+        self._use_emfetch('tests.test_mqengine.EMFetcher_hourly')
+        mds1 = mqengine.MQEngine( self.metset1 ).query( self.query1 )
+        sflight = singleflight.SingleFlight()
+        mqe2 = asyncengine.AsyncMQEngine( self.metset1,
+            singleflight=sflight, fetch_workers=2 )
+        mds2 = mqe2.query( self.query1 )
+        assert self._values(mds2) == self._values(mds1)
+        assert sflight.count_calls > 0
+
+    def test_fetch_error(self):
+        self._use_emfetch('tests.test_mqengine.EMFetcher_hourly_async')
+        mqe2 = asyncengine.AsyncMQEngine( self.metset1 )
+        mqe2.open_session()
+        EMFetcher_hourly_async.fail = True
+        try:
+            with pytest.raises(KeyError):
+                mqe2.query( self.query1 )
+        finally:
+            EMFetcher_hourly_async.fail = False
+        assert mqe2._emfpool.count_fetchers() == 0
+        mqe2.close_session()
+
+    def test_deadline(self):
+        self._use_emfetch('tests.test_mqengine.EMFetcher_slow')
+        EMFetcher_slow.delay = 1.0
+        try:
+            for mqe2 in (asyncengine.AsyncMQEngine( self.metset1 ),
+                    mqengine.MQEngine( self.metset1 )):
+                t0 = time.time()
+                mds2 = mqe2.query( self.query1, timeout=0.1 )
+                assert time.time() - t0 < 0.5
+                ds = mds2.get_series(0)
+                assert ds.count_missing() == ds.count_points()
+                t0 = time.time()
+                mqe2.open_session()
+                mqe2.query( self.query1, timeout=0.1 )
+                mqe2.close_session()
+                assert time.time() - t0 < 0.5
+        finally:
+            EMFetcher_slow.delay = 0.2
+        # (abandoned fetches still finish in background:)
+        for thread in threading.enumerate():
+            if thread.name.startswith('mqe-'):
+                thread.join(5.0)
+
+    def test_bad(self):
+        with pytest.raises(TypeError):
+            asyncengine.AsyncMQEngine( self.metset1, backend_limit='Not int' )
+        with pytest.raises(ValueError):
+            asyncengine.AsyncMQEngine( self.metset1, backend_limit=0 )
+
+
+# ----------------------------------------------------------------------------
+
+
+class TestParallel(object):
+    """
+    Test MQEngine parallel helpers.
+    """
+
+    #
+    # Tests
+    #
+
+    def test_parallel_map(self):
+        items = range(50)
+        assert parallel.parallel_map(lambda x: x*2, items, 1) == \
+            [x*2 for x in items]
+        assert parallel.parallel_map(lambda x: x*2, items, 7) == \
+            [x*2 for x in items]
+        assert parallel.parallel_map(lambda x: x*2, [], 7) == []
+
+    def test_parallel_map_error(self):
+        def _func(x):
+            if x == 13:
+                raise KeyError("unlucky")
+            return x
+        with pytest.raises(KeyError):
+            parallel.parallel_map(_func, range(50), 5)
+
+    def test_split_chunks(self):
+        assert parallel.split_chunks(range(7), 3) == [[0,1,2], [3,4], [5,6]]
+        assert parallel.split_chunks(range(2), 5) == [[0], [1]]
+        assert parallel.split_chunks(range(3), 1) == [[0,1,2]]
+        assert parallel.split_chunks([], 3) == []
+
+
+# ----------------------------------------------------------------------------
+
+
+class FakeEMFetcher(object):
+    """Minimal stand-in EMFetcher recording its lifecycle."""
+    def __init__(self, mdef, extinfo):
+        self.mdef = mdef
+        self.extinfo = extinfo
+        self.created = self.destroyed = False
+    def plugin_create(self):
+        self.created = True
+    def plugin_destroy(self):
+        self.destroyed = True
+
+
+class TestEMFetcherPool(object):
+    """
+    Test MQEngine EMFetcher pool.
+    """
+
+    #
+    # Setup / Teardown
+    #
+
+    def setup_method(self, method):
+        self.pool = emfpool.EMFetcherPool(FakeEMFetcher)
+
+    #
+    # Tests
+    #
+
+    def test_reuse(self, mdefs):
+        emf1 = self.pool.acquire(mdefs[1], {'a': 1})
+        assert emf1.created
+        self.pool.release(emf1)
+        emf2 = self.pool.acquire(mdefs[1], {'a': 1})
+        assert emf2 is emf1
+        assert self.pool.count_created == 1
+        assert self.pool.count_acquired == 2
+        str(self.pool)
+
+    def test_distinct(self, mdefs):
+        emf1 = self.pool.acquire(mdefs[1], {'a': 1})
+        emf2 = self.pool.acquire(mdefs[1], {'a': 1})
+        assert emf2 is not emf1
+        self.pool.release(emf1)
+        self.pool.release(emf2)
+        emf3 = self.pool.acquire(mdefs[1], {'a': 2})
+        emf4 = self.pool.acquire(mdefs[0], {'a': 1})
+        assert emf3 not in (emf1, emf2)
+        assert emf4 not in (emf1, emf2, emf3)
+        assert self.pool.count_fetchers() == 4
+
+    def test_fingerprint_key(self, mdefs):
+        emf1 = self.pool.acquire(mdefs[1], {'a': 1})
+        self.pool.release(emf1)
+        mdef2 = copy.deepcopy(mdefs[1])
+        assert self.pool.acquire(mdef2, {'a': 1}) is emf1
+        mdefs[1].table = 'othertbl'
+        assert self.pool.acquire(mdefs[1], {'a': 1}) is not emf1
+
+    def test_unhashable_extinfo(self, mdefs):
+        extinfo = {'l': [1, {'x': 2}], 's': set([3])}
+        emf1 = self.pool.acquire(mdefs[1], extinfo)
+        self.pool.release(emf1)
+        assert self.pool.acquire(mdefs[1], extinfo) is emf1
+
+    def test_discard_destroy(self, mdefs):
+        emf1 = self.pool.acquire(mdefs[1], {})
+        emf2 = self.pool.acquire(mdefs[1], {})
+        self.pool.discard(emf1)
+        assert emf1.destroyed
+        assert self.pool.count_fetchers() == 1
+        self.pool.release(emf2)
+        self.pool.destroy()
+        assert emf2.destroyed
+        assert self.pool.count_fetchers() == 0
+        assert self.pool.acquire(mdefs[1], {}) is not emf2
+
+    def test_destroy_acquired(self, mdefs):
+        emf1 = self.pool.acquire(mdefs[1], {})
+        emf2 = self.pool.acquire(mdefs[1], {})
+        self.pool.destroy()
+        assert not emf1.destroyed
+        self.pool.release(emf1)
+        assert emf1.destroyed
+        self.pool.discard(emf2)
+        assert emf2.destroyed
+        assert self.pool.count_fetchers() == 0
+
+
+# ----------------------------------------------------------------------------
+
+
+class TestStepCache(object):
+    """
+    Test MQEngine step caches.
+    """
+
+    #
+    # Setup / Teardown
+    #
+
+    def setup_method(self, method):
+        self.cache = stepcache.MemoryStepCache(maxsize=3)
+
+    #
+    # Tests
+    #
+
+    def test_get_put(self, tmranges):
+        key1 = stepcache.StepCache.make_key('fp', tmranges[1])
+        key2 = stepcache.StepCache.make_key('fp', tmranges[2])
+        assert self.cache.get_many([key1]) == {}
+        self.cache.put_many([(key1, 12), (key2, None)])
+        assert self.cache.get_many([key1, key2]) == {key1: 12, key2: None}
+        stats = self.cache.stats()
+        assert (stats['hits'], stats['misses'], stats['size']) == (2, 1, 2)
+        self.cache.clear()
+        assert self.cache.get_many([key1]) == {}
+        str(self.cache)
+
+    def test_lru(self):
+        self.cache.put_many([(1, 'a'), (2, 'b'), (3, 'c')])
+        self.cache.get_many([1])
+        self.cache.put_many([(4, 'd')])
+        assert sorted(self.cache.get_many([1, 2, 3, 4])) == [1, 3, 4]
+        assert self.cache.stats()['evictions'] == 1
+        with pytest.raises(ValueError):
+            self.cache.maxsize = 0
+
+    def test_ttl(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(stepcache.time, 'time', lambda: now[0])
+        self.cache.put_many([(1, 'a')], ttl=10)
+        self.cache.put_many([(2, 'b')])
+        now[0] += 9
+        assert self.cache.get_many([1, 2]) == {1: 'a', 2: 'b'}
+        now[0] += 1
+        assert self.cache.get_many([1, 2]) == {2: 'b'}
+        assert self.cache.stats()['size'] == 1
+
+    def test_invalidate(self, tmranges):
+        key1 = stepcache.StepCache.make_key('fp1', tmranges[1])
+        key2 = stepcache.StepCache.make_key('fp2', tmranges[1])
+        self.cache.put_many([(key1, 1), (key2, 2)])
+        self.cache.invalidate('fp1')
+        assert self.cache.get_many([key1, key2]) == {key2: 2}
+
+    def test_aware_keys(self, tmranges):
+        tzt = tztable.get_table('America/Los_Angeles')
+        step = TimeRange(inc_begin=tzt.localize(dt('2014-03-09')),
+            exc_end=tzt.localize(dt('2014-03-10')))
+        key1 = stepcache.StepCache.make_key('fp', step)
+        assert key1 == ('fp' + stepcache.UTC_KEY_SUFFIX,
+            dt('2014-03-09 08:00'), dt('2014-03-10 07:00'))
+        key2 = stepcache.StepCache.make_key('fp', tmranges[1])
+        self.cache.put_many([(key1, 1), (key2, 2)])
+        self.cache.invalidate('fp')
+        assert self.cache.get_many([key1, key2]) == {}
+
+    def test_base_not_impl(self):
+        cache = stepcache.StepCache()
+        with pytest.raises(NotImplementedError):
+            cache.get_many([])
+        with pytest.raises(NotImplementedError):
+            cache.put_many([])
+
+
+class TestSQLiteStepCache(object):
+    """
+    Test MQEngine persistent SQLite step cache.
+    """
+
+    #
+    # Tests
+    #
+
+    def test_persist(self, tmpdir, tmranges):
+        path = str(tmpdir.join('steps.db'))
+        key1 = stepcache.StepCache.make_key('fp', tmranges[1])
+        key2 = stepcache.StepCache.make_key('fp', tmranges[2])
+        key3 = stepcache.StepCache.make_key('fp', tmranges[3])
+        cache1 = stepcache.SQLiteStepCache(path)
+        cache1.put_many([(key1, 12), (key2, None)])
+        cache1.put_many([(key3, 3.5)], ttl=60)  # (not stored)
+        cache1.close()
+        cache2 = stepcache.SQLiteStepCache(path)
+        assert cache2.get_many([key1, key2, key3]) == {key1: 12, key2: None}
+        stats = cache2.stats()
+        assert (stats['hits'], stats['misses'], stats['size']) == (2, 1, 2)
+        cache2.invalidate('fp')
+        assert cache2.get_many([key1]) == {}
+        str(cache2)
+
+    def test_layered(self, tmranges):
+        mem = stepcache.MemoryStepCache()
+        db = stepcache.SQLiteStepCache(':memory:')
+        cache = stepcache.LayeredStepCache([mem, db])
+        key1 = stepcache.StepCache.make_key('fp', tmranges[1])
+        key2 = stepcache.StepCache.make_key('fp', tmranges[2])
+        cache.put_many([(key1, 1)])
+        db.put_many([(key2, 2)])
+        assert cache.get_many([key1, key2]) == {key1: 1, key2: 2}
+        assert mem.get_many([key2]) == {key2: 2}  # (promoted)
+        cache.clear()
+        assert cache.get_many([key1, key2]) == {}
+        assert cache.stats()['layers'][1]['size'] == 0
+        str(cache)
+        with pytest.raises(ValueError):
+            stepcache.LayeredStepCache([])
+        with pytest.raises(TypeError):
+            stepcache.LayeredStepCache(['Not StepCache'])
+
+    def test_mqengine(self, tmpdir):
+        path = str(tmpdir.join('steps.db'))
+        metset1 = load_metset( 'mqe-metset1.yml' )
+        query1 = load_query( 'mqe-query1.yml' )
+        query1.qtimeframe.tmfrspec.reframe_dt = dt('2013-08-15')
+        mds1 = mqengine.MQEngine( metset1,
+            stepcache=stepcache.SQLiteStepCache(path) ).query( query1 )
+        cache = stepcache.SQLiteStepCache(path)
+        mds2 = mqengine.MQEngine( metset1, stepcache=cache ).query( query1 )
+        stats = cache.stats()
+        assert 0 < stats['misses'] < stats['hits']  # (open steps missed)
+        for ds1, ds2 in zip(mds1.iter_series(), mds2.iter_series()):
+            if '_G_' not in ds1.id:
+                continue  # (only ghost series wholly closed)
+            values1 = [dp.value for dp in ds1.iter_points()]
+            values2 = [dp.value for dp in ds2.iter_points()]
+            assert values1 == values2
+
+
+# ----------------------------------------------------------------------------
+
+
+class TestDecompose(object):
+    """
+    Test MQEngine decomposition of overlapping steps.
+    """
+
+    #
+    # Setup / Teardown
+    #
+
+    def setup_method(self, method):
+        self.steps = [
+            TimeRange(inc_begin=dt('2014-01-01'), exc_end=dt('2014-01-03')),
+            TimeRange(inc_begin=dt('2014-01-02'), exc_end=dt('2014-01-04')),
+            TimeRange(inc_begin=dt('2014-01-03'), exc_end=dt('2014-01-05')),
+            TimeRange(inc_begin=dt('2014-01-07'), exc_end=dt('2014-01-08')),
+        ]
+
+    #
+    # Tests
+    #
+
+    def test_steps_overlap(self):
+        assert decompose.steps_overlap(self.steps)
+        assert not decompose.steps_overlap(self.steps[2:])
+
+    def test_elementary_ranges(self):
+        (ranges, spans) = decompose.elementary_ranges(self.steps)
+        assert [r.inc_begin.day for r in ranges] == [1, 2, 3, 4, 7]
+        assert [r.exc_end.day for r in ranges] == [2, 3, 4, 5, 8]
+        assert spans == [(0, 2), (1, 3), (2, 4), (4, 5)]
+
+    def test_combine(self):
+        spans = [(0, 2), (1, 3), (2, 4), (4, 5)]
+        values = [3, None, 5, 1, None]
+        assert decompose.combine_sums(values, spans) == [3, 5, 6, None]
+        assert decompose.combine_extremes(values, spans, 'MIN') == \
+            [3, 5, 1, None]
+        assert decompose.combine_extremes(values, spans, 'MAX') == \
+            [3, 5, 5, None]
+        assert decompose.combine_extremes(values, spans[::-1], 'MAX') == \
+            [None, 5, 5, 3]
+        assert decompose.combine_firstlast(values, spans, 'FIRST') == \
+            [3, 5, 5, None]
+        assert decompose.combine_firstlast(values, spans, 'LAST') == \
+            [3, 5, 1, None]
+        with pytest.raises(ValueError):
+            decompose.combine_firstlast(values, spans, 'SUM')
+        assert decompose.combine_avg([3, 6, None], [1, 2, 0],
+            [(0, 2), (1, 3), (2, 3)]) == [3.0, 3.0, None]
+        with pytest.raises(ValueError):
+            decompose.combine_extremes(values, spans, 'AVG')
+
+
+# ----------------------------------------------------------------------------
+
+
+class TestSingleFlight(object):
+    """
+    Test MQEngine single-flight coalescing.
+    """
+
+    #
+    # Setup / Teardown
+    #
+
+    def setup_method(self, method):
+        self.sflight = singleflight.SingleFlight()
+        self.called = list()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _slow_func(self, items):
+        self.called.append(list(items))
+        self.started.set()
+        self.release.wait()
+        if 'bad' in items:
+            raise KeyError("bad item")
+        return [item.upper() for item in items]
+
+    def _run_leader(self, items, results):
+        def _leader():
+            try:
+                results.append(self.sflight.do_many(
+                    self._slow_func, items, lambda x: x))
+            except KeyError as e:
+                results.append(e)
+        thread = threading.Thread(target=_leader)
+        thread.start()
+        self.started.wait()
+        return thread
+
+    #
+    # Tests
+    #
+
+    def test_coalesce(self):
+        results = list()
+        thread = self._run_leader(['a', 'b'], results)
+        threading.Timer(0.05, self.release.set).start()
+        assert self.sflight.do_many(self._slow_func, ['b', 'c', 'c'],
+            lambda x: x) == ['B', 'C', 'C']
+        thread.join()
+        assert results == [['A', 'B']]
+        assert self.called == [['a', 'b'], ['c']]
+        assert self.sflight.count_calls == 3
+        assert self.sflight.count_shared == 2
+        str(self.sflight)
+
+    def test_error(self):
+        results = list()
+        thread = self._run_leader(['bad'], results)
+        threading.Timer(0.05, self.release.set).start()
+        with pytest.raises(KeyError):
+            self.sflight.do_many(self._slow_func, ['bad'], lambda x: x)
+        thread.join()
+        assert isinstance(results[0], KeyError)
+        assert self.called == [['bad']]
+        self.release.set()
+        assert self.sflight.do_many(self._slow_func, ['ok'],
+            lambda x: x) == ['OK']
+
+    def test_cancelled(self):
+        results = list()
+        def _cancelled_func(items):
+            self.called.append(list(items))
+            self.started.set()
+            self.release.wait()
+            raise mqengine.FetchCancelled("deadline expired")
+        def _leader():
+            try:
+                self.sflight.do_many(_cancelled_func, ['a'], lambda x: x)
+            except mqengine.FetchCancelled as e:
+                results.append(e)
+        thread = threading.Thread(target=_leader)
+        thread.start()
+        self.started.wait()
+        threading.Timer(0.05, self.release.set).start()
+        assert self.sflight.do_many(self._slow_func, ['a', 'b'],
+            lambda x: x) == ['A', 'B']
+        thread.join()
+        assert isinstance(results[0], mqengine.FetchCancelled)
+        assert self.called == [['a'], ['b'], ['a']]
+        assert str(self.sflight) == "SingleFlight(0 in flight)"
+
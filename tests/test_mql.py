@@ -70,6 +70,13 @@ class TestQueryParse(object):
         assert tmfrspec1.accumulate == True
         assert tmfrspec1.allow_overflow_begin == False
         assert tmfrspec1.allow_overflow_end == True
+        assert tmfrspec1.timezone is None
+
+    def test_parse_qtimeframe_timezone(self):
+        qobj = yaml.load(self.yaml_query1)
+        qobj['timeframe']['timezone'] = 'America/New_York'
+        q = self.parser1.parse_ystr_query(yaml.dump(qobj))
+        assert q.qtimeframe.tmfrspec.timezone == 'America/New_York'
 
     def test_parse_missing_ok(self):
         missing_ok = [
@@ -106,6 +113,10 @@ class TestQueryParse(object):
         qobj['timeframe']['reframe_dt'] = 12345 # not datetime
         with pytest.raises(mql.MQLParseError):
             self.parser1.parse_ystr_query(yaml.dump(qobj))
+        del(qobj['timeframe']['reframe_dt'])
+        qobj['timeframe']['timezone'] = 'Mars/Olympus' # unknown
+        with pytest.raises(ValueError):
+            self.parser1.parse_ystr_query(yaml.dump(qobj))
         qobj['timeframe'] = 12345 # not dict
         with pytest.raises(mql.MQLParseError):
             self.parser1.parse_ystr_query(yaml.dump(qobj))
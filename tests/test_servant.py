@@ -19,6 +19,7 @@ from axonchisel.metrics.run.servant.config import ServantConfig
 from axonchisel.metrics.run.servant.request import ServantRequest
 from axonchisel.metrics.run.servant.state import ServantState
 from axonchisel.metrics.run.servant.servant import Servant
+from axonchisel.metrics.run.mqengine.mqengine import MQEngine
 
 from .util import dt, log_config, load_metset, load_queryset
 
@@ -81,6 +82,78 @@ class TestServant(object):
         servant = Servant(self.sconfig)
         servant.process(self.sreq)
 
+    def test_mqengine_opts(self):
+        self.sconfig.mqengine_opts = {'series_workers': 3, 'fetch_workers': 2}
+        servant = Servant(self.sconfig)
+        servant.process(self.sreq)
+        lines = self.buf1.getvalue().splitlines()
+        assert lines[0].startswith('query_id,series_id')
+        with pytest.raises(TypeError):
+            self.sconfig.mqengine_opts = 'Not dict'
+
+    def test_stream(self):
+        self.sreq.erout_plugin_ids = ['csv']
+        servant = Servant(self.sconfig)
+        servant.process(self.sreq)
+        lines1 = self.buf1.getvalue().splitlines()
+        self.sreq.erout_plugin_ids = ['strbuf', 'csv']
+        self.buf1.truncate(0)
+        servant.process(self.sreq)
+        lines2 = self.buf1.getvalue().splitlines()
+        assert len(lines1) == len(lines2)
+        assert [l.split(',')[:3] for l in lines1] == \
+            [l.split(',')[:3] for l in lines2]
+        self.sreq.erout_plugin_ids = ['csv']
+        self.sreq.collapse = True
+        self.buf1.truncate(0)
+        servant.process(self.sreq)
+        assert len(self.buf1.getvalue().splitlines()) == 10
+
+    def test_stream_no_erouts(self, monkeypatch):
+        def _query_stream(*args, **kwargs):
+            raise AssertionError("streamed with no EROuts")
+        monkeypatch.setattr(MQEngine, 'query_stream', _query_stream)
+        self.sreq.erout_plugin_ids = []
+        self.sreq.refresh = True
+        servant = Servant(self.sconfig)
+        servant.process(self.sreq)
+        assert len(servant._refreshable) == 3
+        assert self.buf1.getvalue() == ''
+
+    def test_refresh(self):
+        self.sreq.refresh = True
+        servant = Servant(self.sconfig)
+        servant.process(self.sreq)
+        lines1 = self.buf1.getvalue().splitlines()
+        assert len(servant._refreshable) == 3
+        self.buf1.truncate(0)
+        servant.process(self.sreq)
+        lines2 = self.buf1.getvalue().splitlines()
+        assert len(lines2) == len(lines1)
+        self.sreq.erout_plugin_ids = ['csv']
+        self.buf1.truncate(0)
+        servant.process(self.sreq)
+        assert len(self.buf1.getvalue().splitlines()) == len(lines1)
+        # (same query twice, streamed, keeps each result whole once:)
+        self.sreq.query_ids = ['new_users_r7d', 'new_users_r7d']
+        servant = Servant(self.sconfig)
+        servant.process(self.sreq)
+        (mdseries,) = servant._refreshable.values()
+        assert mdseries.count_series() == 3   # (primary and 2 ghosts)
+        assert ServantRequest.from_params({'refresh': '1'}).refresh
+        with pytest.raises(TypeError):
+            self.sreq.refresh = 'Not bool'
+
+    def test_mqengine_async(self):
+        self.sconfig.mqengine_async = True
+        self.sconfig.mqengine_opts = {'backend_limit': 2}
+        servant = Servant(self.sconfig)
+        servant.process(self.sreq)
+        lines = self.buf1.getvalue().splitlines()
+        assert lines[0].startswith('query_id,series_id')
+        with pytest.raises(TypeError):
+            self.sconfig.mqengine_async = 'Not bool'
+
     def test_collapse(self):
         servant = Servant(self.sconfig)
         self.sreq.collapse = True
@@ -103,7 +176,18 @@ class TestServant(object):
         sreq = ServantRequest.from_params(params)
         assert sreq.collapse == True
         assert sreq.noghosts == True
+        assert sreq.deadline is None
         servant.process(sreq)
+        params['deadline'] = '2.5'
+        sreq = ServantRequest.from_params(params)
+        assert sreq.deadline == 2.5
+        servant.process(sreq)
+        params['deadline'] = 'soon'
+        with pytest.raises(ValueError):
+            ServantRequest.from_params(params)
+        params['deadline'] = '-1'
+        with pytest.raises(ValueError):
+            ServantRequest.from_params(params)
 
     def test_state(self):
         sstate = ServantState()